@@ -0,0 +1,34 @@
+"""widen cache value for cached Open Library responses
+
+Revision ID: 3f9a1c2d7b40
+Revises: c6b7da6debc2
+Create Date: 2026-10-18 09:12:41.518203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9a1c2d7b40'
+down_revision: Union[str, None] = 'c6b7da6debc2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.alter_column('cache', 'value',
+               existing_type=sa.String(length=1024),
+               type_=sa.Text(),
+               existing_nullable=True)
+
+
+def downgrade() -> None:
+    # Oversized entries are disposable cache data; drop them before narrowing.
+    op.execute("DELETE FROM cache WHERE length(value) > 1024")
+    op.alter_column('cache', 'value',
+               existing_type=sa.Text(),
+               type_=sa.String(length=1024),
+               existing_nullable=True)
@@ -0,0 +1,66 @@
+"""add local full-text search index on items
+
+Revision ID: 5b7e0c93d1a2
+Revises: 8d2e4b61a9f3
+Create Date: 2026-10-18 13:41:52.530118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b7e0c93d1a2'
+down_revision: Union[str, None] = '8d2e4b61a9f3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+items = sa.table(
+    'items',
+    sa.column('id', sa.BigInteger),
+    sa.column('openlibrary_edition', sa.BigInteger),
+    sa.column('openlibrary_metadata', postgresql.JSONB),
+    sa.column('search_text', sa.Text),
+)
+
+
+def search_document(olid, metadata):
+    """Item.search_document as of this revision."""
+    metadata = metadata or {}
+    parts = [metadata.get("title")]
+    parts += [a.get("name") for a in metadata.get("authors") or []]
+    parts += metadata.get("subject") or []
+    parts += metadata.get("publisher") or []
+    parts += metadata.get("isbn") or []
+    parts += [f"OL{olid}M", (metadata.get("work_key") or "").rsplit("/", 1)[-1]]
+    return " ".join(str(p) for p in parts if p).lower()
+
+
+def upgrade() -> None:
+    op.add_column('items', sa.Column('search_text', sa.Text(), nullable=True))
+
+    # Backfill from metadata already stored by refresh_metadata
+    conn = op.get_bind()
+    rows = conn.execute(
+        sa.select(items.c.id, items.c.openlibrary_edition, items.c.openlibrary_metadata)
+        .where(items.c.openlibrary_metadata.isnot(None))
+    ).fetchall()
+    for row in rows:
+        conn.execute(
+            items.update().where(items.c.id == row.id)
+            .values(search_text=search_document(row.openlibrary_edition, row.openlibrary_metadata))
+        )
+
+    op.execute(
+        "CREATE INDEX idx_items_search_text ON items "
+        "USING gin (to_tsvector('simple', coalesce(search_text, '')))"
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('idx_items_search_text', table_name='items')
+    op.drop_column('items', 'search_text')
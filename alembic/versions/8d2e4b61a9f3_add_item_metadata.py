@@ -0,0 +1,29 @@
+"""add local Open Library metadata to items
+
+Revision ID: 8d2e4b61a9f3
+Revises: 3f9a1c2d7b40
+Create Date: 2026-10-18 10:03:17.204951
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d2e4b61a9f3'
+down_revision: Union[str, None] = '3f9a1c2d7b40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('items', sa.Column('openlibrary_metadata', postgresql.JSONB(astext_type=sa.Text()), nullable=True))
+    op.add_column('items', sa.Column('metadata_updated_at', sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('items', 'metadata_updated_at')
+    op.drop_column('items', 'openlibrary_metadata')
@@ -0,0 +1,42 @@
+"""one active loan per item and patron
+
+Revision ID: 9a4d1f7c3e28
+Revises: f3c8a2e61d57
+Create Date: 2026-10-18 20:14:37.205816
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9a4d1f7c3e28'
+down_revision: Union[str, None] = 'f3c8a2e61d57'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Close duplicate active loans left by concurrent borrows (keeping the
+    # oldest) and recount the copies they were holding
+    op.execute(
+        "UPDATE loans SET returned_at = CURRENT_TIMESTAMP "
+        "WHERE returned_at IS NULL AND id NOT IN ("
+        "SELECT min(id) FROM loans WHERE returned_at IS NULL "
+        "GROUP BY item_id, patron_email_hash)"
+    )
+    op.execute(
+        "UPDATE items SET active_loans = ("
+        "SELECT count(*) FROM loans "
+        "WHERE loans.item_id = items.id AND loans.returned_at IS NULL)"
+    )
+    op.create_index(
+        'uq_loans_item_patron_active', 'loans', ['item_id', 'patron_email_hash'],
+        unique=True, postgresql_where=sa.text('returned_at IS NULL'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('uq_loans_item_patron_active', table_name='loans')
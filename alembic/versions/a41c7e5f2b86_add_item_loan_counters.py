@@ -0,0 +1,35 @@
+"""add lendable copies and active loan counter to items
+
+Revision ID: a41c7e5f2b86
+Revises: 5b7e0c93d1a2
+Create Date: 2026-10-18 15:12:08.771340
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a41c7e5f2b86'
+down_revision: Union[str, None] = '5b7e0c93d1a2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('items', sa.Column('num_lendable_total', sa.Integer(), server_default=sa.text('1'), nullable=False))
+    op.add_column('items', sa.Column('active_loans', sa.Integer(), server_default=sa.text('0'), nullable=False))
+    op.execute(
+        "UPDATE items SET active_loans = ("
+        "SELECT count(*) FROM loans "
+        "WHERE loans.item_id = items.id AND loans.returned_at IS NULL)"
+    )
+    op.create_check_constraint('ck_items_active_loans_nonnegative', 'items', 'active_loans >= 0')
+
+
+def downgrade() -> None:
+    op.drop_constraint('ck_items_active_loans_nonnegative', 'items', type_='check')
+    op.drop_column('items', 'active_loans')
+    op.drop_column('items', 'num_lendable_total')
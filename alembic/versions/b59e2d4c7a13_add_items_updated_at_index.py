@@ -0,0 +1,25 @@
+"""add index on items.updated_at for catalog index refreshes
+
+Revision ID: b59e2d4c7a13
+Revises: e7d3f0a8c215
+Create Date: 2026-10-18 17:21:09.552184
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b59e2d4c7a13'
+down_revision: Union[str, None] = 'e7d3f0a8c215'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('idx_items_updated_at', 'items', ['updated_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('idx_items_updated_at', table_name='items')
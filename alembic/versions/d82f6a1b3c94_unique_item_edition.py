@@ -0,0 +1,44 @@
+"""make items.openlibrary_edition unique, merging duplicate items
+
+Revision ID: d82f6a1b3c94
+Revises: b59e2d4c7a13
+Create Date: 2026-10-18 17:48:31.204617
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd82f6a1b3c94'
+down_revision: Union[str, None] = 'b59e2d4c7a13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# The oldest item of each edition is kept
+KEEPERS = "SELECT min(id) FROM items GROUP BY openlibrary_edition"
+
+
+def upgrade() -> None:
+    # Move loans from duplicate items onto the kept item of their edition
+    op.execute(
+        "UPDATE loans SET item_id = ("
+        "SELECT min(keeper.id) FROM items keeper JOIN items dup "
+        "ON keeper.openlibrary_edition = dup.openlibrary_edition "
+        "WHERE dup.id = loans.item_id) "
+        f"WHERE item_id NOT IN ({KEEPERS})"
+    )
+    op.execute(f"DELETE FROM items WHERE id NOT IN ({KEEPERS})")
+    op.execute(
+        "UPDATE items SET active_loans = ("
+        "SELECT count(*) FROM loans "
+        "WHERE loans.item_id = items.id AND loans.returned_at IS NULL)"
+    )
+    op.drop_index('idx_items_openlibrary_edition', table_name='items')
+    op.create_index('idx_items_openlibrary_edition', 'items', ['openlibrary_edition'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('idx_items_openlibrary_edition', table_name='items')
+    op.create_index('idx_items_openlibrary_edition', 'items', ['openlibrary_edition'], unique=False)
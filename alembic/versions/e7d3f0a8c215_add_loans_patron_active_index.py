@@ -0,0 +1,29 @@
+"""add partial index on active loans by patron
+
+Revision ID: e7d3f0a8c215
+Revises: a41c7e5f2b86
+Create Date: 2026-10-18 16:02:44.318907
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7d3f0a8c215'
+down_revision: Union[str, None] = 'a41c7e5f2b86'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'idx_loans_patron_active', 'loans', ['patron_email_hash'],
+        unique=False, postgresql_where=sa.text('returned_at IS NULL'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('idx_loans_patron_active', table_name='loans')
@@ -0,0 +1,37 @@
+"""add rate_limits table for single-row OTP throttling counters
+
+Revision ID: f3c8a2e61d57
+Revises: d82f6a1b3c94
+Create Date: 2026-10-18 18:35:12.640118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3c8a2e61d57'
+down_revision: Union[str, None] = 'd82f6a1b3c94'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('rate_limits',
+    sa.Column('scope', sa.String(length=64), nullable=False),
+    sa.Column('key', sa.String(length=255), nullable=False),
+    sa.Column('hits', sa.Integer(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('scope', 'key'),
+    prefixes=['UNLOGGED']
+    )
+    op.create_index('idx_rate_limits_expires', 'rate_limits', ['expires_at'], unique=False)
+    # Attempts are no longer recorded as cache rows
+    op.execute("DELETE FROM cache WHERE scope LIKE 'otp:%'")
+
+
+def downgrade() -> None:
+    op.drop_index('idx_rate_limits_expires', table_name='rate_limits')
+    op.drop_table('rate_limits')
@@ -1,17 +1,33 @@
 #!/usr/bin/env python3
 
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from lenny.routes import api
+from lenny.core import database
+from lenny.core.openlibrary import OpenLibrary
+from lenny.core.maintenance import Maintenance
 from lenny.configs import OPTIONS
 from lenny import __version__ as VERSION
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open this worker's pooled database connections before taking traffic
+    database.warmup()
+    Maintenance.start()
+    yield
+    Maintenance.stop()
+    # Release pooled keep-alive connections to openlibrary.org
+    await OpenLibrary.aclose()
+    await database.adispose()
+
 app = FastAPI(
     title="Lenny API",
     description="Lenny: A Free, Open Source Lending System for Libraries",
     version=VERSION,
+    lifespan=lifespan,
 )
 
 # App-level CORS should be a setting, as to not
@@ -24,6 +40,14 @@ app.add_middleware(
     allow_headers=["Authorization", "Content-Type"],
 )
 
+@app.middleware("http")
+async def route_reads_to_replicas(request: Request, call_next):
+    # Each request starts reading from replicas until it writes, and
+    # doesn't see objects cached by earlier requests on this thread
+    database.use_replicas()
+    database.expire_session()
+    return await call_next(request)
+
 app.templates = Jinja2Templates(directory="lenny/templates")
 
 app.include_router(api.router, prefix="/v1/api")
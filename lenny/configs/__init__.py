@@ -38,6 +38,58 @@ READIUM_BASE_URL = f"http://lenny_readium:{READIUM_PORT}"
 
 LENNY_SEED = os.environ.get('LENNY_SEED')
 LOAN_LIMIT = int(os.environ.get('LENNY_LOAN_LIMIT', 10))
+# Copies of each newly uploaded item that can be on loan at once
+LENDABLE_COPIES = int(os.environ.get('LENNY_LENDABLE_COPIES', 1))
+
+# Open Library search responses are cached in the `cache` table: entries are
+# served fresh for OL_CACHE_TTL seconds, then served stale (and refreshed in
+# the background) for another OL_CACHE_STALE_TTL seconds. A TTL of 0 disables.
+OL_CACHE_TTL = int(os.environ.get('LENNY_OL_CACHE_TTL', 3600))
+OL_CACHE_STALE_TTL = int(os.environ.get('LENNY_OL_CACHE_STALE_TTL', 86400))
+# Where Cache keeps shared entries and rate limits: 'postgres' (the cache
+# and rate_limits tables), 'sqlite' (a file shared by the workers on this
+# host, at CACHE_URL) or 'redis' (CACHE_URL, needs the redis package)
+CACHE_BACKEND = os.environ.get('LENNY_CACHE_BACKEND', 'postgres').lower()
+CACHE_URL = os.environ.get('LENNY_CACHE_URL', '')
+# Rendered OPDS documents for anonymous requests are cached for
+# OPDS_CACHE_TTL seconds (0 disables), and dropped whenever the catalog
+# changes (upload, borrow, return)
+OPDS_CACHE_TTL = int(os.environ.get('LENNY_OPDS_CACHE_TTL', 0 if TESTING else 300))
+# Verified session tokens are remembered per worker (at most SESSION_CACHE_SIZE,
+# each for up to SESSION_CACHE_TTL seconds; 0 disables) so repeated requests,
+# e.g. a reader fetching a book's resources, skip re-verifying the signature.
+# SESSION_TOKEN_FORMAT picks how new sessions are signed: 'itsdangerous' or
+# 'compact' (a shorter binary HMAC token); both are always accepted.
+SESSION_CACHE_SIZE = int(os.environ.get('LENNY_SESSION_CACHE_SIZE', 10000))
+SESSION_CACHE_TTL = int(os.environ.get('LENNY_SESSION_CACHE_TTL', 60))
+SESSION_TOKEN_FORMAT = os.environ.get('LENNY_SESSION_TOKEN_FORMAT', 'itsdangerous').lower()
+# Expired cache entries and rate limit windows are purged in the background
+# once every MAINTENANCE_INTERVAL seconds (0 disables) by whichever worker
+# wakes first, at most MAINTENANCE_BATCH_SIZE rows per DELETE
+MAINTENANCE_INTERVAL = int(os.environ.get('LENNY_MAINTENANCE_INTERVAL', 300))
+MAINTENANCE_BATCH_SIZE = int(os.environ.get('LENNY_MAINTENANCE_BATCH_SIZE', 5000))
+# Per-worker cap on pooled (keep-alive) connections to openlibrary.org
+OL_MAX_CONNECTIONS = int(os.environ.get('LENNY_OL_MAX_CONNECTIONS', 20))
+# Circuit breaker: after OL_BREAKER_FAILURES consecutive errors or calls
+# slower than OL_BREAKER_LATENCY seconds, Open Library calls fail fast for
+# OL_BREAKER_RESET seconds and feeds fall back to local metadata.
+OL_BREAKER_FAILURES = int(os.environ.get('LENNY_OL_BREAKER_FAILURES', 5))
+OL_BREAKER_LATENCY = float(os.environ.get('LENNY_OL_BREAKER_LATENCY', 3.0))
+OL_BREAKER_RESET = float(os.environ.get('LENNY_OL_BREAKER_RESET', 30))
+
+# Item metadata is copied from Open Library at upload and refreshed once it
+# is older than METADATA_TTL seconds. With LOCAL_METADATA enabled, OPDS feeds
+# are rendered from these local copies instead of querying Open Library.
+METADATA_TTL = int(os.environ.get('LENNY_METADATA_TTL', 7 * 86400))
+LOCAL_METADATA = os.environ.get('LENNY_LOCAL_METADATA', 'false').lower() == 'true'
+
+# Max concurrent Open Library requests per /opds/search call
+SEARCH_CONCURRENCY = int(os.environ.get('LENNY_SEARCH_CONCURRENCY', 4))
+# Where /opds/search matches: 'openlibrary' (upstream, constrained to our
+# editions) or 'local' (full-text index over the items' local metadata)
+SEARCH_BACKEND = os.environ.get('LENNY_SEARCH_BACKEND', 'openlibrary').lower()
+# Seconds between incremental refreshes of each worker's in-memory catalog index
+CATALOG_REFRESH_INTERVAL = float(os.environ.get('LENNY_CATALOG_REFRESH_INTERVAL', 5))
 
 OPTIONS = {
     'host': HOST,
@@ -64,6 +116,34 @@ DB_URI = (
     "sqlite:///:memory:" if TESTING else
     'postgresql+psycopg2://{user}:{password}@{host}:{port}/{dbname}'.format(**DB_CONFIG)
 )            
+# Optional comma-separated read-replica URIs. Read-only queries are spread
+# across them; writes, and reads after a write in the same request, use DB_URI
+DB_REPLICA_URIS = [uri.strip() for uri in os.environ.get('LENNY_DB_REPLICA_URIS', '').split(',') if uri.strip()]
+# With DB_ASYNC, route handlers borrow/return/look up items on an asyncpg
+# engine (created on first use) instead of blocking the event loop
+DB_ASYNC = os.environ.get('LENNY_DB_ASYNC', 'false' if TESTING else 'true').lower() == 'true'
+ASYNC_DB_URI = (
+    "sqlite+aiosqlite:///:memory:" if TESTING else
+    'postgresql+asyncpg://{user}:{password}@{host}:{port}/{dbname}'.format(**DB_CONFIG)
+)
+
+# Per-process connection pools. The primary database gets up to
+# LENNY_WORKERS * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections from the sync
+# engine, plus LENNY_WORKERS * (DB_ASYNC_POOL_SIZE + DB_ASYNC_MAX_OVERFLOW)
+# from the async engine with DB_ASYNC; each replica gets the sync amount.
+# Checkouts wait up to DB_POOL_TIMEOUT seconds; connections are replaced
+# after DB_POOL_RECYCLE seconds and, with DB_POOL_PRE_PING, tested before use.
+DB_POOL_SIZE = int(os.environ.get('LENNY_DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('LENNY_DB_MAX_OVERFLOW', 10))
+DB_ASYNC_POOL_SIZE = int(os.environ.get('LENNY_DB_ASYNC_POOL_SIZE', 5))
+DB_ASYNC_MAX_OVERFLOW = int(os.environ.get('LENNY_DB_ASYNC_MAX_OVERFLOW', 5))
+DB_POOL_TIMEOUT = float(os.environ.get('LENNY_DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(os.environ.get('LENNY_DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = os.environ.get('LENNY_DB_POOL_PRE_PING', 'true').lower() == 'true'
+# Server-side statement_timeout in milliseconds (0 disables)
+DB_STATEMENT_TIMEOUT = int(os.environ.get('LENNY_DB_STATEMENT_TIMEOUT', 30000))
+# Connections each worker opens at startup, so first requests don't pay for them
+DB_POOL_WARMUP = int(os.environ.get('LENNY_DB_POOL_WARMUP', DB_POOL_SIZE))
 
 # MinIO configuration
 S3_CONFIG = {
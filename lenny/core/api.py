@@ -1,16 +1,23 @@
 from pathlib import Path
 from typing import Optional
+from datetime import datetime, timezone
 from fastapi import UploadFile, Request
 from botocore.exceptions import ClientError
+import logging
 import socket
 import ipaddress
+import threading
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor
 from pyopds2_lenny import LennyDataProvider, LennyDataRecord, build_post_borrow_publication
 from pyopds2 import Catalog, Metadata
-from pyopds2.models import Link, Navigation
+from pyopds2.models import Link, Navigation, Contributor, Publication
 from lenny.core import db, s3, auth
-from lenny.core.utils import hash_email
+from lenny.core.utils import run_in_background, encode_cursor, decode_cursor
 from lenny.core.models import Item, FormatEnum, Loan
 from lenny.core.openlibrary import OpenLibrary
+from lenny.core.catalog import CatalogIndex
+from lenny.core.cache import ResponseCache
 from lenny.core.exceptions import (
     ItemExistsError,
     InvalidFileError,
@@ -20,15 +27,24 @@ from lenny.core.exceptions import (
     UploaderNotAllowedError,
     EmailNotFoundError,
     ItemNotFoundError,
-    LoanNotFoundError
+    LoanNotFoundError,
+    CircuitOpenError
 )
 
 from lenny.configs import (
     SCHEME, HOST, PORT, PROXY,
-    READER_PORT, LOAN_LIMIT, AUTH_MODE_DIRECT
+    READER_PORT, LOAN_LIMIT, AUTH_MODE_DIRECT,
+    METADATA_TTL, LOCAL_METADATA, SEARCH_CONCURRENCY, SEARCH_BACKEND,
+    DB_ASYNC
 )
 from urllib.parse import quote
 
+logger = logging.getLogger(__name__)
+
+# Set while building a feed that had to leave out Open Library data; see
+# LennyAPI.feed_degraded
+_feed_degraded = ContextVar('lenny_feed_degraded', default=False)
+
 def _make_url(path):
     if PROXY:
         return f"{PROXY}{path}"
@@ -50,7 +66,13 @@ class LennyAPI:
     }
     SEARCH_BATCH_SIZE = 250
     SEARCH_MAX_RESULTS = 100
+    SEARCH_CONCURRENCY = SEARCH_CONCURRENCY
+    SEARCH_BACKEND = SEARCH_BACKEND
+    DB_ASYNC = DB_ASYNC
+    METADATA_FIELDS = ['subject']
     Item = Item
+    _refreshing = set()
+    _refreshing_lock = threading.Lock()
     
     @classmethod
     def make_manifest_url(cls, book_id):
@@ -73,6 +95,21 @@ class LennyAPI:
         """
         Checks if the user is allowed to access the book.
         """
+        result = cls._check_session(item, session=session, request=request)
+        if 'email' in result and not item.borrow(result['email']):
+            return cls._borrow_required(item)
+        return result
+
+    @classmethod
+    async def aauth_check(cls, item, session: str=None, request: Request=None):
+        """auth_check for async route handlers (borrows via aborrow)."""
+        result = cls._check_session(item, session=session, request=request)
+        if 'email' in result and not await cls.aborrow(item, result['email']):
+            return cls._borrow_required(item)
+        return result
+
+    @classmethod
+    def _check_session(cls, item, session: str=None, request: Request=None):
         success = {"success": "authenticated"}
         ip = request.client.host
         redir = request.url.path
@@ -88,13 +125,42 @@ class LennyAPI:
                 }
             email = email_data.get("email") if isinstance(email_data, dict) else email_data
             success['email'] = email
-            if not (loan := item.borrow(email)):
-                return {
-                    "error": "unauthorized",
-                    "url": f"/v1/api/items/{item.openlibrary_edition}/borrow",
-                    "message": "Book must be borrowed before being read"
-                }
         return success
+
+    @classmethod
+    def _borrow_required(cls, item):
+        return {
+            "error": "unauthorized",
+            "url": f"/v1/api/items/{item.openlibrary_edition}/borrow",
+            "message": "Book must be borrowed before being read"
+        }
+
+    @classmethod
+    async def aget_item(cls, olid):
+        """Item.exists for async route handlers; with DB_ASYNC the lookup
+        runs on the async engine instead of blocking the event loop."""
+        if cls.DB_ASYNC:
+            # asyncpg won't coerce path strings (e.g. "123") to BIGINT
+            try:
+                olid = int(olid)
+            except (TypeError, ValueError):
+                return None
+            return await Item.aexists(olid)
+        return Item.exists(olid)
+
+    @classmethod
+    async def aborrow(cls, item, email):
+        """item.borrow for async route handlers (see aget_item)."""
+        if cls.DB_ASYNC:
+            return await item.aborrow(email)
+        return item.borrow(email)
+
+    @classmethod
+    async def areturn(cls, item, email):
+        """item.unborrow for async route handlers (see aget_item)."""
+        if cls.DB_ASYNC:
+            return await item.aunborrow(email)
+        return item.unborrow(email)
     
     @classmethod
     def make_session_cookie(cls, email: str):
@@ -110,36 +176,71 @@ class LennyAPI:
         return None
 
     @classmethod
-    def _enrich_items(cls, items, fields=None, limit=None):
+    def _enrich_items(cls, items, fields=None, limit=None, profile=None):
         imap = dict((i.openlibrary_edition, i) for i in items)
-        olids = [f"OL{i}M" for i in imap.keys()]
-        if olids:
-            q = f"edition_key:({' OR '.join(olids)})"
+        if imap:
+            q = cls._edition_query(imap.keys())
             return dict((
                 int(book.olid),
                 book + {"lenny": imap[int(book.olid)]}
-            ) for book in OpenLibrary.search(query=q, fields=fields))
+            ) for book in OpenLibrary.search(query=q, fields=fields, profile=profile))
         return {}
     
     @classmethod
-    def get_enriched_items(cls, olid=None, fields=None, offset=None, limit=None, encrypted=None):
+    def get_enriched_items(cls, olid=None, fields=None, offset=None, limit=None, encrypted=None, profile=None):
         """Returns a dict whose keys are int `olid` Open Library
         edition IDs and whose values are OpenLibraryRecords with an
         additional `lenny` field containing Lenny's record for this
-        item in the LennyDB
+        item in the LennyDB. `profile` names an OpenLibrary.FIELD_PROFILES
+        projection (default 'full').
         """
-        limit = limit or cls.DEFAULT_LIMIT
-        items = [Item.exists(olid)] if olid else Item.get_many(offset=offset, limit=limit, encrypted=encrypted)
-        return cls._enrich_items(items, fields=fields)
+        items = cls.get_items(olid=olid, offset=offset, limit=limit, encrypted=encrypted)
+        return cls._enrich_items(items, fields=fields, profile=profile)
+
+    @classmethod
+    async def _aenrich_items(cls, items, fields=None, profile=None):
+        imap = dict((i.openlibrary_edition, i) for i in items)
+        if imap:
+            q = cls._edition_query(imap.keys())
+            return dict([
+                (int(book.olid), book + {"lenny": imap[int(book.olid)]})
+                async for book in OpenLibrary.asearch(query=q, fields=fields, profile=profile)
+            ])
+        return {}
+
+    @classmethod
+    async def aget_enriched_items(cls, olid=None, fields=None, offset=None, limit=None, encrypted=None, profile=None):
+        """Async counterpart of `get_enriched_items`: the Open Library
+        fetch runs on the shared AsyncClient and doesn't block the worker.
+        """
+        items = cls.get_items(olid=olid, offset=offset, limit=limit, encrypted=encrypted)
+        return await cls._aenrich_items(items, fields=fields, profile=profile)
 
     @classmethod
-    def opds_feed(cls, olid=None, offset=None, limit=None, query=None, auth_mode_direct=None, email=None):
+    async def aget_enriched_page(cls, cursor=None, fields=None, limit=None, encrypted=None, profile=None):
+        """Keyset-paginated `aget_enriched_items`: returns the enriched
+        records and the {"next", "previous"} cursors (see get_items_page).
+        """
+        items, cursors = cls.get_items_page(cursor=cursor, limit=limit, encrypted=encrypted)
+        return await cls._aenrich_items(items, fields=fields, profile=profile), cursors
+
+    @classmethod
+    def opds_feed(cls, olid=None, offset=None, limit=None, query=None, auth_mode_direct=None, email=None, local=None, cursor=None):
         """
         Generate an OPDS 2.0 catalog using the opds2 Catalog.create helper
         and the LennyDataProvider to transform Open Library metadata into
         OPDS Publications with Lenny borrow/return links.
+
+        Catalog pages are keyset-paginated with opaque `cursor`s in their
+        next/previous links; an explicit `offset` pages the old way.
+
+        With `local` (default: LENNY_LOCAL_METADATA) publications are
+        built from the metadata stored on each Item instead. While the
+        Open Library circuit breaker is open, the local metadata feed is
+        served regardless, omitting items that have none yet.
         """
         use_direct = auth_mode_direct if auth_mode_direct is not None else AUTH_MODE_DIRECT
+        _feed_degraded.set(False)
 
         # If requesting single item and user is authenticated, check for active loan
         if olid and email:
@@ -148,72 +249,303 @@ class LennyAPI:
                     return build_post_borrow_publication(olid, auth_mode_direct=use_direct)
 
         limit = limit or cls.DEFAULT_LIMIT
+        # Lenny's own rows are all the provider needs besides Open Library
+        # metadata, which it fetches itself: one upstream query per page.
+        cursors = None
+        if olid or offset is not None:
+            items = cls.get_items(olid=olid, offset=offset, limit=limit)
+        else:
+            items, cursors = cls.get_items_page(cursor=cursor, limit=limit)
         offset = offset or 0
-        items = cls.get_enriched_items(olid=olid, offset=offset, limit=limit)
+
+        if LOCAL_METADATA if local is None else local:
+            feed = cls._local_opds_feed(
+                items, olid=olid, offset=offset, limit=limit, auth_mode_direct=use_direct, cursors=cursors
+            )
+            if feed is not None:
+                return feed
+
         if not items:
             return LennyDataProvider.empty_catalog(limit=limit, auth_mode_direct=use_direct)
-        query, lenny_ids, total = cls._build_query_and_lenny_ids(items)
-        lenny_ids_map = {k: v for k, v in zip(items.keys(), lenny_ids) if v is not None}
-        lenny_ids_arg = lenny_ids_map if lenny_ids_map else None
-        
-        # Build maps for each item's encryption and availability status
-        encryption_map = {}
-        borrowable_map = {}
-        
-        for rec in items.values():
-            lenny_item = getattr(rec, "lenny", None)
-            if lenny_item is None:
-                continue
-            try:
-                edition_id = int(lenny_item.openlibrary_edition)
-                encryption_map[edition_id] = lenny_item.encrypted
-                borrowable_map[edition_id] = lenny_item.is_borrowable
-            except (AttributeError, TypeError, ValueError):
-                continue
 
-        search_response = LennyDataProvider.search(
-            query=query,
-            limit=limit,
-            offset=offset,
-            lenny_ids=lenny_ids_arg,
-            encryption_map=encryption_map,
-            borrowable_map=borrowable_map,
-        )
+        query = cls._edition_query(i.openlibrary_edition for i in items)
+        lenny_ids_arg = {i.openlibrary_edition: i.openlibrary_edition for i in items}
+        encryption_map = {i.openlibrary_edition: i.encrypted for i in items}
+        borrowable_map = Item.borrowable_map(items)
+
+        try:
+            with OpenLibrary.BREAKER.track():
+                search_response = LennyDataProvider.search(
+                    query=query,
+                    limit=limit,
+                    offset=offset,
+                    lenny_ids=lenny_ids_arg,
+                    encryption_map=encryption_map,
+                    borrowable_map=borrowable_map,
+                )
+        except CircuitOpenError:
+            _feed_degraded.set(True)
+            return cls._local_opds_feed(
+                items, olid=olid, offset=offset, limit=limit, auth_mode_direct=use_direct,
+                partial=True, cursors=cursors,
+            )
 
         for record in search_response.records:
             if isinstance(record, LennyDataRecord):
                 record.auth_mode_direct = use_direct
         
         if olid:
+            if not search_response.records:
+                return LennyDataProvider.empty_catalog(limit=limit, auth_mode_direct=use_direct)
             return LennyDataProvider.build_publication(search_response.records[0], auth_mode_direct=use_direct)
         
-        return LennyDataProvider.build_catalog(search_response, auth_mode_direct=use_direct)
+        catalog = LennyDataProvider.build_catalog(search_response, auth_mode_direct=use_direct)
+        if cursors is not None:
+            cls._set_cursor_links(catalog, "/v1/api/opds", cursors, limit, use_direct)
+        return catalog
+
+    @classmethod
+    def feed_degraded(cls):
+        """True if the last opds_feed or search_feed call in this context
+        built a partial feed because Open Library was unavailable (such
+        feeds shouldn't be cached)."""
+        return _feed_degraded.get()
+
+    @classmethod
+    def get_items(cls, olid=None, offset=None, limit=None, encrypted=None):
+        """Returns the Lenny Items for one edition or for a page of the catalog."""
+        if olid:
+            item = Item.exists(olid)
+            return [item] if item else []
+        return Item.get_many(offset=offset, limit=limit or cls.DEFAULT_LIMIT, encrypted=encrypted)
+
+    @classmethod
+    def get_items_page(cls, cursor=None, limit=None, encrypted=None):
+        """Keyset page of Items in id order, starting from an opaque
+        `cursor` (the first page if None). Returns `(items, cursors)`
+        where cursors is {"next": ..., "previous": ...}, None at either
+        end. Raises InvalidCursorError for a malformed cursor.
+        """
+        limit = limit or cls.DEFAULT_LIMIT
+        direction, item_id = decode_cursor(cursor) if cursor else ("after", None)
+        # One extra row tells us whether there is a further page
+        if direction == "before":
+            items = Item.get_page(before=item_id, limit=limit + 1, encrypted=encrypted)
+            more, items = len(items) > limit, items[-limit:]
+            has_next, has_previous = True, more
+        else:
+            items = Item.get_page(after=item_id, limit=limit + 1, encrypted=encrypted)
+            more, items = len(items) > limit, items[:limit]
+            has_next, has_previous = more, item_id is not None
+        return items, {
+            "next": encode_cursor("after", items[-1].id) if items and has_next else None,
+            "previous": encode_cursor("before", items[0].id) if items and has_previous else None,
+        }
+
+    @classmethod
+    def _set_cursor_links(cls, catalog, path, cursors, limit, auth_mode_direct=False):
+        """Replaces a catalog's next/previous links with keyset cursor links."""
+        links = [l for l in catalog.get("links", []) if l.get("rel") not in {"next", "previous", "prev"}]
+        for rel, cursor in cursors.items():
+            if cursor:
+                query = f"cursor={cursor}&limit={limit}"
+                if auth_mode_direct:
+                    query += "&auth_mode=direct"
+                links.append({
+                    "rel": rel,
+                    "href": cls.make_url(f"{path}?{query}"),
+                    "type": "application/opds+json",
+                })
+        catalog["links"] = links
+
+    @classmethod
+    def _edition_query(cls, olids):
+        """Open Library query matching the given int edition ids."""
+        return f"edition_key:({' OR '.join(f'OL{olid}M' for olid in olids)})"
+
+    @classmethod
+    def _local_opds_feed(cls, items, olid=None, offset=0, limit=None, auth_mode_direct=False, partial=False, cursors=None):
+        """Builds the feed for a page of `items` from the metadata stored
+        on each Item. Returns None if an item has no local metadata yet;
+        it is queued for a background refresh and the caller falls back
+        to Open Library. With `partial`, such items are left out instead.
+        """
+        if not OpenLibrary.BREAKER.is_open:
+            cls._schedule_metadata_refresh([i.openlibrary_edition for i in items if cls._is_metadata_stale(i)])
+        described = [i for i in items if i.openlibrary_metadata is not None]
+        if len(described) < len(items) and not partial:
+            return None
+        if not described:
+            return LennyDataProvider.empty_catalog(limit=limit, auth_mode_direct=auth_mode_direct)
+
+        borrowable = Item.borrowable_map(described)
+        publications = [
+            cls._local_publication(i, auth_mode_direct=auth_mode_direct, borrowable=borrowable[i.openlibrary_edition])
+            for i in described
+        ]
+        if olid:
+            return publications[0]
+
+        catalog = LennyDataProvider.empty_catalog(limit=limit, auth_mode_direct=auth_mode_direct)
+        catalog["publications"] = publications
+        if cursors is not None:
+            cls._set_cursor_links(catalog, "/v1/api/opds", cursors, limit, auth_mode_direct)
+        elif len(items) == limit:
+            cls._add_next_link(catalog, "/v1/api/opds", offset + limit, limit, auth_mode_direct)
+        return catalog
+
+    @classmethod
+    def _add_next_link(cls, catalog, path, offset, limit, auth_mode_direct=False, **params):
+        """Appends a rel=next link for the following page to a catalog dict."""
+        query = "&".join(f"{k}={quote(str(v))}" for k, v in params.items())
+        query += f"{'&' if query else ''}offset={offset}&limit={limit}"
+        if auth_mode_direct:
+            query += "&auth_mode=direct"
+        catalog.setdefault("links", []).append({
+            "rel": "next",
+            "href": cls.make_url(f"{path}?{query}"),
+            "type": "application/opds+json",
+        })
+
+    @classmethod
+    def _local_publication(cls, item, auth_mode_direct=False, borrowable=None, borrowed=False):
+        """Renders an OPDS publication from the Item's local metadata,
+        with the same Lenny acquisition links the provider would emit.
+        """
+        meta = item.openlibrary_metadata or {}
+        olid = item.openlibrary_edition
+        suffix = "?auth_mode=direct" if auth_mode_direct else ""
+        links = [Link(
+            rel="self",
+            href=cls.make_url(f"/v1/api/opds/{olid}{suffix}"),
+            type="application/opds-publication+json",
+        )]
+        if borrowed:
+            links += [
+                Link(
+                    rel="http://opds-spec.org/acquisition",
+                    href=cls.make_url(f"/v1/api/items/{olid}/read"),
+                    type="text/html",
+                ),
+                Link(
+                    rel="http://librarysimplified.org/terms/rel/revoke",
+                    href=cls.make_url(f"/v1/api/items/{olid}/return{suffix}"),
+                    type="application/opds-publication+json",
+                ),
+            ]
+        elif item.is_lendable:
+            borrowable = item.is_borrowable if borrowable is None else borrowable
+            links.append(Link(
+                rel="http://opds-spec.org/acquisition/borrow",
+                href=cls.make_url(f"/v1/api/items/{olid}/borrow{suffix}"),
+                type="application/opds-publication+json",
+                properties={"availability": {"state": "available" if borrowable else "unavailable"}},
+            ))
+        else:
+            links.append(Link(
+                rel="http://opds-spec.org/acquisition/open-access",
+                href=cls.make_url(f"/v1/api/items/{olid}/read"),
+                type="text/html",
+            ))
+
+        authors = [
+            Contributor(
+                name=a["name"],
+                identifier=f"https://openlibrary.org/authors/{a['key']}" if a.get("key") else None,
+            )
+            for a in meta.get("authors") or [] if a.get("name")
+        ]
+        metadata = Metadata(
+            title=meta.get("title") or f"OL{olid}M",
+            identifier=f"https://openlibrary.org/books/OL{olid}M",
+            type="http://schema.org/Book",
+            author=authors or None,
+            language=meta.get("language") or None,
+            publisher=[Contributor(name=p) for p in meta.get("publisher") or []] or None,
+            subject=meta.get("subject") or None,
+        )
+        images = [Link(
+            href=f"{OpenLibrary.COVER_SERVER}/b/id/{meta['cover_i']}-M.jpg",
+            type="image/jpeg",
+        )] if meta.get("cover_i") else None
+        return Publication(metadata=metadata, links=links, images=images).model_dump(
+            by_alias=True, exclude_none=True
+        )
+
+    @classmethod
+    def _is_metadata_stale(cls, item):
+        updated = item.metadata_updated_at
+        if item.openlibrary_metadata is None or updated is None:
+            return True
+        if updated.tzinfo is None:
+            updated = updated.replace(tzinfo=timezone.utc)
+        return (datetime.now(timezone.utc) - updated).total_seconds() > METADATA_TTL
 
     @classmethod
-    def _build_query_and_lenny_ids(cls, items):
-        """Create Open Library query and determine lenny_ids alignment."""
-        olids = [f"OL{olid}M" for olid in items.keys()]
-        query = f"edition_key:({' OR '.join(olids)})" if olids else ""
-        lenny_ids: list[Optional[int]] = []
-        for olid, rec in items.items():
+    def refresh_metadata(cls, olids=None, limit=None):
+        """Copies Open Library metadata onto Items so feeds can be built
+        locally. Defaults to items whose copy is missing or older than
+        METADATA_TTL. Returns the number of items updated.
+        """
+        if olids:
+            items = Item.get_by_editions(olids)
+        else:
+            items = Item.get_stale_metadata(METADATA_TTL, limit=limit or cls.SEARCH_BATCH_SIZE)
+
+        # Fetch every batch before assigning: the Open Library cache shares
+        # db and may roll it back, discarding changes made in between
+        records = []
+        for i in range(0, len(items), cls.SEARCH_BATCH_SIZE):
+            records += cls._enrich_items(items[i:i + cls.SEARCH_BATCH_SIZE], fields=cls.METADATA_FIELDS).values()
+
+        now = datetime.now(timezone.utc)
+        for record in records:
+            metadata = record.to_metadata()
+            record.lenny.openlibrary_metadata = metadata
+            record.lenny.search_text = Item.search_document(record.lenny.openlibrary_edition, metadata)
+            record.lenny.metadata_updated_at = now
+        try:
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            raise DatabaseInsertError(f"Failed to store item metadata: {str(e)}.")
+        return len(records)
+
+    @classmethod
+    def _schedule_metadata_refresh(cls, olids):
+        """Refreshes metadata for `olids` in a background thread, skipping
+        editions that already have a refresh in flight.
+        """
+        with cls._refreshing_lock:
+            olids = [o for o in olids if o not in cls._refreshing]
+            cls._refreshing.update(olids)
+        if not olids:
+            return
+
+        def refresh():
             try:
-                lenny_ids.append(int(getattr(rec, "lenny").openlibrary_edition))
-            except Exception:
-                lenny_ids.append(int(olid) if isinstance(olid, int) else None)
-        total = len(lenny_ids)
-        return query, lenny_ids, total
+                cls.refresh_metadata(olids)
+            finally:
+                with cls._refreshing_lock:
+                    cls._refreshing.difference_update(olids)
+
+        run_in_background(refresh)
 
     @classmethod
-    def search_feed(cls, query=None, limit=None, auth_mode_direct=None):
+    def search_feed(cls, query=None, limit=None, auth_mode_direct=None, offset=None):
         """
         Search Lenny's catalog via OpenLibrary, constrained to local edition IDs.
 
-        Chunks all local edition IDs into batches, queries OL with
-        '{query} AND edition_key:(OL1M OR OL2M OR ...)' per batch,
-        and stops once enough results are collected.
+        Chunks all local edition IDs (from the in-memory CatalogIndex)
+        into batches, queries OL with
+        '{query} AND edition_key:(OL1M OR OL2M OR ...)' per batch
+        (SEARCH_CONCURRENCY at a time), and stops once `offset + limit`
+        results are collected. With SEARCH_BACKEND 'local' the local full-text
+        index is used instead (see _local_search_feed).
         """
         use_direct = auth_mode_direct if auth_mode_direct is not None else AUTH_MODE_DIRECT
         limit = min(limit or cls.DEFAULT_LIMIT, cls.SEARCH_MAX_RESULTS)
+        _feed_degraded.set(False)
 
         if not query or not query.strip():
             return LennyDataProvider.empty_catalog(
@@ -221,80 +553,155 @@ class LennyAPI:
             )
 
         query = query.strip()
-        all_items = Item.get_all()
-        if not all_items:
+        if cls.SEARCH_BACKEND == "local" or OpenLibrary.BREAKER.is_open:
+            if cls.SEARCH_BACKEND != "local":
+                _feed_degraded.set(True)
+            return cls._local_search_feed(query, offset=offset or 0, limit=limit, auth_mode_direct=use_direct)
+
+        # Sorted edition ids from this worker's in-memory index, so no
+        # ORM objects are built for items that don't match
+        editions = CatalogIndex.editions()
+        if not editions:
             return LennyDataProvider.empty_catalog(
                 title=f"Search results for: {query}", auth_mode_direct=use_direct
             )
 
-        olid_list = list(all_items.keys())
         batches = [
-            olid_list[i:i + cls.SEARCH_BATCH_SIZE]
-            for i in range(0, len(olid_list), cls.SEARCH_BATCH_SIZE)
+            editions[i:i + cls.SEARCH_BATCH_SIZE]
+            for i in range(0, len(editions), cls.SEARCH_BATCH_SIZE)
         ]
 
-        collected = []
-        for batch in batches:
-            edition_keys = " OR ".join(f"OL{olid}M" for olid in batch)
-            ol_query = f"{query} AND edition_key:({edition_keys})"
-
-            for record in OpenLibrary.search(query=ol_query, limit=cls.SEARCH_BATCH_SIZE):
-                collected.append(record)
-                if len(collected) >= limit:
-                    break
-
-            if len(collected) >= limit:
-                break
+        # Failed or rejected batches just return no records
+        offset = offset or 0
+        errors = OpenLibrary.BREAKER.errors
+        collected = cls._search_batches(query, batches, offset + limit)[offset:]
+        if OpenLibrary.BREAKER.errors != errors:
+            _feed_degraded.set(True)
 
         if not collected:
             return LennyDataProvider.empty_catalog(
                 title=f"Search results for: {query}", auth_mode_direct=use_direct
             )
 
-        matched_query_parts = []
-        lenny_ids_map = {}
-        encryption_map = {}
-        borrowable_map = {}
-
+        matched_olids = []
         for record in collected:
             try:
                 olid_int = int(record.olid)
             except (AttributeError, ValueError, TypeError):
                 continue
+            if CatalogIndex.contains(olid_int):
+                matched_olids.append(olid_int)
+
+        # Only the matched items are loaded (the index may briefly list an
+        # item that has since been removed)
+        items = {item.openlibrary_edition: item for item in Item.get_by_editions(matched_olids)} if matched_olids else {}
 
-            item = all_items.get(olid_int)
+        matched_query_parts = []
+        matched_items = []
+        lenny_ids_map = {}
+        encryption_map = {}
+
+        for olid_int in matched_olids:
+            item = items.get(olid_int)
             if not item:
                 continue
 
             matched_query_parts.append(f"OL{olid_int}M")
             lenny_ids_map[olid_int] = olid_int
             encryption_map[olid_int] = item.encrypted
-            borrowable_map[olid_int] = item.is_borrowable
+            matched_items.append(item)
 
         if not matched_query_parts:
             return LennyDataProvider.empty_catalog(
                 title=f"Search results for: {query}", auth_mode_direct=use_direct
             )
+        borrowable_map = Item.borrowable_map(matched_items)
 
         # Re-query via LennyDataProvider to get properly structured records
         provider_query = f"edition_key:({' OR '.join(matched_query_parts)})"
-        search_response = LennyDataProvider.search(
-            query=provider_query,
-            limit=limit,
-            lenny_ids=lenny_ids_map,
-            encryption_map=encryption_map,
-            borrowable_map=borrowable_map,
-        )
+        try:
+            with OpenLibrary.BREAKER.track():
+                search_response = LennyDataProvider.search(
+                    query=provider_query,
+                    limit=limit,
+                    lenny_ids=lenny_ids_map,
+                    encryption_map=encryption_map,
+                    borrowable_map=borrowable_map,
+                )
+        except CircuitOpenError:
+            _feed_degraded.set(True)
+            catalog = cls._local_opds_feed(
+                matched_items, limit=limit, auth_mode_direct=use_direct, partial=True, cursors={},
+            )
+            catalog.setdefault("metadata", {})["title"] = f"Search results for: {query}"
+            if len(collected) == limit:
+                cls._add_next_link(catalog, "/v1/api/opds/search", offset + limit, limit,
+                                   use_direct, query=query)
+            return catalog
 
         for record in search_response.records:
             if isinstance(record, LennyDataRecord):
                 record.auth_mode_direct = use_direct
 
-        return LennyDataProvider.build_catalog(
+        catalog = LennyDataProvider.build_catalog(
             search_response,
             title=f"Search results for: {query}",
             auth_mode_direct=use_direct,
         )
+        if len(collected) == limit:
+            catalog["links"] = [l for l in catalog.get("links", []) if l.get("rel") != "next"]
+            cls._add_next_link(catalog, "/v1/api/opds/search", offset + limit, limit,
+                               use_direct, query=query)
+        return catalog
+
+    @classmethod
+    def _local_search_feed(cls, query, offset=0, limit=None, auth_mode_direct=False):
+        """Ranked, paginated search over Item.search_text, rendered from
+        local metadata without any Open Library calls. Items are indexed
+        when their metadata is refreshed (see refresh_metadata).
+        """
+        items = Item.search(query, offset=offset, limit=limit)
+        catalog = LennyDataProvider.empty_catalog(
+            title=f"Search results for: {query}", auth_mode_direct=auth_mode_direct
+        )
+        borrowable = Item.borrowable_map(items)
+        catalog["publications"] = [
+            cls._local_publication(item, auth_mode_direct=auth_mode_direct, borrowable=borrowable[item.openlibrary_edition])
+            for item in items
+        ]
+        if len(items) == limit:
+            cls._add_next_link(catalog, "/v1/api/opds/search", offset + limit, limit,
+                               auth_mode_direct, query=query)
+        return catalog
+
+    @classmethod
+    def _search_batches(cls, query, batches, limit):
+        """Queries Open Library for each batch of edition ids, running up
+        to SEARCH_CONCURRENCY requests at once. Results are consumed in
+        batch order so output is deterministic; once `limit` records are
+        collected, batches that haven't started are cancelled.
+        """
+        def search_batch(batch):
+            try:
+                ol_query = f"{query} AND {cls._edition_query(batch)}"
+                # Only edition keys are needed to test membership
+                return list(OpenLibrary.search(
+                    query=ol_query, limit=cls.SEARCH_BATCH_SIZE, profile='membership'))
+            finally:
+                db.remove()
+
+        collected = []
+        pool = ThreadPoolExecutor(max_workers=max(1, min(cls.SEARCH_CONCURRENCY, len(batches))))
+        try:
+            futures = [pool.submit(search_batch, batch) for batch in batches]
+            for future in futures:
+                collected.extend(future.result())
+                if len(collected) >= limit:
+                    break
+        finally:
+            # Don't wait on in-flight requests whose results we no longer need
+            pool.shutdown(wait=False, cancel_futures=True)
+        return collected[:limit]
 
     @classmethod
     def encrypt_file(cls, f, method="lcp"):
@@ -353,6 +760,22 @@ class LennyAPI:
                 f"File '{fp.filename}' is closed or unreadable: {e}"
             )
     
+    @classmethod
+    def upload_formats(cls, files: list[UploadFile]):
+        """The FormatEnum upload_files will store for `files`, checked
+        before anything is uploaded."""
+        formats = 0
+        for fp in files:
+            if not fp.filename:
+                continue
+            ext = Path(fp.filename).suffix.lower()
+            if ext not in cls.VALID_EXTS:
+                raise InvalidFileError(f"Invalid format {ext} for {fp.filename}")
+            formats += cls.VALID_EXTS[ext].value
+        if not formats:
+            raise InvalidFileError("No valid files provided")
+        return FormatEnum(formats)
+
     @classmethod
     def upload_files(cls, files: list[UploadFile], filename, encrypt=False):
         from io import BytesIO
@@ -397,54 +820,57 @@ class LennyAPI:
         return formats
 
     @classmethod
-    def add(cls, openlibrary_edition: int, files: list[UploadFile], uploader_ip:str, encrypt: bool=False):
-        """Adds a book into s3 and the database"""
+    def add(cls, openlibrary_edition: int, files: list[UploadFile], uploader_ip:str, encrypt: bool=False, copies: Optional[int]=None):
+        """Adds a book into s3 and the database; `copies` is how many
+        patrons may borrow it at once (default LENNY_LENDABLE_COPIES)"""
         if not cls.is_allowed_uploader(uploader_ip):
             raise UploaderNotAllowedError(f"IP {uploader_ip} not in allow list")
 
-        if Item.exists(openlibrary_edition):
+        formats = cls.upload_formats(files)
+        try:
+            item = Item.claim(openlibrary_edition, encrypt, formats, copies=copies)
+        except Exception as e:
+            db.rollback()
+            raise DatabaseInsertError(f"Failed to add item to db: {str(e)}.")
+        if item is None:
+            db.rollback()
             raise ItemExistsError(f"Item '{openlibrary_edition}' already exists.")
 
-        if formats:= cls.upload_files(files, openlibrary_edition, encrypt=encrypt):
+        # The claim stays uncommitted while the files are uploaded, so a
+        # concurrent upload of the same edition waits instead of overwriting
+        # them, and a failed (or killed) upload leaves no row behind
+        try:
+            cls.upload_files(files, openlibrary_edition, encrypt=encrypt)
+            db.commit()
+        except Exception:
             try:
-                item = Item(
-                    openlibrary_edition=openlibrary_edition,
-                    encrypted=encrypt,
-                    formats=FormatEnum(formats)
-                )
-                db.add(item)
-                db.commit()
-                return item
-            except Exception as e:
                 db.rollback()
-                raise DatabaseInsertError(f"Failed to add item to db: {str(e)}.")
+            except Exception as e:
+                logger.error(f"Failed to release claim on item {openlibrary_edition}: {e}")
+            raise
+        CatalogIndex.touch()
+        ResponseCache.bump()
+        cls._schedule_metadata_refresh([openlibrary_edition])
+        return item
 
     @classmethod
     def get_borrowed_items(cls, email: str):
         """
         Returns a list of active (not returned) Loan objects for the given user email.
-        Ensures openlibrary_edition is set for each loan.
+        Ensures openlibrary_edition is set for each loan. Loans and their
+        Items are fetched in one joined query.
         """
-        email_hash = hash_email(email)
-        loans = db.query(Loan).filter(
-            Loan.patron_email_hash == email_hash,
-            Loan.returned_at == None
-        ).all()
-        enriched_loans = []
+        loans = Loan.get_active(email)
         for loan in loans:
-            item = db.query(Item).filter(Item.id == loan.item_id).first()
-            if item:
-                loan.openlibrary_edition = item.openlibrary_edition
-                enriched_loans.append(loan)
-        return enriched_loans
+            loan.openlibrary_edition = loan.item.openlibrary_edition
+        return loans
 
     @classmethod
     def get_user_profile(cls, email: str, name: Optional[str] = None) -> dict:
         """
         Retrieves loan stats and generates the OPDS User Profile using LennyDataProvider.
         """
-        current_loans = cls.get_borrowed_items(email)
-        loans_count = len(current_loans)
+        loans_count = Loan.count_active(email)
         
         return LennyDataProvider.get_user_profile(
             name=name,
@@ -454,15 +880,26 @@ class LennyAPI:
         )
 
     @classmethod
-    def get_shelf_feed(cls, email: str, auth_mode_direct: bool = False) -> dict:
+    def get_shelf_feed(cls, email: str, auth_mode_direct: bool = False, local=None) -> dict:
         """
         Retrieves user loans, fetches their metadata, and generates the OPDS Shelf Feed.
+        With `local` (default: LENNY_LOCAL_METADATA) the metadata stored on
+        each Item is used instead of querying Open Library, as it is while
+        the Open Library circuit breaker is open.
         """
         loans = cls.get_borrowed_items(email)
         
         if not loans:
              return LennyDataProvider.get_shelf_feed([])
 
+        items = [loan.item for loan in loans]
+        degraded = OpenLibrary.BREAKER.is_open
+        if degraded or (LOCAL_METADATA if local is None else local):
+            described = [i for i in items if i.openlibrary_metadata is not None]
+            if degraded or (items and len(described) == len(items)):
+                return cls._local_shelf_feed(items, auth_mode_direct=auth_mode_direct)
+            cls._schedule_metadata_refresh([i.openlibrary_edition for i in items if cls._is_metadata_stale(i)])
+
         olids = [f"OL{loan.openlibrary_edition}M" for loan in loans if loan.openlibrary_edition]
         lenny_ids = {int(loan.openlibrary_edition): int(loan.openlibrary_edition) for loan in loans if loan.openlibrary_edition}
         
@@ -471,11 +908,15 @@ class LennyAPI:
 
         query = f"edition_key:({' OR '.join(olids)})"
         
-        resp = LennyDataProvider.search(
-            query=query, 
-            limit=len(olids), 
-            lenny_ids=lenny_ids
-        )
+        try:
+            with OpenLibrary.BREAKER.track():
+                resp = LennyDataProvider.search(
+                    query=query,
+                    limit=len(olids),
+                    lenny_ids=lenny_ids
+                )
+        except CircuitOpenError:
+            return cls._local_shelf_feed(items, auth_mode_direct=auth_mode_direct)
 
         publications = []
         for record in resp.records:
@@ -490,6 +931,15 @@ class LennyAPI:
         
         return LennyDataProvider.get_shelf_feed(publications)
 
+    @classmethod
+    def _local_shelf_feed(cls, items, auth_mode_direct=False):
+        """Shelf feed of borrowed `items` from their local metadata; items
+        without any yet are left out."""
+        return LennyDataProvider.get_shelf_feed([
+            cls._local_publication(i, auth_mode_direct=auth_mode_direct, borrowed=True)
+            for i in items if i.openlibrary_metadata is not None
+        ])
+
     @classmethod
     def build_oauth_fragment(cls, session_cookie: str, state: str = None) -> dict:
         """Build OAuth token fragment for redirect URL or opds:// callback."""
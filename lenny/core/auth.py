@@ -1,11 +1,21 @@
+import base64
+import binascii
 import hashlib
 import hmac
 import logging
+import struct
+import threading
+import time
 import httpx
+from collections import OrderedDict
 from datetime import datetime, timedelta
+from functools import lru_cache
 from typing import Optional
 from itsdangerous import URLSafeTimedSerializer, BadSignature
-from lenny.configs import SEED, OTP_SERVER, ADMIN_USERNAME, ADMIN_PASSWORD, ADMIN_INTERNAL_SECRET, ADMIN_SALT
+from lenny.configs import (
+    SEED, OTP_SERVER, ADMIN_USERNAME, ADMIN_PASSWORD, ADMIN_INTERNAL_SECRET, ADMIN_SALT,
+    SESSION_CACHE_SIZE, SESSION_CACHE_TTL, SESSION_TOKEN_FORMAT,
+)
 from lenny.core.cache import Cache
 from lenny.core.exceptions import RateLimitError
 
@@ -74,8 +84,111 @@ def _get_serializer():
         SERIALIZER = URLSafeTimedSerializer(SEED, salt="auth-cookie")
     return SERIALIZER
 
+class SessionCache:
+    """Bounded LRU of verified session tokens, keyed by a digest of the
+    token and client IP. Entries live for at most TTL seconds and never
+    past the token's own expiry; only successful verifications are kept."""
+
+    SIZE = SESSION_CACHE_SIZE
+    TTL = SESSION_CACHE_TTL
+
+    _entries = OrderedDict()
+    _lock = threading.Lock()
+    _stats = {"hits": 0, "misses": 0}
+
+    @classmethod
+    def key(cls, session, client_ip=None):
+        return hashlib.sha256(f"{client_ip or ''}\0{session}".encode()).digest()
+
+    @classmethod
+    def get(cls, key):
+        with cls._lock:
+            entry = cls._entries.get(key)
+            if entry is not None and entry[1] > time.time():
+                cls._entries.move_to_end(key)
+                cls._stats["hits"] += 1
+                return entry[0]
+            if entry is not None:
+                del cls._entries[key]
+            cls._stats["misses"] += 1
+            return None
+
+    @classmethod
+    def set(cls, key, data, expires_at):
+        if cls.TTL <= 0 or cls.SIZE <= 0:
+            return
+        with cls._lock:
+            cls._entries[key] = (data, min(expires_at, time.time() + cls.TTL))
+            cls._entries.move_to_end(key)
+            while len(cls._entries) > cls.SIZE:
+                cls._entries.popitem(last=False)
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._entries.clear()
+
+    @classmethod
+    def stats(cls):
+        with cls._lock:
+            return {**cls._stats, "size": len(cls._entries), "max_size": cls.SIZE, "ttl": cls.TTL}
+
+
+# Compact tokens: "c1." + base64url(issued (uint32) | len(ip) (uint8) | ip |
+# email | first 16 bytes of HMAC-SHA256 over everything before it)
+COMPACT_PREFIX = "c1."
+COMPACT_HEADER = struct.Struct(">IB")
+COMPACT_MAC_SIZE = 16
+
+@lru_cache(maxsize=4)
+def _compact_key(seed) -> bytes:
+    seed = seed.encode() if isinstance(seed, str) else seed
+    return hmac.new(seed, b"auth-cookie-compact", hashlib.sha256).digest()
+
+def _compact_mac(payload: bytes) -> bytes:
+    return hmac.digest(_compact_key(SEED), COMPACT_PREFIX.encode() + payload, "sha256")[:COMPACT_MAC_SIZE]
+
+def _dump_compact(email: str, ip: str = None) -> str:
+    ip_bytes = (ip or "").encode()
+    payload = COMPACT_HEADER.pack(int(time.time()), len(ip_bytes)) + ip_bytes + email.encode()
+    token = base64.urlsafe_b64encode(payload + _compact_mac(payload)).rstrip(b"=")
+    return COMPACT_PREFIX + token.decode()
+
+def _load_compact(session: str, max_age: int):
+    """Returns (data, issued_at) for a valid compact token, else None."""
+    body = session[len(COMPACT_PREFIX):]
+    try:
+        raw = base64.urlsafe_b64decode(body + "=" * (-len(body) % 4))
+    except (binascii.Error, ValueError):
+        return None
+    payload, mac = raw[:-COMPACT_MAC_SIZE], raw[-COMPACT_MAC_SIZE:]
+    if len(payload) < COMPACT_HEADER.size or not hmac.compare_digest(mac, _compact_mac(payload)):
+        return None
+    issued, ip_len = COMPACT_HEADER.unpack_from(payload)
+    if time.time() - issued > max_age:
+        return None
+    try:
+        ip = payload[COMPACT_HEADER.size:COMPACT_HEADER.size + ip_len].decode()
+        email = payload[COMPACT_HEADER.size + ip_len:].decode()
+    except UnicodeDecodeError:
+        return None
+    return ({"email": email, "ip": ip} if ip else email), issued
+
+def _load_session(session: str):
+    """Verifies a session token of either format and returns
+    (data, issued_at), or None if it is invalid or expired."""
+    if session.startswith(COMPACT_PREFIX):
+        return _load_compact(session, COOKIE_TTL)
+    try:
+        data, issued = _get_serializer().loads(session, max_age=COOKIE_TTL, return_timestamp=True)
+    except BadSignature:
+        return None
+    return data, issued.timestamp()
+
 def create_session_cookie(email: str, ip: str = None) -> str:
     """Returns a signed + encrypted session cookie."""
+    if SESSION_TOKEN_FORMAT == "compact":
+        return _dump_compact(email, ip)
     serializer = _get_serializer()
     if ip:
         # New format: serialize both email and IP (no need to store SEED in cookie)
@@ -87,37 +200,37 @@ def create_session_cookie(email: str, ip: str = None) -> str:
 
 def get_authenticated_email(session) -> Optional[str]:
     """Retrieves and verifies email from signed cookie."""
-    try:
-        serializer = _get_serializer()
-        data = serializer.loads(session, max_age=COOKIE_TTL)
-        if isinstance(data, dict):
-            # New format with IP
-            return data.get("email")
-        else:
-            # Old format, just email
-            return data
-    except BadSignature:
+    loaded = _load_session(session) if session else None
+    if not loaded:
         return None
+    data = loaded[0]
+    if isinstance(data, dict):
+        # New format with IP
+        return data.get("email")
+    # Old format, just email
+    return data
 
 def verify_session_cookie(session, client_ip: str = None):
-    """Retrieves and verifies data from signed cookie, optionally checking IP."""
-    try:
-        if not session:
-            return None
-        serializer = _get_serializer()
-        data = serializer.loads(session, max_age=COOKIE_TTL)
-        if isinstance(data, dict):
-            # New format with IP verification
-            stored_ip = data.get("ip")
-            if client_ip and stored_ip and client_ip != stored_ip:
-                return None  # IP mismatch
-            return data
-        else:
-            # Old format, just email (no IP verification possible)
-            return data
-    except BadSignature:
+    """Retrieves and verifies data from signed cookie, optionally checking IP.
+    Recently verified (session, client_ip) pairs come from SessionCache."""
+    if not session:
         return None
-        
+    key = SessionCache.key(session, client_ip)
+    if (data := SessionCache.get(key)) is not None:
+        return data
+    loaded = _load_session(session)
+    if not loaded:
+        return None
+    data, issued = loaded
+    if isinstance(data, dict):
+        # New format with IP verification
+        stored_ip = data.get("ip")
+        if client_ip and stored_ip and client_ip != stored_ip:
+            return None  # IP mismatch
+    # Old format is just email (no IP verification possible)
+    SessionCache.set(key, data, issued + COOKIE_TTL)
+    return data
+
 class OTP:
 
     @classmethod
@@ -1,28 +1,37 @@
 """
-    PostgreSQL-backed cache for Lenny.
+    Shared cache for Lenny, with pluggable backends (PostgreSQL, a local
+    SQLite file or Redis; see LENNY_CACHE_BACKEND).
 
-    Used for OTP email-based rate limiting across multiple Uvicorn workers.
+    Used for OTP email-based rate limiting across multiple Uvicorn workers,
+    and to share Open Library search responses between workers.
     IP-based rate limiting is handled by nginx (limit_req).
 
     :copyright: (c) 2015 by AUTHORS
     :license: see LICENSE for more details
 """
 
+import asyncio
+import hashlib
+import json
 import logging
-import random
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
 from datetime import datetime, timedelta, timezone
 
-from sqlalchemy import Column, String, BigInteger, DateTime, Index
+from sqlalchemy import Column, String, Text, Integer, DateTime, Index, case, delete, select, tuple_
+from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.sql import func
 
-from lenny.core.db import session as db, Base
-from lenny.core.exceptions import DatabaseInsertError
+from lenny.core.db import Base, BigIntegerID, dialect_insert, engine
 from lenny import configs
 
 logger = logging.getLogger(__name__)
 
-PURGE_PROBABILITY = 0.01  # 1-in-100 chance per rate limit check
-
 # UNLOGGED tables skip WAL for faster writes — ideal for ephemeral cache.
 # SQLite (used in tests) doesn't support UNLOGGED, so we only apply it on PostgreSQL.
 _cache_table_opts = {'prefixes': ['UNLOGGED']} if not configs.TESTING else {}
@@ -36,83 +45,398 @@ class CacheEntry(Base):
         _cache_table_opts,
     )
 
-    id = Column(BigInteger, primary_key=True)
+    id = Column(BigIntegerID, primary_key=True)
     scope = Column(String(64), nullable=False)
     key = Column(String(255), nullable=False)
-    value = Column(String(1024), nullable=True)
+    value = Column(Text, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     expires_at = Column(DateTime(timezone=True), nullable=False)
 
 
-class Cache:
-    """PostgreSQL-backed cache with built-in rate limiting."""
+class RateLimit(Base):
+    """One fixed-window counter per (scope, key), see Cache.is_throttled."""
+    __tablename__ = 'rate_limits'
+    __table_args__ = (
+        Index('idx_rate_limits_expires', 'expires_at'),
+        _cache_table_opts,
+    )
 
-    @classmethod
-    def _record(cls, scope, key, ttl, value=None):
-        """Insert a cache entry that expires after ttl seconds."""
+    scope = Column(String(64), primary_key=True)
+    key = Column(String(255), primary_key=True)
+    hits = Column(Integer, nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+
+
+class CacheBackend(ABC):
+    """Storage behind Cache. Failures are logged, not raised: get returns
+    None and is_throttled returns False (fails open)."""
+
+    @abstractmethod
+    def get(self, scope, key):
+        """Return the value of the newest unexpired entry, or None."""
+
+    @abstractmethod
+    def set(self, scope, key, value, ttl):
+        """Store value for scope and key for ttl seconds."""
+
+    @abstractmethod
+    def is_throttled(self, scope, key, limit, ttl):
+        """Record an attempt; True if `limit` attempts were already made
+        in the key's current `ttl`-second window."""
+
+    def purge(self, batch_size=None):
+        """Delete expired entries (at most batch_size per table) if the
+        backend doesn't expire them itself. Returns the number deleted."""
+        return 0
+
+
+class PostgresCacheBackend(CacheBackend):
+    """The cache and rate_limits tables. They are UNLOGGED, which hot
+    standby replicas can't read, so they're always on the primary, through
+    a session of the backend's own: cache I/O never commits or rolls back
+    the caller's work on the shared session."""
+
+    def __init__(self, bind=None):
+        self.session = scoped_session(sessionmaker(
+            bind=bind if bind is not None else engine, autoflush=False))
+
+    def get(self, scope, key):
         try:
-            entry = CacheEntry(
+            now = datetime.now(timezone.utc)
+            entry = self.session.query(CacheEntry.value).filter(
+                CacheEntry.scope == scope,
+                CacheEntry.key == key,
+                CacheEntry.expires_at > now,
+            ).order_by(CacheEntry.id.desc()).first()
+            self.session.rollback()
+            return entry.value if entry else None
+        except Exception as e:
+            self.session.rollback()
+            logger.warning(f"Cache get failed: {str(e)}")
+            return None
+
+    def set(self, scope, key, value, ttl):
+        """Replace all entries for scope and key with a single value."""
+        try:
+            self.session.query(CacheEntry).filter(
+                CacheEntry.scope == scope,
+                CacheEntry.key == key,
+            ).delete()
+            self.session.add(CacheEntry(
                 scope=scope,
                 key=key,
                 value=value,
                 expires_at=datetime.now(timezone.utc) + timedelta(seconds=ttl),
-            )
-            db.add(entry)
-            db.commit()
-            return entry
+            ))
+            self.session.commit()
         except Exception as e:
-            db.rollback()
-            raise DatabaseInsertError(f"Failed to record cache entry: {str(e)}")
+            self.session.rollback()
+            logger.warning(f"Cache set failed: {str(e)}")
 
-    @classmethod
-    def _count(cls, scope, key):
-        """Count unexpired entries for a given scope and key."""
+    def is_throttled(self, scope, key, limit, ttl):
+        """Deciding and recording the attempt is a single INSERT ... ON
+        CONFLICT DO UPDATE ... RETURNING on the key's row."""
+        now = datetime.now(timezone.utc)
+        expired = RateLimit.expires_at <= now
+        stmt = dialect_insert(RateLimit, self.session.get_bind()).values(
+            scope=scope,
+            key=key,
+            hits=1,
+            expires_at=now + timedelta(seconds=ttl),
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['scope', 'key'],
+            set_={
+                # Stops at limit + 1, which marks the attempt as throttled
+                'hits': case(
+                    (expired, 1),
+                    (RateLimit.hits > limit, RateLimit.hits),
+                    else_=RateLimit.hits + 1,
+                ),
+                'expires_at': case((expired, stmt.excluded.expires_at), else_=RateLimit.expires_at),
+            },
+        ).returning(RateLimit.hits)
+        try:
+            hits = self.session.execute(stmt).scalar()
+            self.session.commit()
+        except Exception as e:
+            self.session.rollback()
+            logger.warning(f"Rate limit check failed: {str(e)}")
+            return False
+        return hits > limit
+
+    def purge(self, batch_size=None):
         try:
             now = datetime.now(timezone.utc)
-            count = db.query(CacheEntry).filter(
-                CacheEntry.scope == scope,
-                CacheEntry.key == key,
-                CacheEntry.expires_at > now,
-            ).count()
-            db.rollback()
-            return count
+            expired_entries = select(CacheEntry.id).where(CacheEntry.expires_at < now).limit(batch_size)
+            expired_windows = select(RateLimit.scope, RateLimit.key).where(RateLimit.expires_at < now).limit(batch_size)
+            deleted = self.session.execute(
+                delete(CacheEntry).where(CacheEntry.id.in_(expired_entries))
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            deleted += self.session.execute(
+                delete(RateLimit).where(tuple_(RateLimit.scope, RateLimit.key).in_(expired_windows))
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            self.session.commit()
+            return deleted
         except Exception as e:
-            db.rollback()
-            logger.warning(f"Cache count failed: {str(e)}")
+            self.session.rollback()
+            logger.warning(f"Cache purge failed: {str(e)}")
+            return 0
+
+
+class SQLiteFileCacheBackend(CacheBackend):
+    """Cache in a SQLite file (WAL mode) shared by all workers on one host,
+    so caching and rate limiting don't touch the primary database."""
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS cache ("
+        "scope TEXT NOT NULL, key TEXT NOT NULL, value TEXT, expires_at REAL NOT NULL, "
+        "PRIMARY KEY (scope, key))",
+        "CREATE TABLE IF NOT EXISTS rate_limits ("
+        "scope TEXT NOT NULL, key TEXT NOT NULL, hits INTEGER NOT NULL, expires_at REAL NOT NULL, "
+        "PRIMARY KEY (scope, key))",
+    )
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(tempfile.gettempdir(), 'lenny-cache.sqlite3')
+        self._local = threading.local()
+        for statement in self.SCHEMA:
+            self._conn().execute(statement)
+
+    def _conn(self):
+        # sqlite3 connections can't be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, scope, key):
+        try:
+            row = self._conn().execute(
+                "SELECT value FROM cache WHERE scope = ? AND key = ? AND expires_at > ?",
+                (scope, key, time.time()),
+            ).fetchone()
+            return row[0] if row else None
+        except sqlite3.Error as e:
+            logger.warning(f"Cache get failed: {str(e)}")
+            return None
+
+    def set(self, scope, key, value, ttl):
+        try:
+            self._conn().execute(
+                "INSERT INTO cache (scope, key, value, expires_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (scope, key) DO UPDATE SET "
+                "value = excluded.value, expires_at = excluded.expires_at",
+                (scope, key, value, time.time() + ttl),
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Cache set failed: {str(e)}")
+
+    def is_throttled(self, scope, key, limit, ttl):
+        now = time.time()
+        try:
+            (hits,) = self._conn().execute(
+                "INSERT INTO rate_limits (scope, key, hits, expires_at) VALUES (?1, ?2, 1, ?3) "
+                "ON CONFLICT (scope, key) DO UPDATE SET "
+                "hits = CASE WHEN expires_at <= ?4 THEN 1 WHEN hits > ?5 THEN hits ELSE hits + 1 END, "
+                "expires_at = CASE WHEN expires_at <= ?4 THEN excluded.expires_at ELSE expires_at END "
+                "RETURNING hits",
+                (scope, key, now + ttl, now, limit),
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Rate limit check failed: {str(e)}")
+            return False
+        return hits > limit
+
+    def purge(self, batch_size=None):
+        try:
+            now, limit = time.time(), -1 if batch_size is None else batch_size
+            conn = self._conn()
+            deleted = 0
+            for table in ("cache", "rate_limits"):
+                deleted += conn.execute(
+                    f"DELETE FROM {table} WHERE rowid IN "
+                    f"(SELECT rowid FROM {table} WHERE expires_at < ? LIMIT ?)",
+                    (now, limit),
+                ).rowcount
+            return deleted
+        except sqlite3.Error as e:
+            logger.warning(f"Cache purge failed: {str(e)}")
             return 0
 
+
+class RedisCacheBackend(CacheBackend):
+    """Cache in Redis (or a server speaking its protocol); Redis expires
+    keys itself, so purge is a no-op. Needs the optional redis package."""
+
+    PREFIX = "lenny"
+
+    def __init__(self, url=None, client=None):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise ImportError("LENNY_CACHE_BACKEND=redis requires the 'redis' package")
+            client = redis.Redis.from_url(url or "redis://localhost:6379/0")
+        self.client = client
+
+    def get(self, scope, key):
+        try:
+            value = self.client.get(f"{self.PREFIX}:{scope}:{key}")
+            return value.decode() if isinstance(value, bytes) else value
+        except Exception as e:
+            logger.warning(f"Cache get failed: {str(e)}")
+            return None
+
+    def set(self, scope, key, value, ttl):
+        try:
+            self.client.set(f"{self.PREFIX}:{scope}:{key}", value, ex=max(1, int(ttl)))
+        except Exception as e:
+            logger.warning(f"Cache set failed: {str(e)}")
+
+    def is_throttled(self, scope, key, limit, ttl):
+        # The window starts (and its expiry is set) on the first attempt;
+        # SET NX + INCR run as one MULTI/EXEC round trip
+        name = f"{self.PREFIX}:rl:{scope}:{key}"
+        try:
+            pipe = self.client.pipeline(transaction=True)
+            pipe.set(name, 0, ex=max(1, int(ttl)), nx=True)
+            pipe.incr(name)
+            _, hits = pipe.execute()
+        except Exception as e:
+            logger.warning(f"Rate limit check failed: {str(e)}")
+            return False
+        return hits > limit
+
+
+class Cache:
+    """Cache with built-in rate limiting, stored in the backend selected
+    by LENNY_CACHE_BACKEND ('postgres', 'sqlite' or 'redis')."""
+
+    BACKENDS = {
+        'postgres': PostgresCacheBackend,
+        'sqlite': SQLiteFileCacheBackend,
+        'redis': RedisCacheBackend,
+    }
+    _backend = None
+    _backend_lock = threading.Lock()
+
+    @classmethod
+    def backend(cls):
+        if cls._backend is None:
+            with cls._backend_lock:
+                if cls._backend is None:
+                    if configs.CACHE_BACKEND not in cls.BACKENDS:
+                        raise ValueError(f"Unknown LENNY_CACHE_BACKEND '{configs.CACHE_BACKEND}'")
+                    backend = cls.BACKENDS[configs.CACHE_BACKEND]
+                    if backend is PostgresCacheBackend:
+                        cls._backend = backend()
+                    else:
+                        cls._backend = backend(configs.CACHE_URL or None)
+        return cls._backend
+
+    @classmethod
+    def get(cls, scope, key):
+        """Return the value of the newest unexpired entry, or None."""
+        return cls.backend().get(scope, key)
+
+    @classmethod
+    def set(cls, scope, key, value, ttl):
+        """Replace the entry for scope and key with a single value."""
+        cls.backend().set(scope, key, value, ttl)
+
     @classmethod
     def is_throttled(cls, scope, key, limit, ttl):
         """Check if a key has exceeded its rate limit.
 
-        Counts existing unexpired entries, then records the current
-        attempt. Returns True if count >= limit (before recording).
-        Only records the attempt if not already throttled.
+        Allows `limit` attempts per window of `ttl` seconds, starting at
+        the first attempt. Returns True if the limit was already reached
+        (throttled attempts don't extend the window).
         """
-        current_count = cls._count(scope, key)
+        return cls.backend().is_throttled(scope, key, limit, ttl)
 
-        if current_count < limit:
-            try:
-                cls._record(scope, key, ttl)
-            except DatabaseInsertError:
-                pass
+    @classmethod
+    def purge(cls, batch_size=None):
+        """Delete expired cache entries and rate limit windows, at most
+        batch_size per table. Run by lenny.core.maintenance, never inline
+        in a request. Returns the number deleted."""
+        return cls.backend().purge(batch_size)
 
-        if random.random() < PURGE_PROBABILITY:
-            cls.purge()
 
-        return current_count >= limit
+class ResponseCache:
+    """Rendered OPDS documents, stored through Cache and keyed by endpoint,
+    params, auth mode and the catalog version. bump() changes the version,
+    so every cached document is invalidated at once (old entries expire)."""
+
+    SCOPE = "opds"
+    VERSION_SCOPE = "catalog"
+    TTL = configs.OPDS_CACHE_TTL
+    # Keep the version for a second per worker instead of reading it for
+    # every request; other workers' bumps are seen within that time
+    VERSION_TTL = 1.0
+    _version = (None, 0.0)
 
     @classmethod
-    def purge(cls):
-        """Delete all expired cache entries."""
-        try:
-            now = datetime.now(timezone.utc)
-            deleted = db.query(CacheEntry).filter(
-                CacheEntry.expires_at < now,
-            ).delete()
-            db.commit()
-            if deleted:
-                logger.debug(f"Cache purge: removed {deleted} expired entries")
-        except Exception as e:
-            db.rollback()
-            logger.warning(f"Cache purge failed: {str(e)}")
+    def version(cls):
+        version, read_at = cls._version
+        if version is None or time.monotonic() - read_at > cls.VERSION_TTL:
+            version = Cache.get(cls.VERSION_SCOPE, "version") or "0"
+            cls._version = (version, time.monotonic())
+        return version
+
+    @classmethod
+    def bump(cls):
+        """Invalidates all cached documents, e.g. after an upload, borrow
+        or return."""
+        if cls.TTL <= 0:
+            return
+        version = uuid.uuid4().hex
+        # Outlives any entry cached under the previous version
+        Cache.set(cls.VERSION_SCOPE, "version", version, max(cls.TTL * 10, 86400))
+        cls._version = (version, time.monotonic())
+
+    @classmethod
+    async def abump(cls):
+        """bump() for the async paths: the cache write goes to a worker
+        thread so it doesn't block the event loop."""
+        if cls.TTL > 0:
+            await asyncio.to_thread(cls.bump)
+
+    @classmethod
+    def key(cls, endpoint, params, auth_mode_direct):
+        raw = json.dumps([endpoint, params, bool(auth_mode_direct), cls.version()], sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    @classmethod
+    def get(cls, key):
+        if cls.TTL <= 0 or not key:
+            return None
+        return Cache.get(cls.SCOPE, key)
+
+    @classmethod
+    def set(cls, key, content):
+        if cls.TTL > 0 and key:
+            Cache.set(cls.SCOPE, key, content, cls.TTL)
+
+    # Counterparts for async route handlers; cache I/O (including reading
+    # the version for a key) goes to a worker thread, as in abump
+
+    @classmethod
+    async def akey(cls, endpoint, params, auth_mode_direct):
+        return await asyncio.to_thread(cls.key, endpoint, params, auth_mode_direct)
+
+    @classmethod
+    async def aget(cls, key):
+        if cls.TTL <= 0 or not key:
+            return None
+        return await asyncio.to_thread(cls.get, key)
+
+    @classmethod
+    async def aset(cls, key, content):
+        if cls.TTL > 0 and key:
+            await asyncio.to_thread(cls.set, key, content)
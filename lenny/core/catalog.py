@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+"""
+    In-process index of the edition ids Lenny holds, so searches and
+    membership checks don't load the whole items table into ORM objects.
+
+    Each worker keeps a sorted array of edition ids. It is refreshed
+    incrementally from items.updated_at at most every REFRESH_INTERVAL
+    seconds (immediately after `touch()`), and rebuilt in full every
+    REBUILD_INTERVAL seconds to drop deleted items.
+
+    :copyright: (c) 2015 by AUTHORS
+    :license: see LICENSE for more details
+"""
+
+import bisect
+import threading
+import time
+from array import array
+from datetime import timedelta
+from lenny.configs import CATALOG_REFRESH_INTERVAL
+from lenny.core.db import session as db
+from lenny.core.models import Item
+
+
+class CatalogIndex:
+
+    REFRESH_INTERVAL = CATALOG_REFRESH_INTERVAL
+    REBUILD_INTERVAL = 3600
+    # updated_at is the writing transaction's start time, so a row can
+    # commit after a refresh with an older stamp; each refresh re-reads
+    # this much history to catch those
+    REFRESH_OVERLAP = timedelta(seconds=30)
+
+    # Sorted edition ids; replaced (never mutated) so readers need no lock
+    _snapshot = array('q')
+    _synced_until = None
+    _checked_at = 0.0
+    _built_at = 0.0
+    _dirty = True
+    _lock = threading.Lock()
+
+    @classmethod
+    def touch(cls):
+        """Marks the index stale so the next read refreshes it, e.g.
+        after an item is added in this worker.
+        """
+        cls._dirty = True
+
+    @classmethod
+    def editions(cls):
+        """Sorted array of all edition ids in the catalog."""
+        cls.refresh()
+        return cls._snapshot
+
+    @classmethod
+    def contains(cls, olid):
+        editions = cls._snapshot
+        i = bisect.bisect_left(editions, olid)
+        return i < len(editions) and editions[i] == olid
+
+    @classmethod
+    def refresh(cls, force=False):
+        if not (force or cls._dirty or time.monotonic() - cls._checked_at >= cls.REFRESH_INTERVAL):
+            return
+        with cls._lock:
+            now = time.monotonic()
+            if not (force or cls._dirty or now - cls._checked_at >= cls.REFRESH_INTERVAL):
+                return
+            cls._dirty = False
+            cls._checked_at = now
+            full = force or cls._synced_until is None or now - cls._built_at >= cls.REBUILD_INTERVAL
+
+            # Plain column tuples, never ORM objects
+            q = db.query(Item.openlibrary_edition, Item.updated_at)
+            if not full:
+                q = q.filter(Item.updated_at >= cls._synced_until - cls.REFRESH_OVERLAP)
+            rows = q.all()
+
+            if full:
+                cls._build(rows)
+                cls._built_at = now
+            elif rows:
+                cls._merge(rows)
+            stamps = [r.updated_at for r in rows if r.updated_at is not None]
+            if not full and cls._synced_until is not None:
+                stamps.append(cls._synced_until)
+            if stamps:
+                cls._synced_until = max(stamps)
+
+    @classmethod
+    def _build(cls, rows):
+        cls._snapshot = array('q', sorted({r.openlibrary_edition for r in rows}))
+
+    @classmethod
+    def _merge(cls, rows):
+        editions = array('q', cls._snapshot)
+        for r in rows:
+            i = bisect.bisect_left(editions, r.openlibrary_edition)
+            if i == len(editions) or editions[i] != r.openlibrary_edition:
+                editions.insert(i, r.openlibrary_edition)
+        cls._snapshot = editions
+
+    @classmethod
+    def stats(cls):
+        editions = cls._snapshot
+        return {
+            "editions": len(editions),
+            "bytes": editions.itemsize * len(editions),
+            "synced_until": cls._synced_until.isoformat() if cls._synced_until else None,
+        }
@@ -0,0 +1,133 @@
+"""
+    Circuit breaker for calls to upstream services (Open Library).
+
+    After `failure_threshold` consecutive failures or calls slower than
+    `latency_budget` seconds the breaker opens and calls fail fast with
+    CircuitOpenError. After `reset_timeout` seconds one probe call is let
+    through (half-open): success closes the breaker, failure re-opens it.
+
+    :copyright: (c) 2015 by AUTHORS
+    :license: see LICENSE for more details
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from lenny.core.exceptions import CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, failure_threshold=5, latency_budget=2.0, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.latency_budget = latency_budget
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+            self._trips = 0
+            self._rejected = 0
+            self._failed = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    @property
+    def is_open(self):
+        return self.state == self.OPEN
+
+    @property
+    def errors(self):
+        """Calls rejected or failed since reset. Compare it before and
+        after some work to tell whether any of that work went without
+        upstream data (other threads' errors count too, erring safe)."""
+        with self._lock:
+            return self._rejected + self._failed
+
+    def _current_state(self):
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+        return self._state
+
+    def allow(self):
+        """True if a call may go upstream now. In half-open state only a
+        single probe call is allowed at a time.
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self._rejected += 1
+            return False
+
+    def record_success(self, elapsed=0.0):
+        if self.latency_budget and elapsed > self.latency_budget:
+            logger.warning(f"{self.name} call took {elapsed:.2f}s (budget {self.latency_budget}s)")
+            return self.record_failure()
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._failed += 1
+            self._probing = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self._trips += 1
+                    logger.warning(f"{self.name} circuit opened after {self._failures} failures")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    @contextmanager
+    def track(self):
+        """Guards a call: raises CircuitOpenError instead of running it
+        while open, and records the outcome (exceptions and latency
+        budget breaches count as failures).
+        """
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} circuit is open")
+        start = time.monotonic()
+        try:
+            yield
+        except Exception:
+            self.record_failure()
+            raise
+        except BaseException:
+            # Cancelled, not failed: just free the probe slot
+            with self._lock:
+                self._probing = False
+            raise
+        self.record_success(time.monotonic() - start)
+
+    def stats(self):
+        with self._lock:
+            state = self._current_state()
+            return {
+                "state": state,
+                "failures": self._failures,
+                "trips": self._trips,
+                "rejected": self._rejected,
+                "open_for": round(time.monotonic() - self._opened_at, 1) if state != self.CLOSED else None,
+            }
@@ -1,17 +1,226 @@
 
 import logging
-from sqlalchemy import create_engine
-from sqlalchemy.orm import scoped_session, sessionmaker, declarative_base
-from lenny.configs import DB_URI, DEBUG
+import random
+import threading
+import time
+from contextvars import ContextVar
+from sqlalchemy import create_engine, BigInteger, Integer, Select, exc
+from sqlalchemy.orm import Session, scoped_session, sessionmaker, declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from lenny.configs import (
+    DB_URI, ASYNC_DB_URI, DB_REPLICA_URIS, DEBUG,
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_ASYNC_POOL_SIZE, DB_ASYNC_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT, DB_POOL_RECYCLE,
+    DB_POOL_PRE_PING, DB_STATEMENT_TIMEOUT, DB_POOL_WARMUP,
+)
 
 logger = logging.getLogger(__name__)
-# Only use client_encoding for PostgreSQL, not SQLite
-engine_kwargs = {'echo': DEBUG}
-if not DB_URI.startswith('sqlite'):
-    engine_kwargs['client_encoding'] = 'utf8'
-engine = create_engine(DB_URI, **engine_kwargs)
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long checkouts wait for a connection
+    and how many give up, to spot pool starvation."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+
+
+class InstrumentedAsyncQueuePool(InstrumentedQueuePool, AsyncAdaptedQueuePool):
+    """InstrumentedQueuePool for the async engine."""
+
+
+def engine_options(uri):
+    options = {'echo': DEBUG}
+    # SQLite (tests) keeps SQLAlchemy's default single-connection pool
+    if uri.startswith('sqlite'):
+        return options
+    options.update({
+        'client_encoding': 'utf8',
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING,
+    })
+    if DB_STATEMENT_TIMEOUT:
+        options['connect_args'] = {'options': f'-c statement_timeout={DB_STATEMENT_TIMEOUT}'}
+    return options
+
+def async_engine_options(uri):
+    options = {'echo': DEBUG}
+    if uri.startswith('sqlite'):
+        return options
+    options.update({
+        'poolclass': InstrumentedAsyncQueuePool,
+        'pool_size': DB_ASYNC_POOL_SIZE,
+        'max_overflow': DB_ASYNC_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING,
+    })
+    if DB_STATEMENT_TIMEOUT:
+        options['connect_args'] = {'server_settings': {'statement_timeout': str(DB_STATEMENT_TIMEOUT)}}
+    return options
+
+# Set once the current request (or thread/task) writes, so its later reads
+# see that write instead of a lagging replica; reset per request by
+# the app middleware (see use_replicas)
+_on_primary = ContextVar('lenny_db_on_primary', default=False)
+
+
+class RoutingSession(Session):
+    """Session that sends read-only SELECTs to a replica (when any are
+    configured) and everything else to the primary engine. After the first
+    write in a context, all further queries stick to the primary."""
+
+    def __init__(self, *args, replicas=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.replicas = replica_engines if replicas is None else replicas
+
+    def get_bind(self, mapper=None, *, clause=None, **kwargs):
+        primary = super().get_bind(mapper, clause=clause, **kwargs)
+        if not self.replicas or _on_primary.get():
+            return primary
+        if self._flushing or (clause is not None and not isinstance(clause, Select)):
+            _on_primary.set(True)
+            return primary
+        return random.choice(self.replicas)
+
+
+def use_replicas():
+    """Lets reads in the current context go to replicas again; called at
+    the start of each request."""
+    _on_primary.set(False)
+
+def expire_session():
+    """Ends the current thread's session transaction and expires its
+    objects, so later reads see rows written elsewhere (e.g. through the
+    async engine). Async handlers all share the event loop thread's
+    session, so this runs at the start of each request and after each
+    async write."""
+    session.rollback()
+
+def use_primary():
+    """Sends the rest of the current context's queries to the primary,
+    for reads that a following write depends on (e.g. the active-loan
+    check before a borrow), which a lagging replica could answer wrong."""
+    _on_primary.set(True)
+
+
+engine = create_engine(DB_URI, **engine_options(DB_URI))
+replica_engines = [create_engine(uri, **engine_options(uri)) for uri in DB_REPLICA_URIS]
 session = scoped_session(sessionmaker(
-    bind=engine, autocommit=False, autoflush=False))
+    bind=engine, class_=RoutingSession, autocommit=False, autoflush=False))
+
+# The async engine is only created on first use, so workers (and scripts)
+# that never touch it don't open a second pool
+_async_engine = None
+_async_sessionmaker = None
+
+def get_async_engine():
+    global _async_engine, _async_sessionmaker
+    if _async_engine is None:
+        _async_engine = create_async_engine(ASYNC_DB_URI, **async_engine_options(ASYNC_DB_URI))
+        # Objects outlive the session they were loaded in (see Item.aexists),
+        # so don't expire them on commit
+        _async_sessionmaker = async_sessionmaker(
+            _async_engine, autoflush=False, expire_on_commit=False)
+    return _async_engine
+
+def async_session():
+    """A new AsyncSession; use as `async with async_session() as adb:`."""
+    get_async_engine()
+    return _async_sessionmaker()
+
+async def adispose():
+    """Closes the async engine's pool (it is recreated on next use)."""
+    global _async_engine, _async_sessionmaker
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = _async_sessionmaker = None
+
+# SQLite only autoincrements INTEGER PRIMARY KEY columns, so BigInteger ids
+# fall back to Integer there to keep the in-memory test database insertable.
+BigIntegerID = BigInteger().with_variant(Integer, "sqlite")
+
+def dialect_insert(entity, bind=None):
+    """INSERT construct for the bound database's dialect, so callers can
+    use ON CONFLICT (supported by both PostgreSQL and SQLite)."""
+    bind = bind if bind is not None else session.get_bind()
+    if bind.dialect.name == 'postgresql':
+        return postgresql.insert(entity)
+    return sqlite.insert(entity)
+
+def warmup(connections=DB_POOL_WARMUP, bind=None):
+    """Opens up to `connections` pooled connections (at most the pool
+    size) and returns them to the pool. Returns how many were opened.
+    Without `bind`, warms the primary and every replica."""
+    if bind is None:
+        return sum(warmup(connections, bind=e) for e in [engine, *replica_engines])
+    if not isinstance(bind.pool, QueuePool):
+        return 0
+    opened = []
+    try:
+        for _ in range(min(connections, bind.pool.size())):
+            opened.append(bind.connect())
+    except exc.SQLAlchemyError as e:
+        logger.warning(f"Database pool warmup stopped after {len(opened)} connections: {e}")
+    finally:
+        for conn in opened:
+            conn.close()
+    return len(opened)
+
+def pool_stats(bind=None):
+    """Current pool occupancy plus checkout wait counters for this process."""
+    if bind is None:
+        stats = pool_stats(engine)
+        if replica_engines:
+            stats["replicas"] = [pool_stats(e) for e in replica_engines]
+        if _async_engine is not None:
+            stats["async"] = pool_stats(_async_engine.sync_engine)
+        return stats
+    pool = (bind if bind is not None else engine).pool
+    if not isinstance(pool, QueuePool):
+        return {"pool": type(pool).__name__}
+    stats = {
+        "pool": type(pool).__name__,
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(0, pool.overflow()),
+    }
+    if isinstance(pool, InstrumentedQueuePool):
+        with pool._stats_lock:
+            stats.update({
+                "checkouts": pool.checkouts,
+                "timeouts": pool.timeouts,
+                "wait_avg_ms": round(1000 * pool.wait_total / pool.checkouts, 3) if pool.checkouts else 0.0,
+                "wait_max_ms": round(1000 * pool.wait_max, 3),
+            })
+    return stats
 
 class LennyBase:
     @classmethod
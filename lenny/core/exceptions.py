@@ -29,6 +29,12 @@ class ExistingLoanError(LennyAPIError): pass
 
 class LoanNotFoundError(LennyAPIError): pass
 
+class InvalidCursorError(LennyAPIError): pass
+
+class CircuitOpenError(LennyAPIError):
+    """Raised instead of calling an upstream service that is failing."""
+    pass
+
 class BookUnavailableError(LennyAPIError):
     """Raised when no copies are available for borrowing."""
     pass
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+"""
+    Background maintenance for Lenny.
+
+    Each worker runs a scheduler thread that wakes every MAINTENANCE_INTERVAL
+    seconds. A run takes a PostgreSQL advisory lock (so runs never overlap)
+    and then skips if any worker ran within the last interval (a marker kept
+    in Cache), so expired cache rows are purged once per interval in bounded
+    batches instead of inline in patron requests.
+
+    :copyright: (c) 2015 by AUTHORS
+    :license: see LICENSE for more details
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from sqlalchemy import text
+from lenny.configs import MAINTENANCE_INTERVAL, MAINTENANCE_BATCH_SIZE
+from lenny.core.db import engine, session as db
+from lenny.core.cache import Cache
+
+logger = logging.getLogger(__name__)
+
+
+class Maintenance:
+
+    INTERVAL = MAINTENANCE_INTERVAL
+    BATCH_SIZE = MAINTENANCE_BATCH_SIZE
+    # Caps how many batches one run deletes, so a backlog is spread over runs
+    MAX_BATCHES = 100
+    # Arbitrary app-wide key for pg_try_advisory_lock ("LENNY" in hex)
+    LOCK_ID = 0x4C454E4E59
+    # Cache scope of the "ran recently" marker shared by all workers
+    SCOPE = "maintenance"
+
+    _thread = None
+    _stop = threading.Event()
+    _stats = {
+        "runs": 0,
+        "skipped": 0,
+        "deleted": 0,
+        "last_run_at": None,
+        "last_deleted": 0,
+        "last_duration_ms": 0.0,
+    }
+
+    @classmethod
+    def start(cls):
+        """Starts this worker's scheduler thread (once)."""
+        if cls.INTERVAL <= 0 or (cls._thread and cls._thread.is_alive()):
+            return
+        cls._stop.clear()
+        cls._thread = threading.Thread(target=cls._loop, name="lenny-maintenance", daemon=True)
+        cls._thread.start()
+
+    @classmethod
+    def stop(cls, timeout=5):
+        cls._stop.set()
+        if cls._thread:
+            cls._thread.join(timeout)
+            cls._thread = None
+
+    @classmethod
+    def _loop(cls):
+        while not cls._stop.wait(cls.INTERVAL):
+            try:
+                cls.run_once()
+            except Exception as e:
+                logger.warning(f"Maintenance run failed: {e}")
+            finally:
+                db.remove()
+
+    @classmethod
+    @contextmanager
+    def leader(cls):
+        """Yields True if this worker holds the maintenance lock for the
+        block (always True off PostgreSQL, where there's one process)."""
+        if engine.dialect.name != "postgresql":
+            yield True
+            return
+        with engine.connect() as conn:
+            acquired = conn.execute(text("SELECT pg_try_advisory_lock(:id)"), {"id": cls.LOCK_ID}).scalar()
+            try:
+                yield bool(acquired)
+            finally:
+                if acquired:
+                    conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": cls.LOCK_ID})
+                conn.commit()
+
+    @classmethod
+    def run_once(cls):
+        """Purges expired cache rows if this worker is the leader and no
+        worker has run within INTERVAL. Returns the number of rows
+        deleted, or None if another worker is running or ran recently."""
+        with cls.leader() as is_leader:
+            if not is_leader or Cache.get(cls.SCOPE, "last_run"):
+                cls._stats["skipped"] += 1
+                return None
+            # Expires after INTERVAL, so the next run (by whichever worker
+            # wakes first) comes at least an interval after this one
+            Cache.set(cls.SCOPE, "last_run", datetime.now(timezone.utc).isoformat(), cls.INTERVAL)
+            start = time.perf_counter()
+            deleted = 0
+            for _ in range(cls.MAX_BATCHES):
+                batch = Cache.purge(cls.BATCH_SIZE)
+                deleted += batch
+                if batch < cls.BATCH_SIZE or cls._stop.is_set():
+                    break
+            duration_ms = round(1000 * (time.perf_counter() - start), 3)
+
+        cls._stats.update({
+            "runs": cls._stats["runs"] + 1,
+            "deleted": cls._stats["deleted"] + deleted,
+            "last_run_at": datetime.now(timezone.utc).isoformat(),
+            "last_deleted": deleted,
+            "last_duration_ms": duration_ms,
+        })
+        logger.info(f"Maintenance: purged {deleted} expired cache rows in {duration_ms} ms")
+        return deleted
+
+    @classmethod
+    def stats(cls):
+        return {**cls._stats, "interval": cls.INTERVAL, "running": bool(cls._thread and cls._thread.is_alive())}
@@ -8,13 +8,18 @@
     :license: see LICENSE for more details
 """
 
-from sqlalchemy import Column, String, Boolean, BigInteger, Integer, DateTime, Enum as SQLAlchemyEnum, Index
+from sqlalchemy import Column, String, Text, Boolean, BigInteger, Integer, DateTime, JSON, Enum as SQLAlchemyEnum, Index, CheckConstraint, or_, text, literal_column, update, select
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.sql import func
 from sqlalchemy import ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, contains_eager
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.ext.hybrid import hybrid_property
 from lenny.core.utils import hash_email
-from lenny.core.db import session as db, Base
+from lenny.configs import LENDABLE_COPIES
+from lenny.core.db import session as db, Base, BigIntegerID, dialect_insert, async_session, use_primary, expire_session
+from lenny.core.cache import ResponseCache
 from lenny.core.exceptions import (
     LoanNotRequiredError,
     LoanNotFoundError,
@@ -33,42 +38,46 @@ class FormatEnum(enum.Enum):
 class Item(Base):
     __tablename__ = 'items'
     __table_args__ = (
-        Index('idx_items_openlibrary_edition', 'openlibrary_edition'),
+        Index('idx_items_openlibrary_edition', 'openlibrary_edition', unique=True),
+        Index('idx_items_updated_at', 'updated_at'),
+        Index(
+            'idx_items_search_text',
+            text("to_tsvector('simple', coalesce(search_text, ''))"),
+            postgresql_using='gin',
+        ).ddl_if(dialect='postgresql'),
+        CheckConstraint('active_loans >= 0', name='ck_items_active_loans_nonnegative'),
     )
     
-    id = Column(BigInteger, primary_key=True)
+    id = Column(BigIntegerID, primary_key=True)
     openlibrary_edition = Column(BigInteger, nullable=False)
     encrypted = Column(Boolean, default= False, nullable=False)
     formats = Column(SQLAlchemyEnum(FormatEnum), nullable=False)
     created_at = Column(DateTime(timezone=True), default=func.now())
     updated_at = Column(DateTime(timezone=True), default=func.now(), onupdate=func.now())
+    # Local copy of the edition's Open Library metadata (see
+    # OpenLibraryRecord.to_metadata) so feeds can render without upstream calls
+    openlibrary_metadata = Column(JSON().with_variant(JSONB(), "postgresql"), nullable=True)
+    metadata_updated_at = Column(DateTime(timezone=True), nullable=True)
+    # Lowercased title, authors, subjects and identifiers (see search_document)
+    # backing the local /opds/search backend
+    search_text = Column(Text, nullable=True)
+    # Total lendable copies, and how many are out on loan. active_loans is
+    # kept in step with the loans table by borrow() and Loan.finalize()
+    num_lendable_total = Column(Integer, nullable=False, default=LENDABLE_COPIES, server_default=text('1'))
+    active_loans = Column(Integer, nullable=False, default=0, server_default=text('0'))
     
     @hybrid_property
     def is_login_required(self):
         """True if the item is encrypted and requires login."""
         return self.encrypted
-    
-    @hybrid_property
-    def num_lendable_total(self):
-        """Total number of lendable copies."""
-        return 1
 
     @hybrid_property
     def available_copies(self):
-        """Number of copies currently available for lending.
-
-        This queries the Loan table for active (not returned) loans
-        on this item and subtracts from `num_lendable_total`.
+        """Number of copies currently available for lending, from the
+        active_loans counter (no query against the loans table).
         """
-        try:
-            active_loans = db.query(Loan).filter(
-                Loan.item_id == getattr(self, "id"),
-                Loan.returned_at == None
-            ).count()
-            available = getattr(self, "num_lendable_total", 1) - active_loans
-            return max(0, int(available))
-        except Exception:
-            return int(getattr(self, "num_lendable_total", 1))
+        available = (self.num_lendable_total or 0) - (self.active_loans or 0)
+        return max(0, int(available))
 
     @hybrid_property
     def is_borrowable(self):
@@ -101,16 +110,116 @@ class Item(Base):
         """Always print disabled."""
         return True
 
+    @classmethod
+    def borrowable_map(cls, items):
+        """{openlibrary_edition: is_borrowable} for a page of items, read
+        from each item's loan counter so no queries are issued.
+        """
+        return {i.openlibrary_edition: bool(i.is_borrowable) for i in items}
+
     @classmethod
     def get_many(cls, offset=None, limit=None, encrypted=None):
         q = db.query(cls)
         if encrypted is not None:
             q = q.filter(cls.encrypted == encrypted)
-        return q.offset(offset).limit(limit).all()
+        return q.order_by(cls.id).offset(offset).limit(limit).all()
+
+    @classmethod
+    def get_page(cls, after=None, before=None, limit=None, encrypted=None):
+        """Keyset page ordered by id: the `limit` items following id
+        `after` or preceding id `before`, in ascending id order. Costs
+        the same at any depth, unlike OFFSET.
+        """
+        q = db.query(cls)
+        if encrypted is not None:
+            q = q.filter(cls.encrypted == encrypted)
+        if before is not None:
+            items = q.filter(cls.id < before).order_by(cls.id.desc()).limit(limit).all()
+            return items[::-1]
+        if after is not None:
+            q = q.filter(cls.id > after)
+        return q.order_by(cls.id).limit(limit).all()
 
     @classmethod
     def exists(cls, olid):
-        return db.query(Item).filter(Item.openlibrary_edition == olid).first()
+        # openlibrary_edition is unique, so this is a single index lookup
+        return db.query(Item).filter(Item.openlibrary_edition == olid).one_or_none()
+
+    @classmethod
+    async def aexists(cls, olid):
+        """exists() on the async engine; the Item is returned detached."""
+        async with async_session() as adb:
+            return (await adb.execute(
+                select(Item).where(Item.openlibrary_edition == olid)
+            )).scalar_one_or_none()
+
+    @classmethod
+    def claim(cls, olid, encrypted, formats, copies=None):
+        """Inserts an item for `olid` with a single INSERT ... ON CONFLICT
+        DO NOTHING. Returns the new Item, or None if the edition already
+        exists. Not committed: until the caller commits, the row is
+        invisible to feeds and borrows, and a concurrent claim of the same
+        edition waits on it (then gets None, or the row if this rolls back).
+        """
+        item = db.scalars(
+            dialect_insert(cls, db.get_bind())
+            .values(
+                openlibrary_edition=olid,
+                encrypted=encrypted,
+                formats=formats,
+                num_lendable_total=copies or LENDABLE_COPIES,
+            )
+            .on_conflict_do_nothing(index_elements=['openlibrary_edition'])
+            .returning(cls)
+        ).one_or_none()
+        return item
+
+    @classmethod
+    def get_by_editions(cls, olids):
+        """Return the items for a list of Open Library edition ids."""
+        if not olids:
+            return []
+        return db.query(cls).filter(cls.openlibrary_edition.in_(olids)).all()
+
+    @classmethod
+    def get_stale_metadata(cls, max_age, limit=None):
+        """Return items whose local metadata is missing or older than max_age seconds."""
+        cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=max_age)
+        return db.query(cls).filter(or_(
+            cls.metadata_updated_at == None,
+            cls.metadata_updated_at < cutoff,
+        )).limit(limit).all()
+
+    @staticmethod
+    def search_document(olid, metadata):
+        """Flattens an edition's local metadata into the text we index."""
+        metadata = metadata or {}
+        parts = [metadata.get("title")]
+        parts += [a.get("name") for a in metadata.get("authors") or []]
+        parts += metadata.get("subject") or []
+        parts += metadata.get("publisher") or []
+        parts += metadata.get("isbn") or []
+        parts += [f"OL{olid}M", (metadata.get("work_key") or "").rsplit("/", 1)[-1]]
+        return " ".join(str(p) for p in parts if p).lower()
+
+    @classmethod
+    def search(cls, query, offset=None, limit=None):
+        """Full-text search over search_text. On Postgres this uses the
+        GIN index and ranks by ts_rank_cd; elsewhere (SQLite in tests) every
+        term must appear as a substring and results are ordered by id.
+        """
+        q = db.query(cls)
+        if db.get_bind().dialect.name == "postgresql":
+            document = func.to_tsvector(
+                literal_column("'simple'"), func.coalesce(cls.search_text, literal_column("''")))
+            tsquery = func.websearch_to_tsquery(literal_column("'simple'"), query)
+            q = q.filter(document.op("@@")(tsquery)).order_by(
+                func.ts_rank_cd(document, tsquery).desc(), cls.id)
+        else:
+            for term in query.lower().split():
+                q = q.filter(cls.search_text.contains(term, autoescape=True))
+            q = q.order_by(cls.id)
+        return q.offset(offset).limit(limit).all()
 
     @classmethod
     def get_all(cls):
@@ -125,10 +234,25 @@ class Item(Base):
         if not email:
             raise EmailNotFoundError("Email required to borrow encrypted items.")
 
+        # A replica may not have the loan yet
+        use_primary()
         if loan := Loan.exists(self.id, email):
             return loan.finalize()
 
         raise LoanNotFoundError("Patron has no active loan for this book.")
+
+    async def aunborrow(self, email: str):
+        """unborrow() on the async engine."""
+        if not self.is_login_required:
+            raise LoanNotRequiredError
+
+        if not email:
+            raise EmailNotFoundError("Email required to borrow encrypted items.")
+
+        if loan := await Loan.aexists(self.id, email):
+            return await loan.afinalize()
+
+        raise LoanNotFoundError("Patron has no active loan for this book.")
     
     def is_encrypted_item(self):
         return self.encrypted
@@ -155,14 +279,85 @@ class Item(Base):
             raise EmailNotFoundError("Email is required to borrow encrypted items.")
 
         hashed_email = hash_email(email)
-        
+
+        # A replica may not have this patron's latest loan yet
+        use_primary()
         if active_loan := Loan.exists(self.id, hashed_email, hashed=True):
             return active_loan
-        
-        if not self.is_borrowable:
+
+        if not self.claim_copy():
             raise BookUnavailableError("No copies available for borrowing.")
-        
-        return Loan.create(self.id, hashed_email, hashed=True)
+
+        # Commits the claimed copy and the loan together
+        try:
+            loan = Loan.create(self.id, hashed_email, hashed=True)
+        except IntegrityError as e:
+            # A concurrent borrow by the same patron won; the claim was
+            # rolled back with the insert, so return that loan instead
+            if active_loan := Loan.exists(self.id, hashed_email, hashed=True):
+                return active_loan
+            raise DatabaseInsertError(f"Failed to create loan record: {str(e)}.")
+        ResponseCache.bump()
+        return loan
+
+    async def aborrow(self, email: str):
+        """borrow() on the async engine: the copy is claimed and the loan
+        inserted in one transaction on an AsyncSession."""
+        if not self.is_login_required:
+            raise LoanNotRequiredError
+
+        if not email:
+            raise EmailNotFoundError("Email is required to borrow encrypted items.")
+
+        hashed_email = hash_email(email)
+
+        if active_loan := await Loan.aexists(self.id, hashed_email, hashed=True):
+            return active_loan
+
+        async with async_session() as adb:
+            active_loans = (await adb.execute(self._claim_statement())).scalar()
+            if active_loans is None:
+                await adb.rollback()
+                raise BookUnavailableError("No copies available for borrowing.")
+            loan = Loan(item_id=self.id, patron_email_hash=hashed_email)
+            adb.add(loan)
+            try:
+                await adb.commit()
+            except IntegrityError as e:
+                # Lost a race with the same patron's borrow (see borrow)
+                await adb.rollback()
+                if active_loan := await Loan.aexists(self.id, hashed_email, hashed=True):
+                    return active_loan
+                raise DatabaseInsertError(f"Failed to create loan record: {str(e)}.")
+            except Exception as e:
+                await adb.rollback()
+                raise DatabaseInsertError(f"Failed to create loan record: {str(e)}.")
+        set_committed_value(self, 'active_loans', active_loans)
+        # The sync session may hold this item with the old counter
+        expire_session()
+        await ResponseCache.abump()
+        return loan
+
+    def _claim_statement(self):
+        return (
+            update(Item)
+            .where(Item.id == self.id, Item.active_loans < Item.num_lendable_total)
+            .values(active_loans=Item.active_loans + 1)
+            .returning(Item.active_loans)
+            .execution_options(synchronize_session=False)
+        )
+
+    def claim_copy(self):
+        """Atomically takes a copy with a single conditional UPDATE, so
+        concurrent borrows can never exceed num_lendable_total. Returns
+        False (and rolls back) if no copy was free. Not committed.
+        """
+        active_loans = db.execute(self._claim_statement()).scalar()
+        if active_loans is None:
+            db.rollback()
+            return False
+        set_committed_value(self, 'active_loans', active_loans)
+        return True
 
 
 class Loan(Base):
@@ -170,9 +365,23 @@ class Loan(Base):
     __table_args__ = (
         Index('idx_loans_item_patron_returned', 'item_id', 'patron_email_hash', 'returned_at'),
         Index('idx_loans_item_returned', 'item_id', 'returned_at'),
+        # Patron-scoped lookups (shelf, profile) only ever want active loans
+        Index(
+            'idx_loans_patron_active', 'patron_email_hash',
+            postgresql_where=text('returned_at IS NULL'),
+            sqlite_where=text('returned_at IS NULL'),
+        ),
+        # A patron holds at most one active loan per item, even when two
+        # borrows race past the Loan.exists check
+        Index(
+            'uq_loans_item_patron_active', 'item_id', 'patron_email_hash',
+            unique=True,
+            postgresql_where=text('returned_at IS NULL'),
+            sqlite_where=text('returned_at IS NULL'),
+        ),
     )
 
-    id = Column(BigInteger, primary_key=True)
+    id = Column(BigIntegerID, primary_key=True)
     item_id = Column(BigInteger, ForeignKey('items.id'), nullable=False)
     patron_email_hash = Column(String, nullable=False)
     created_at = Column(DateTime(timezone=True), default=func.now())
@@ -189,6 +398,39 @@ class Loan(Base):
             Loan.returned_at == None
         ).first()
 
+    @classmethod
+    async def aexists(cls, item_id, email, hashed=False):
+        """exists() on the async engine; the Loan is returned detached."""
+        hashed_email = email if hashed else hash_email(email)
+        async with async_session() as adb:
+            return (await adb.execute(
+                select(Loan).where(
+                    Loan.item_id == item_id,
+                    Loan.patron_email_hash == hashed_email,
+                    Loan.returned_at == None
+                ).limit(1)
+            )).scalar_one_or_none()
+
+    @classmethod
+    def get_active(cls, email, hashed=False):
+        """A patron's active loans, each with its Item loaded by the same
+        (joined) query.
+        """
+        hashed_email = email if hashed else hash_email(email)
+        return db.query(Loan).join(Loan.item).options(contains_eager(Loan.item)).filter(
+            Loan.patron_email_hash == hashed_email,
+            Loan.returned_at == None
+        ).all()
+
+    @classmethod
+    def count_active(cls, email, hashed=False):
+        """Number of a patron's active loans, without loading them."""
+        hashed_email = email if hashed else hash_email(email)
+        return db.query(func.count(Loan.id)).filter(
+            Loan.patron_email_hash == hashed_email,
+            Loan.returned_at == None
+        ).scalar()
+
     @classmethod
     def create(cls, item_id, email, hashed=False):
         hashed_email = email if hashed else hash_email(email)
@@ -197,17 +439,63 @@ class Loan(Base):
             db.add(loan)
             db.commit()
             return loan
+        except IntegrityError:
+            # e.g. the patron already has an active loan (see borrow)
+            db.rollback()
+            raise
         except Exception as e:
             db.rollback()
             raise DatabaseInsertError(f"Failed to create loan record: {str(e)}.")
     def finalize(self):
+        """Marks the loan returned and releases the item's copy. The loan
+        row is only updated while still active, so a loan returned twice
+        concurrently decrements the counter once.
+        """
         try:
-            self.returned_at = datetime.datetime.utcnow()
-            db.add(self)
+            returned = db.execute(self._return_statement()).scalar()
+            if returned is not None:
+                db.execute(self._release_statement())
             db.commit()
-            return self
+            db.refresh(self)
         except Exception as e:
             db.rollback()
             raise DatabaseInsertError(f"Failed to return loan: {str(e)}.")
+        if returned is not None:
+            ResponseCache.bump()
+        return self
+
+    async def afinalize(self):
+        """finalize() on the async engine. Returns the updated Loan."""
+        async with async_session() as adb:
+            try:
+                returned = (await adb.execute(self._return_statement())).scalar()
+                if returned is not None:
+                    await adb.execute(self._release_statement())
+                await adb.commit()
+            except Exception as e:
+                await adb.rollback()
+                raise DatabaseInsertError(f"Failed to return loan: {str(e)}.")
+            loan = await adb.get(Loan, self.id)
+        if returned is not None:
+            expire_session()
+            await ResponseCache.abump()
+        return loan
+
+    def _return_statement(self):
+        return (
+            update(Loan)
+            .where(Loan.id == self.id, Loan.returned_at == None)
+            .values(returned_at=datetime.datetime.utcnow())
+            .returning(Loan.id)
+            .execution_options(synchronize_session=False)
+        )
+
+    def _release_statement(self):
+        return (
+            update(Item)
+            .where(Item.id == self.item_id, Item.active_loans > 0)
+            .values(active_loans=Item.active_loans - 1)
+            .execution_options(synchronize_session=False)
+        )
 
 Item.loans = relationship('Loan', back_populates='item', cascade='all, delete-orphan')
@@ -1,9 +1,23 @@
+import asyncio
 import httpx
-from typing import List, Generator, Optional, Dict, Any
+import hashlib
+import json
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from typing import List, Generator, AsyncGenerator, Optional, Dict, Any
 from urllib.parse import urlencode
 import logging
 
-from lenny.configs import LENNY_HTTP_HEADERS
+from lenny.configs import (
+    LENNY_HTTP_HEADERS, OL_CACHE_TTL, OL_CACHE_STALE_TTL, OL_MAX_CONNECTIONS,
+    OL_BREAKER_FAILURES, OL_BREAKER_LATENCY, OL_BREAKER_RESET,
+)
+from lenny.core.cache import Cache
+from lenny.core.circuitbreaker import CircuitBreaker
+from lenny.core.exceptions import CircuitOpenError
+from lenny.core.utils import run_in_background
 
 logger = logging.getLogger(__name__)
 
@@ -12,17 +26,124 @@ class OpenLibrary:
     SEARCH_URL = "https://openlibrary.org/search.json"
     HTTP_HEADERS = LENNY_HTTP_HEADERS
     HTTP_TIMEOUT = 10
+    HTTP_LIMITS = httpx.Limits(
+        max_connections=OL_MAX_CONNECTIONS,
+        max_keepalive_connections=OL_MAX_CONNECTIONS,
+        keepalive_expiry=30,
+    )
     DEFAULT_FIELDS = [
         'key', 'title', 'author_key', 'author_name', 'editions', 'editions.*',
     ]
+    # Named field projections; callers pick the smallest one they need
+    FIELD_PROFILES = {
+        # Just enough to tell which of our editions a work matched
+        'membership': ['key', 'editions', 'editions.key'],
+        # Title, authors and cover for a feed entry
+        'card': [
+            'key', 'title', 'author_key', 'author_name', 'editions',
+            'editions.key', 'editions.title', 'editions.cover_i', 'editions.language',
+        ],
+        'full': DEFAULT_FIELDS,
+    }
+    DEFAULT_PROFILE = 'full'
     COVER_SERVER = "https://covers.openlibrary.org"
-    
+    CACHE_SCOPE = "ol:search"
+    CACHE_TTL = OL_CACHE_TTL
+    CACHE_STALE_TTL = OL_CACHE_STALE_TTL
+    BREAKER = CircuitBreaker(
+        "openlibrary",
+        failure_threshold=OL_BREAKER_FAILURES,
+        latency_budget=OL_BREAKER_LATENCY,
+        reset_timeout=OL_BREAKER_RESET,
+    )
+    CACHE_STATS = Counter(hits=0, stale=0, misses=0, coalesced=0)
+    _revalidating = set()
+    _revalidating_lock = threading.Lock()
+    _client: Optional[httpx.Client] = None
+    _async_client: Optional[httpx.AsyncClient] = None
+    _async_client_loop: Optional[asyncio.AbstractEventLoop] = None
+    _client_lock = threading.Lock()
+    # In-flight upstream requests by URL, shared by concurrent callers
+    _inflight: Dict[str, Future] = {}
+    _inflight_lock = threading.Lock()
+    _ainflight: Dict[Any, "asyncio.Task"] = {}
+
+    @classmethod
+    def client(cls) -> httpx.Client:
+        """Process-wide pooled client; keeps HTTP/2 connections to
+        openlibrary.org alive across searches instead of paying TCP+TLS
+        setup per page.
+        """
+        if cls._client is None:
+            with cls._client_lock:
+                if cls._client is None:
+                    cls._client = httpx.Client(
+                        http2=True,
+                        headers=cls.HTTP_HEADERS,
+                        timeout=cls.HTTP_TIMEOUT,
+                        limits=cls.HTTP_LIMITS,
+                    )
+        return cls._client
+
+    @classmethod
+    def async_client(cls) -> httpx.AsyncClient:
+        """Process-wide pooled async client, bound to the running event loop.
+        A client left over from a previous loop is closed, not leaked.
+        """
+        loop = asyncio.get_running_loop()
+        if cls._async_client is None or cls._async_client_loop is not loop:
+            if cls._async_client is not None:
+                cls._discard_async_client(cls._async_client, cls._async_client_loop)
+            cls._async_client = httpx.AsyncClient(
+                http2=True,
+                headers=cls.HTTP_HEADERS,
+                timeout=cls.HTTP_TIMEOUT,
+                limits=cls.HTTP_LIMITS,
+            )
+            cls._async_client_loop = loop
+        return cls._async_client
+
+    @classmethod
+    def _discard_async_client(cls, client, loop):
+        """Closes `client` on its own loop if that is still running, else
+        (best effort) on the current one."""
+        async def close():
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.debug(f"Error closing stale Open Library client: {e}")
+
+        if loop is not None and loop.is_running() and not loop.is_closed():
+            asyncio.run_coroutine_threadsafe(close(), loop)
+        else:
+            asyncio.ensure_future(close())
+
+    @classmethod
+    async def aclose(cls):
+        """Closes the pooled clients; called on application shutdown."""
+        if cls._async_client is not None:
+            await cls._async_client.aclose()
+            cls._async_client = cls._async_client_loop = None
+        with cls._client_lock:
+            if cls._client is not None:
+                cls._client.close()
+                cls._client = None
+
+    @classmethod
+    def fields_for(cls, profile: Optional[str] = None, fields: Optional[List[str]] = None) -> List[str]:
+        """The fields of a named profile (DEFAULT_PROFILE if None) plus
+        any extra `fields`, sorted and de-duplicated.
+        """
+        return sorted(set(cls.FIELD_PROFILES[profile or cls.DEFAULT_PROFILE] + (fields or [])))
+
     @classmethod
     def _construct_search_url(cls, query: str, fields: Optional[List[str]] = None, page: int = 1, limit: int = 100) -> str:
-        fields = list(set(cls.DEFAULT_FIELDS + (fields or [])))
+        """`fields` is the exact field list (see fields_for); None means
+        the default profile.
+        """
         params = {
             'q': query,
-            'fields': ','.join(fields),
+            'fields': ','.join(fields or cls.fields_for()),
             'page': page,
             'limit': limit
         }
@@ -36,13 +157,14 @@ class OpenLibrary:
         offset: int = 0,
         limit: int = 100,
         max_results: Optional[int] = None,
+        profile: Optional[str] = None,
     ) -> Generator["OpenLibraryRecord", None, None]:
         page = offset // limit + 1
         start_doc = (offset % limit)
         num_yielded = 0
         
         while True:
-            data = cls.search_json(query, fields=fields, page=page, limit=limit)
+            data = cls.search_json(query, fields=fields, page=page, limit=limit, profile=profile)
             docs = data.get("docs", []) if isinstance(data, dict) else []
             page += 1
 
@@ -60,47 +182,332 @@ class OpenLibrary:
                 break
 
     @classmethod
-    def search_json(cls, query: str, fields: Optional[List[str]] = None, page: int = 1, limit: int = 100) -> Dict[str, Any]:
+    async def asearch(
+        cls,
+        query: str,
+        fields: Optional[List[str]] = None,
+        offset: int = 0,
+        limit: int = 100,
+        max_results: Optional[int] = None,
+        profile: Optional[str] = None,
+    ) -> AsyncGenerator["OpenLibraryRecord", None]:
+        """Async counterpart of `search`; pages are fetched with the
+        shared AsyncClient so the event loop is free while waiting.
+        """
+        page = offset // limit + 1
+        start_doc = (offset % limit)
+        num_yielded = 0
+
+        while True:
+            data = await cls.asearch_json(query, fields=fields, page=page, limit=limit, profile=profile)
+            docs = data.get("docs", []) if isinstance(data, dict) else []
+            page += 1
+
+            if start_doc is not None:
+                docs = docs[start_doc:]
+                start_doc = None
+
+            for doc in docs:
+                yield OpenLibraryRecord(doc)
+                num_yielded += 1
+                if max_results and num_yielded >= max_results:
+                    return
+
+            if not docs or len(docs) < limit:
+                break
+
+    @classmethod
+    def search_json(cls, query: str, fields: Optional[List[str]] = None, page: int = 1, limit: int = 100, profile: Optional[str] = None) -> Dict[str, Any]:
+        """Cached search: fresh entries are returned as-is, stale entries
+        are returned immediately while a background thread refreshes them,
+        and misses go upstream. Requests the `profile` fields plus `fields`.
+        """
+        fields = cls.fields_for(profile, fields)
+        key, data = cls._cache_lookup(query, fields, page, limit)
+        if data is not None:
+            return data
+        data = cls._fetch_json(query, fields, page, limit)
+        if key and data:
+            cls._cache_set(key, data)
+        return data
+
+    @classmethod
+    async def asearch_json(cls, query: str, fields: Optional[List[str]] = None, page: int = 1, limit: int = 100, profile: Optional[str] = None) -> Dict[str, Any]:
+        """Async counterpart of `search_json`, sharing the same cache. Cache
+        reads and writes go to a worker thread so they don't block the loop.
+        """
+        fields = cls.fields_for(profile, fields)
+        key, data = await asyncio.to_thread(cls._cache_lookup, query, fields, page, limit)
+        if data is not None:
+            return data
+        data = await cls._afetch_json(query, fields, page, limit)
+        if key and data:
+            await asyncio.to_thread(cls._cache_set, key, data)
+        return data
+
+    @classmethod
+    def _cache_lookup(cls, query, fields, page, limit):
+        """Returns `(key, data)`; `data` is None on a miss and `key` is
+        None when caching is disabled. Stale hits schedule a refresh.
+        """
+        if cls.CACHE_TTL <= 0:
+            return None, None
+
+        key = cls._cache_key(query, fields, page, limit)
+        if cached := cls._cache_get(key):
+            fetched_at, data = cached
+            if time.time() - fetched_at < cls.CACHE_TTL:
+                cls.CACHE_STATS['hits'] += 1
+            else:
+                cls.CACHE_STATS['stale'] += 1
+                # While Open Library is down, keep serving stale data as-is
+                if not cls.BREAKER.is_open:
+                    cls._revalidate(key, query, fields, page, limit)
+            return key, data
+
+        cls.CACHE_STATS['misses'] += 1
+        return key, None
+
+    @classmethod
+    def _fetch_json(cls, query: str, fields: Optional[List[str]] = None, page: int = 1, limit: int = 100) -> Dict[str, Any]:
+        """Single-flight GET: concurrent calls for the same URL in this
+        process wait on the first caller's request instead of issuing
+        their own. Across workers, the shared cache absorbs repeats.
+        """
+        url = cls._construct_search_url(query, fields, page, limit)
+        with cls._inflight_lock:
+            future = cls._inflight.get(url)
+            leader = future is None
+            if leader:
+                future = cls._inflight[url] = Future()
+            else:
+                cls.CACHE_STATS['coalesced'] += 1
+        if not leader:
+            return future.result()
+
+        try:
+            data = cls._get_json(url)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(data)
+        finally:
+            with cls._inflight_lock:
+                del cls._inflight[url]
+        return data
+
+    @classmethod
+    async def _afetch_json(cls, query: str, fields: Optional[List[str]] = None, page: int = 1, limit: int = 100) -> Dict[str, Any]:
+        """Async single-flight counterpart of `_fetch_json`; requests are
+        shared per event loop.
+        """
         url = cls._construct_search_url(query, fields, page, limit)
+        key = (asyncio.get_running_loop(), url)
+        if task := cls._ainflight.get(key):
+            cls.CACHE_STATS['coalesced'] += 1
+        else:
+            task = cls._ainflight[key] = asyncio.ensure_future(cls._aget_json(url))
+            task.add_done_callback(lambda _: cls._ainflight.pop(key, None))
+        # Shield so one caller being cancelled doesn't cancel the others
+        return await asyncio.shield(task)
+
+    @classmethod
+    def _get_json(cls, url: str) -> Dict[str, Any]:
+        """GET through BREAKER: transport errors, 5xx responses and slow
+        calls count against it, and while it is open this returns {}
+        immediately instead of waiting on HTTP_TIMEOUT.
+        """
+        try:
+            with cls.BREAKER.track():
+                response = cls.client().get(url)
+                if response.is_server_error:
+                    response.raise_for_status()
+            response.raise_for_status()
+            return response.json()
+        except CircuitOpenError:
+            return {}
+        except (httpx.HTTPError, ValueError) as e:
+            logger.error(f"Error searching Open Library: {e}")
+            return {}
+
+    @classmethod
+    async def _aget_json(cls, url: str) -> Dict[str, Any]:
         try:
-            with httpx.Client() as client:
-                response = client.get(url, headers=cls.HTTP_HEADERS, timeout=cls.HTTP_TIMEOUT)
-                response.raise_for_status()
-                return response.json()
+            with cls.BREAKER.track():
+                response = await cls.async_client().get(url)
+                if response.is_server_error:
+                    response.raise_for_status()
+            response.raise_for_status()
+            return response.json()
+        except CircuitOpenError:
+            return {}
         except (httpx.HTTPError, ValueError) as e:
             logger.error(f"Error searching Open Library: {e}")
             return {}
 
+    @classmethod
+    def _fetch_and_store(cls, key, query, fields, page, limit) -> Dict[str, Any]:
+        data = cls._fetch_json(query, fields, page, limit)
+        if data:
+            cls._cache_set(key, data)
+        return data
+
+    @classmethod
+    def _revalidate(cls, key, query, fields, page, limit):
+        """Refresh a stale entry in the background, once per key at a time."""
+        with cls._revalidating_lock:
+            if key in cls._revalidating:
+                return
+            cls._revalidating.add(key)
+
+        def refresh():
+            try:
+                cls._fetch_and_store(key, query, fields, page, limit)
+            finally:
+                with cls._revalidating_lock:
+                    cls._revalidating.discard(key)
+
+        run_in_background(refresh)
+
+    @classmethod
+    def _cache_key(cls, query: str, fields: Optional[List[str]], page: int, limit: int) -> str:
+        """Hash of the whitespace-normalized query, the exact field list,
+        page and limit; identical searches share one entry.
+        """
+        fields = ','.join(sorted(set(fields or cls.fields_for())))
+        query = ' '.join(query.split())
+        return hashlib.sha256(f"{query}|{fields}|{page}|{limit}".encode('utf-8')).hexdigest()
+
+    @classmethod
+    def _cache_get(cls, key):
+        if value := Cache.get(cls.CACHE_SCOPE, key):
+            try:
+                entry = json.loads(value)
+                return entry['fetched_at'], entry['data']
+            except (ValueError, KeyError, TypeError):
+                return None
+        return None
+
+    @classmethod
+    def _cache_set(cls, key, data):
+        value = json.dumps({"fetched_at": time.time(), "data": data})
+        Cache.set(cls.CACHE_SCOPE, key, value, cls.CACHE_TTL + cls.CACHE_STALE_TTL)
+
+    @classmethod
+    def stats(cls) -> Dict[str, Any]:
+        """Cache hit/miss counters for this worker process; `coalesced`
+        counts fetches that joined an identical in-flight request.
+        """
+        stats = {k: cls.CACHE_STATS[k] for k in ('hits', 'stale', 'misses', 'coalesced')}
+        lookups = stats['hits'] + stats['stale'] + stats['misses']
+        stats['hit_ratio'] = round((stats['hits'] + stats['stale']) / lookups, 4) if lookups else None
+        stats['breaker'] = cls.BREAKER.stats()
+        return stats
+
     
+class OpenLibraryID(str):
+    """An edition key of the re form `OL[0-9]+M` which, when cast to
+    int, returns only the [0-9]+ value
+    """
+    __slots__ = ()
+
+    def __int__(self):
+        # e.g., "OL123M" -> 123
+        return int(self.strip("OLM"))
+
+
+class RecordList(list):
+    """List whose dict items have already been wrapped as records."""
+    __slots__ = ()
+
+
+_UNSET = object()
+
+
 class OpenLibraryRecord(dict):
+    """A search.json doc with attribute access. Nested dicts and lists
+    are wrapped lazily, on first access, and the wrapped value replaces
+    the raw one so it is only converted once. The derived `edition`,
+    `olid` and `cover_url` values are cached per record.
+    """
+    __slots__ = ('_edition', '_olid', '_cover_url')
+
     def __init__(self, data=None, **kwargs):
-        data = data or {}
-        super().__init__()
-        for key, value in {**data, **kwargs}.items():
-            self[key] = self._wrap(value)
+        super().__init__(data or {}, **kwargs)
+        self._reset()
+
+    def _reset(self):
+        object.__setattr__(self, '_edition', _UNSET)
+        object.__setattr__(self, '_olid', _UNSET)
+        object.__setattr__(self, '_cover_url', _UNSET)
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        if type(value) is dict or type(value) is list:
+            value = self._wrap(value)
+            super().__setitem__(key, value)
+        return value
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        if key == 'editions':
+            self._reset()
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
 
     @property
     def cover_url(self) -> Optional[str]:
-        if cover_i := self.edition.get('cover_i'):
-            return f"{OpenLibrary.COVER_SERVER}/b/id/{cover_i}-M.jpg"
-    
+        if self._cover_url is _UNSET:
+            cover_i = self.edition.get('cover_i')
+            url = f"{OpenLibrary.COVER_SERVER}/b/id/{cover_i}-M.jpg" if cover_i else None
+            object.__setattr__(self, '_cover_url', url)
+        return self._cover_url
+
     @property
     def edition(self) -> Optional[str]:
-        return self.editions['docs'][0]
-        
+        """The first matching edition; AttributeError if the work has none."""
+        if self._edition is _UNSET:
+            try:
+                edition = self['editions']['docs'][0]
+            except (KeyError, IndexError, TypeError):
+                raise AttributeError("'OpenLibraryRecord' object has no attribute 'edition'")
+            object.__setattr__(self, '_edition', edition)
+        return self._edition
+
     @property
     def olid(self) -> Optional[str]:
-        """Uses a helper class OpenLibraryID to return a special
-        string of the re form `OL[0-9]+M` which, when cast to int will
-        return only the [0-9]+ value
+        """The edition's id as an OpenLibraryID, e.g. int(olid) -> 123"""
+        if self._olid is _UNSET:
+            try:
+                key = self.edition['key']
+            except KeyError:
+                raise AttributeError("'OpenLibraryRecord' object has no attribute 'olid'")
+            object.__setattr__(self, '_olid', OpenLibraryID(key.split('/')[-1]))
+        return self._olid
+
+    def to_metadata(self) -> Dict[str, Any]:
+        """Compact, JSON-serializable summary of this record and its
+        edition; stored on Items so feeds can render from local data.
         """
-        class OpenLibraryID(str):
-            def __new__(cls, value):
-                return super().__new__(cls, value)
-            def __int__(self):
-                # e.g., "OL123M" -> 123
-                return int(self.strip("OLM"))
-        return OpenLibraryID(self.edition.key.split('/')[-1])
+        edition = self.edition
+        author_keys = self.get('author_key') or []
+        return {
+            "title": edition.get('title') or self.get('title'),
+            "work_key": self.get('key'),
+            "edition_key": edition.get('key'),
+            "authors": [
+                {"name": name, "key": author_keys[i] if i < len(author_keys) else None}
+                for i, name in enumerate(self.get('author_name') or [])
+            ],
+            "cover_i": edition.get('cover_i'),
+            "language": edition.get('language') or [],
+            "publisher": edition.get('publisher') or [],
+            "publish_date": (edition.get('publish_date') or [None])[0],
+            "subject": (self.get('subject') or [])[:25],
+            "isbn": edition.get('isbn') or [],
+        }
 
     @property
     def standardebooks_id(self):
@@ -113,13 +520,10 @@ class OpenLibraryRecord(dict):
         try:
             return self[key]
         except KeyError:
-            try:
-                return super().__getattribute__(key)
-            except AttributeError:
-                raise AttributeError(f"'OpenLibraryRecord' object has no attribute '{key}'")
+            raise AttributeError(f"'OpenLibraryRecord' object has no attribute '{key}'")
 
     def __setattr__(self, key, value):
-        self[key] = self._wrap(value)
+        self[key] = value
 
     def __delattr__(self, key):
         try:
@@ -136,8 +540,11 @@ class OpenLibraryRecord(dict):
 
     @classmethod
     def _wrap(cls, value):
-        if isinstance(value, dict):
+        """Shallowly wraps a raw dict or list; its own nested values are
+        left raw until they are accessed.
+        """
+        if type(value) is dict:
             return cls(value)
-        elif isinstance(value, list):
-            return [cls._wrap(v) for v in value]
+        elif type(value) is list:
+            return RecordList(cls._wrap(v) for v in value)
         return value
@@ -1,6 +1,9 @@
 import base64
 import hashlib
 import logging
+import threading
+from lenny.core.db import session
+from lenny.core.exceptions import InvalidCursorError
 
 logger = logging.getLogger(__name__)
 
@@ -15,3 +18,33 @@ def encode_book_path(book_id: str, format=".epub") -> str:
 
 def hash_email(email: str) -> str:
     return hashlib.sha256(email.strip().lower().encode('utf-8')).hexdigest()
+
+def encode_cursor(direction: str, value: int) -> str:
+    """Opaque pagination cursor, e.g. ('after', 42) -> 'YWZ0ZXI6NDI'"""
+    return base64.urlsafe_b64encode(f"{direction}:{value}".encode()).decode().rstrip('=')
+
+def decode_cursor(cursor: str):
+    """Inverse of encode_cursor: returns (direction, int value)."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        direction, value = base64.urlsafe_b64decode(padded.encode()).decode().split(':')
+        if direction not in ('after', 'before'):
+            raise ValueError(direction)
+        return direction, int(value)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursorError(f"Invalid cursor: {cursor}") from e
+
+def run_in_background(func, *args, **kwargs) -> threading.Thread:
+    """Runs `func` in a daemon thread, releasing the thread's db session
+    when it finishes so background work never holds a pooled connection.
+    """
+    def target():
+        try:
+            func(*args, **kwargs)
+        except Exception as e:
+            logger.warning(f"Background task {func.__name__} failed: {e}")
+        finally:
+            session.remove()
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread
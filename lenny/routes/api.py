@@ -30,7 +30,7 @@ from fastapi.responses import (
     Response,
     JSONResponse,
 )
-from lenny.core import auth
+from lenny.core import auth, database
 from lenny.core.api import LennyAPI
 from lenny import configs
 from pyopds2_lenny import LennyDataProvider, build_post_borrow_publication, LennyDataRecord
@@ -45,9 +45,13 @@ from lenny.core.exceptions import (
     S3UploadError,
     UploaderNotAllowedError,
     BookUnavailableError,
+    InvalidCursorError,
 )
 from lenny.core.readium import ReadiumAPI
-from lenny.core.models import Item
+from lenny.core.openlibrary import OpenLibrary
+from lenny.core.cache import ResponseCache
+from lenny.core.catalog import CatalogIndex
+from lenny.core.maintenance import Maintenance
 from urllib.parse import quote
 COOKIES_MAX_AGE = 604800  # 1 week
 
@@ -94,6 +98,15 @@ def is_direct_auth_mode(auth_mode: Optional[str] = None, beta: bool = False) ->
 # OTP email-based rate limiting remains in auth.py via Cache.is_throttled.
 router = APIRouter()
 
+async def opds_cache_key(endpoint, params, auth_mode_direct, email=None):
+    """ResponseCache key for an OPDS document, or None if it mustn't be
+    cached: patron-specific (signed in) or about to be rendered while Open
+    Library is unreachable. Feeds that degrade while rendering are caught
+    by LennyAPI.feed_degraded."""
+    if email or OpenLibrary.BREAKER.is_open:
+        return None
+    return await ResponseCache.akey(endpoint, params, auth_mode_direct)
+
 def requires_item_auth(do_function=None):
     """
     Decorator checks item existence and gets email of
@@ -107,8 +120,8 @@ def requires_item_auth(do_function=None):
                 email=None, item=None, *args, **kwargs):
             session = extract_session(request, session)
 
-            if item := Item.exists(book_id):
-                result = LennyAPI.auth_check(item, session=session, request=request)
+            if item := await LennyAPI.aget_item(book_id):
+                result = await LennyAPI.aauth_check(item, session=session, request=request)
                 email = result.get('email', '')
                 if 'error' in result:
                     return JSONResponse(
@@ -135,36 +148,76 @@ async def health():
     return {"status": "ok"}
 
 @router.get("/items")
-async def get_items(fields: Optional[str]=None, offset: Optional[int]=None, limit: Optional[int]=None, encrypted: Optional[bool]=None):
-    fields = fields.split(",") if fields else None
-    return LennyAPI.get_enriched_items(
-        fields=fields, offset=offset, limit=limit, encrypted=encrypted
-    )
+async def get_items(response: Response, fields: Optional[str]=None, offset: Optional[int]=None, limit: Optional[int]=None, encrypted: Optional[bool]=None, cursor: Optional[str]=None):
+    """
+    Lists items. Pages are keyset-paginated: follow the `next`/`previous`
+    cursors in the Link header. An explicit `offset` pages the old way.
+    """
+    field_list = fields.split(",") if fields else None
+    # Card fields (title, authors, cover) plus any requested `fields`
+    if offset is not None:
+        return await LennyAPI.aget_enriched_items(
+            fields=field_list, offset=offset, limit=limit, encrypted=encrypted, profile='card'
+        )
+    try:
+        items, cursors = await LennyAPI.aget_enriched_page(
+            cursor=cursor, fields=field_list, limit=limit, encrypted=encrypted, profile='card'
+        )
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    params = {k: v for k, v in (("fields", fields), ("limit", limit), ("encrypted", encrypted)) if v is not None}
+    links = [
+        f'<{LennyAPI.make_url("/v1/api/items?" + urlencode({**params, "cursor": value}))}>; rel="{rel}"'
+        for rel, value in cursors.items() if value
+    ]
+    if links:
+        response.headers["Link"] = ", ".join(links)
+    return items
 
 @router.get("/opds")
-async def get_opds_catalog(request: Request, offset: Optional[int]=None, limit: Optional[int]=None, beta: bool = False, auth_mode: Optional[str] = None, session: Optional[str] = Cookie(None)):
+async def get_opds_catalog(request: Request, offset: Optional[int]=None, limit: Optional[int]=None, cursor: Optional[str]=None, beta: bool = False, auth_mode: Optional[str] = None, session: Optional[str] = Cookie(None)):
     session = extract_session(request, session)
     email = get_authenticated_email(request, session)
-    
+    auth_mode_direct = is_direct_auth_mode(auth_mode, beta)
+
+    cache_key = await opds_cache_key("opds", {"offset": offset, "limit": limit, "cursor": cursor}, auth_mode_direct, email)
+    if content := await ResponseCache.aget(cache_key):
+        return Response(content=content, media_type="application/opds+json")
+    try:
+        feed = LennyAPI.opds_feed(offset=offset, limit=limit, cursor=cursor, auth_mode_direct=auth_mode_direct, email=email)
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    content = json.dumps(feed)
+    if not LennyAPI.feed_degraded():
+        await ResponseCache.aset(cache_key, content)
     return Response(
-        content=json.dumps(
-            LennyAPI.opds_feed(offset=offset, limit=limit, auth_mode_direct=is_direct_auth_mode(auth_mode, beta), email=email)
-        ),
+        content=content,
         media_type="application/opds+json"
     )
 
 @router.get("/opds/search")
-async def opds_search(request: Request, query: Optional[str] = "", auth_mode: Optional[str] = None, beta: bool = False):
+async def opds_search(request: Request, query: Optional[str] = "", offset: Optional[int] = None, limit: Optional[int] = None, auth_mode: Optional[str] = None, beta: bool = False):
     """
     OPDS 2.0 search endpoint. Public — no authentication required.
     """
+    auth_mode_direct = is_direct_auth_mode(auth_mode, beta)
+    paging = {k: v for k, v in (("offset", offset), ("limit", limit)) if v is not None}
+
+    cache_key = await opds_cache_key("opds/search", {"query": query, **paging}, auth_mode_direct)
+    if content := await ResponseCache.aget(cache_key):
+        return Response(content=content, media_type="application/opds+json")
+    content = json.dumps(
+        LennyAPI.search_feed(
+            query=query,
+            **paging,
+            auth_mode_direct=auth_mode_direct,
+        )
+    )
+    if not LennyAPI.feed_degraded():
+        await ResponseCache.aset(cache_key, content)
     return Response(
-        content=json.dumps(
-            LennyAPI.search_feed(
-                query=query,
-                auth_mode_direct=is_direct_auth_mode(auth_mode, beta),
-            )
-        ),
+        content=content,
         media_type="application/opds+json"
     )
 
@@ -176,15 +229,23 @@ async def get_opds_item(request: Request, book_id: int, session: Optional[str] =
     """
     session = extract_session(request, session)
     email = get_authenticated_email(request, session)
-    
-    item = Item.exists(book_id)
+    auth_mode_direct = is_direct_auth_mode(auth_mode, beta)
+
+    cache_key = await opds_cache_key("opds/item", {"olid": book_id}, auth_mode_direct, email)
+    if content := await ResponseCache.aget(cache_key):
+        return Response(content=content, media_type="application/opds-publication+json")
+
+    item = await LennyAPI.aget_item(book_id)
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
 
+    content = json.dumps(
+        LennyAPI.opds_feed(olid=book_id, auth_mode_direct=auth_mode_direct, email=email)
+    )
+    if not LennyAPI.feed_degraded():
+        await ResponseCache.aset(cache_key, content)
     return Response(
-        content=json.dumps(
-            LennyAPI.opds_feed(olid=book_id, auth_mode_direct=is_direct_auth_mode(auth_mode, beta), email=email)
-        ),
+        content=content,
         media_type="application/opds-publication+json"
     )
 
@@ -224,7 +285,7 @@ async def borrow_item(request: Request, response: Response, book_id: int, format
     """
     is_direct_mode = is_direct_auth_mode(auth_mode, beta)
 
-    if not (item := Item.exists(book_id)):
+    if not (item := await LennyAPI.aget_item(book_id)):
          raise HTTPException(status_code=404, detail="Item not found")
 
     session = extract_session(request, session)
@@ -232,7 +293,7 @@ async def borrow_item(request: Request, response: Response, book_id: int, format
     
     if email:
         try:
-            loan = item.borrow(email)
+            loan = await LennyAPI.aborrow(item, email)
         except LoanNotRequiredError:
             pass
         except BookUnavailableError:
@@ -318,7 +379,7 @@ async def return_item(request: Request, book_id: int, format: str=".epub", sessi
     is_direct_mode = is_direct_auth_mode(auth_mode, beta)
 
     try:
-        loan = item.unborrow(email)
+        loan = await LennyAPI.areturn(item, email)
         
         if is_direct_mode:
              redirect_url = f"/v1/api/opds/{book_id}"
@@ -346,6 +407,8 @@ async def upload(
         ..., gt=0, description="OpenLibrary Edition ID (must be a positive integer)"),
     encrypted: bool = Form(
         False, description="Set to true if the file is encrypted"),
+    copies: Optional[int] = Form(
+        None, gt=0, description="Number of copies that can be on loan at once"),
     file: UploadFile = File(
         ..., description="The PDF or EPUB file to upload (max 50MB)")
 ):
@@ -356,6 +419,7 @@ async def upload(
             files=[file],  # TODO expand to allow multiple
             uploader_ip=request.client.host,
             encrypt=encrypted,
+            copies=copies,
         )
         return HTMLResponse(
             status_code=status.HTTP_200_OK,
@@ -578,4 +642,25 @@ async def admin_verify(request: Request):
     if not auth.verify_admin_token(token):
         raise HTTPException(status_code=401, detail="Invalid or expired token")
 
-    return JSONResponse({"valid": True})
\ No newline at end of file
+    return JSONResponse({"valid": True})
+
+
+@router.get("/admin/stats", status_code=status.HTTP_200_OK)
+async def admin_stats(request: Request):
+    """
+    Returns this worker's runtime counters (e.g. Open Library cache hits,
+    catalog index size, database pool checkouts, background purges,
+    session cache hits).
+    Called server-side from lenny-app; never exposed through nginx.
+    """
+    internal_secret = request.headers.get("X-Admin-Internal-Secret", "")
+    if not auth.verify_admin_internal_secret(internal_secret):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+    return JSONResponse({
+        "openlibrary": OpenLibrary.stats(),
+        "catalog": CatalogIndex.stats(),
+        "db": database.pool_stats(),
+        "maintenance": Maintenance.stats(),
+        "sessions": auth.SessionCache.stats(),
+    })
@@ -0,0 +1,123 @@
+"""
+OpenLibraryRecord microbenchmark
+
+Compares the lazily wrapped OpenLibraryRecord with the previous eager
+implementation (reproduced below as EagerRecord) on a synthetic
+search.json page, measuring allocations (tracemalloc) and CPU (timeit)
+for the accesses a feed makes per record: olid, cover_url and title.
+
+    python -m scripts.bench_openlibrary_record -n 100
+"""
+
+import argparse
+import timeit
+import tracemalloc
+
+from lenny.core.openlibrary import OpenLibrary, OpenLibraryRecord
+
+
+class EagerRecord(dict):
+    """The pre-lazy OpenLibraryRecord, kept here only for comparison."""
+
+    def __init__(self, data=None, **kwargs):
+        data = data or {}
+        super().__init__()
+        for key, value in {**data, **kwargs}.items():
+            self[key] = self._wrap(value)
+
+    @property
+    def cover_url(self):
+        if cover_i := self.edition.get('cover_i'):
+            return f"{OpenLibrary.COVER_SERVER}/b/id/{cover_i}-M.jpg"
+
+    @property
+    def edition(self):
+        return self.editions['docs'][0]
+
+    @property
+    def olid(self):
+        class OpenLibraryID(str):
+            def __int__(self):
+                return int(self.strip("OLM"))
+        return OpenLibraryID(self.edition.key.split('/')[-1])
+
+    def __getattr__(self, key):
+        try:
+            return self[key]
+        except KeyError:
+            raise AttributeError(key)
+
+    @classmethod
+    def _wrap(cls, value):
+        if isinstance(value, dict):
+            return cls(value)
+        elif isinstance(value, list):
+            return [cls._wrap(v) for v in value]
+        return value
+
+
+def make_docs(n):
+    return [{
+        "key": f"/works/OL{i}W",
+        "title": f"Work {i}",
+        "author_key": [f"OL{i}A"],
+        "author_name": [f"Author {i}"],
+        "subject": [f"Subject {j}" for j in range(20)],
+        "editions": {
+            "numFound": 1,
+            "start": 0,
+            "docs": [{
+                "key": f"/books/OL{i}M",
+                "title": f"Edition {i}",
+                "cover_i": i,
+                "language": ["eng"],
+                "publisher": ["Publisher"],
+                "publish_date": ["2001"],
+                "isbn": ["9780000000000", "0000000000"],
+                "ia": [f"work{i}00"],
+                "identifiers": {"goodreads": [str(i)], "librarything": [str(i)]},
+            }],
+        },
+    } for i in range(n)]
+
+
+def render(record_cls, docs):
+    records = [record_cls(doc) for doc in docs]
+    for record in records:
+        int(record.olid)
+        record.cover_url
+        record.title
+        # Feeds touch olid more than once (lenny_ids, encryption maps, ...)
+        int(record.olid)
+    return records
+
+
+def measure(record_cls, docs, number):
+    tracemalloc.start()
+    records = render(record_cls, docs)
+    _, peak = tracemalloc.get_traced_memory()
+    del records
+    tracemalloc.stop()
+    seconds = timeit.timeit(lambda: render(record_cls, docs), number=number) / number
+    return peak, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark OpenLibraryRecord")
+    parser.add_argument("-n", type=int, help="Records per page", default=100)
+    parser.add_argument("-r", type=int, help="Timing repetitions", default=200)
+    args = parser.parse_args()
+
+    docs = make_docs(args.n)
+    results = {
+        "eager": measure(EagerRecord, docs, args.r),
+        "lazy": measure(OpenLibraryRecord, docs, args.r),
+    }
+    for name, (peak, seconds) in results.items():
+        print(f"{name:>6}: peak {peak / 1024:8.1f} KiB  {seconds * 1000:7.3f} ms/page")
+    (eager_peak, eager_s), (lazy_peak, lazy_s) = results["eager"], results["lazy"]
+    print(f"saving: {1 - lazy_peak / eager_peak:.0%} memory, {1 - lazy_s / eager_s:.0%} cpu")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Session token microbenchmark
+
+Compares verifying a session cookie the previous way (a full itsdangerous
+loads on every call, reproduced below as verify_uncached), with
+SessionCache in front of it (repeat requests from the same client, e.g. a
+reader fetching a book's resources), and with compact tokens (uncached).
+
+    LENNY_SEED=... python -m scripts.bench_session_tokens -r 20000
+"""
+
+import argparse
+import timeit
+
+from itsdangerous import BadSignature
+from lenny.core import auth
+
+
+def verify_uncached(session, client_ip=None):
+    """The pre-cache verify_session_cookie, kept here only for comparison."""
+    try:
+        data = auth._get_serializer().loads(session, max_age=auth.COOKIE_TTL)
+        if isinstance(data, dict) and client_ip and data.get("ip") not in (None, client_ip):
+            return None
+        return data
+    except BadSignature:
+        return None
+
+
+def verify_compact(session, client_ip=None):
+    loaded = auth._load_compact(session, auth.COOKIE_TTL)
+    if not loaded:
+        return None
+    data = loaded[0]
+    if isinstance(data, dict) and client_ip and data.get("ip") not in (None, client_ip):
+        return None
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark session token verification")
+    parser.add_argument("-r", type=int, help="Verifications per case", default=20000)
+    args = parser.parse_args()
+
+    if not auth.SEED:
+        auth.SEED = "benchmark-seed"
+    email, ip = "patron@example.org", "203.0.113.7"
+    signed = auth._get_serializer().dumps({"email": email, "ip": ip})
+    compact = auth._dump_compact(email, ip)
+    auth.SessionCache.clear()
+
+    cases = {
+        "itsdangerous": (verify_uncached, signed),
+        "cached": (auth.verify_session_cookie, signed),
+        "compact": (verify_compact, compact),
+    }
+    results = {}
+    for name, (verify, token) in cases.items():
+        assert verify(token, ip)["email"] == email
+        seconds = timeit.timeit(lambda: verify(token, ip), number=args.r) / args.r
+        results[name] = seconds
+        print(f"{name:>12}: {seconds * 1e6:7.2f} us/verify  token {len(token)} bytes")
+    base = results["itsdangerous"]
+    print(f"speedup: cached {base / results['cached']:.1f}x, compact {base / results['compact']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+import os
+import pytest
+
+# Set TESTING before any lenny imports
+os.environ["TESTING"] = "true"
+
+
+@pytest.fixture
+def db_models():
+    """Models whose tables db_tables creates. Override it in a module (or
+    parametrize it indirectly) for other tables."""
+    from lenny.core.models import Item, Loan
+    return [Item, Loan]
+
+
+@pytest.fixture
+def db_tables(db_models):
+    """Creates the db_models tables on the test engine and yields the
+    shared session; the session is removed and the tables dropped after."""
+    from lenny.core.db import Base, engine, session
+
+    tables = [model.__table__ for model in db_models]
+    Base.metadata.create_all(engine, tables=tables)
+    yield session
+    session.remove()
+    Base.metadata.drop_all(engine, tables=tables)
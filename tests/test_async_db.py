@@ -0,0 +1,132 @@
+import asyncio
+import os
+import pytest
+import threading
+from unittest.mock import patch, AsyncMock, MagicMock
+
+# Set TESTING before any lenny imports
+os.environ["TESTING"] = "true"
+
+from sqlalchemy import inspect, select
+from lenny.core import database
+from lenny.core.db import Base
+from lenny.core.cache import ResponseCache
+from lenny.core.models import Item, Loan, FormatEnum
+from lenny.core.exceptions import BookUnavailableError
+
+
+def run_on_async_db(scenario):
+    """Runs `scenario` against fresh tables on the (in-memory) async engine."""
+    async def main():
+        async with database.get_async_engine().begin() as conn:
+            await conn.run_sync(Base.metadata.create_all, tables=[Item.__table__, Loan.__table__])
+        try:
+            return await scenario()
+        finally:
+            await database.adispose()
+    return asyncio.run(main())
+
+
+async def add_item(olid, copies=1):
+    async with database.async_session() as adb:
+        adb.add(Item(openlibrary_edition=olid, encrypted=True, formats=FormatEnum.EPUB, num_lendable_total=copies))
+        await adb.commit()
+
+
+def test_async_borrow_and_return_keep_counters():
+    async def scenario():
+        await add_item(7)
+        item = await Item.aexists(7)
+        assert await Item.aexists(8) is None
+
+        loan = await item.aborrow("patron@example.com")
+        assert item.active_loans == 1
+        # Borrowing again returns the active loan instead of a second copy
+        assert (await item.aborrow("patron@example.com")).id == loan.id
+        with pytest.raises(BookUnavailableError):
+            await item.aborrow("other@example.com")
+
+        returned = await item.aunborrow("patron@example.com")
+        assert returned.returned_at is not None
+        assert await Loan.aexists(item.id, "patron@example.com") is None
+        async with database.async_session() as adb:
+            return (await adb.execute(select(Item.active_loans).where(Item.id == item.id))).scalar()
+
+    assert run_on_async_db(scenario) == 0
+
+
+def test_async_borrow_and_return_bump_cache_off_the_loop():
+    bumped = []
+
+    async def scenario():
+        await add_item(7)
+        item = await Item.aexists(7)
+        await item.aborrow("patron@example.com")
+        await item.aunborrow("patron@example.com")
+        return threading.get_ident()
+
+    with patch.object(ResponseCache, "TTL", 300), \
+         patch.object(ResponseCache, "bump", side_effect=lambda: bumped.append(threading.get_ident())):
+        loop_thread = run_on_async_db(scenario)
+    assert len(bumped) == 2 and loop_thread not in bumped
+
+
+def test_async_writes_expire_the_sync_session(db_tables):
+    """Objects the (shared) sync session loaded before an async borrow or
+    return are reloaded instead of showing the old availability."""
+    db_tables.add(Item(openlibrary_edition=7, encrypted=True, formats=FormatEnum.EPUB, num_lendable_total=1))
+    db_tables.commit()
+    cached = Item.exists(7)
+    assert cached.active_loans == 0
+
+    async def borrow():
+        await add_item(7)
+        item = await Item.aexists(7)
+        await item.aborrow("patron@example.com")
+        assert inspect(cached).expired_attributes >= {"active_loans"}
+        cached.active_loans
+        await item.aunborrow("patron@example.com")
+        assert inspect(cached).expired_attributes >= {"active_loans"}
+
+    run_on_async_db(borrow)
+
+
+def test_requests_start_with_a_fresh_sync_session():
+    from fastapi.testclient import TestClient
+
+    with patch("lenny.core.db.init"), \
+         patch("lenny.core.db.create_engine"):
+        from lenny.app import app
+    with patch.object(database, "expire_session") as mock_expire:
+        assert TestClient(app).get("/v1/api/health").status_code == 200
+    mock_expire.assert_called_once_with()
+
+
+def test_async_pool_is_sized_separately():
+    options = database.async_engine_options("postgresql+asyncpg://u:p@localhost/lenny")
+    assert (options["pool_size"], options["max_overflow"]) == (database.DB_ASYNC_POOL_SIZE, database.DB_ASYNC_MAX_OVERFLOW)
+
+
+def test_async_engine_is_created_lazily_and_disposed():
+    asyncio.run(database.adispose())
+    assert database._async_engine is None
+    engine = database.get_async_engine()
+    assert database.get_async_engine() is engine
+    asyncio.run(database.adispose())
+    assert database._async_engine is None
+
+
+def test_aget_item_switches_on_db_async():
+    from lenny.core.api import LennyAPI
+
+    item = MagicMock()
+    with patch.object(LennyAPI, "DB_ASYNC", False), \
+         patch("lenny.core.api.Item.exists", return_value=item) as mock_exists:
+        assert asyncio.run(LennyAPI.aget_item("5")) is item
+    mock_exists.assert_called_once_with("5")
+
+    with patch.object(LennyAPI, "DB_ASYNC", True), \
+         patch("lenny.core.api.Item.aexists", new_callable=AsyncMock, return_value=item) as mock_aexists:
+        assert asyncio.run(LennyAPI.aget_item("5")) is item
+        assert asyncio.run(LennyAPI.aget_item("not-a-number")) is None
+    mock_aexists.assert_awaited_once_with(5)
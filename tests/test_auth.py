@@ -1,4 +1,6 @@
 import pytest 
+import time
+import unittest.mock as mock
 
 # Skip tests if dependencies not installed (for local development)
 pytest.importorskip("itsdangerous")
@@ -71,3 +73,58 @@ def test_otp_authenticate_with_ip():
         
         # Should fail with wrong IP
         assert auth.verify_session_cookie(session_cookie, "10.0.0.2") is None
+
+def test_compact_session_tokens():
+    """Compact tokens verify like itsdangerous ones, IP binding included"""
+    auth.SEED = b"123"
+    auth.SERIALIZER = URLSafeTimedSerializer(auth.SEED, salt="auth-cookie")
+    email = "example@archive.org"
+    ip = "192.168.1.100"
+    auth.SessionCache.clear()
+
+    with mock.patch.object(auth, "SESSION_TOKEN_FORMAT", "compact"):
+        cookie = auth.create_session_cookie(email, ip)
+        legacy = auth.create_session_cookie(email)
+    assert cookie.startswith(auth.COMPACT_PREFIX)
+    assert len(cookie) < len(auth._get_serializer().dumps({"email": email, "ip": ip}))
+
+    assert auth.verify_session_cookie(cookie, ip) == {"email": email, "ip": ip}
+    assert auth.verify_session_cookie(cookie, "192.168.1.101") is None
+    assert auth.get_authenticated_email(cookie) == email
+    assert auth.verify_session_cookie(legacy) == email
+
+    # Tampered, truncated or expired tokens are rejected
+    assert auth.verify_session_cookie(cookie[:-2] + ("AA" if cookie[-2:] != "AA" else "BB"), ip) is None
+    assert auth.verify_session_cookie(auth.COMPACT_PREFIX + "AAAA", ip) is None
+    auth.SessionCache.clear()
+    with mock.patch("lenny.core.auth.time.time", return_value=time.time() + auth.COOKIE_TTL + 1):
+        assert auth.verify_session_cookie(cookie, ip) is None
+
+def test_session_cache_skips_reverification():
+    """Verified tokens are served from SessionCache until they expire"""
+    auth.SEED = b"123"
+    auth.SERIALIZER = URLSafeTimedSerializer(auth.SEED, salt="auth-cookie")
+    ip = "10.0.0.1"
+    cookie = auth.create_session_cookie("test@example.com", ip)
+    auth.SessionCache.clear()
+
+    with mock.patch.object(auth, "_load_session", wraps=auth._load_session) as load:
+        for _ in range(3):
+            assert auth.verify_session_cookie(cookie, ip)["email"] == "test@example.com"
+        assert load.call_count == 1
+        # Cached per client IP, so a mismatch is still rejected
+        assert auth.verify_session_cookie(cookie, "10.0.0.2") is None
+        assert load.call_count == 2
+
+        with mock.patch("lenny.core.auth.time.time", return_value=time.time() + auth.SessionCache.TTL + 1):
+            auth.verify_session_cookie(cookie, ip)
+        assert load.call_count == 3
+
+def test_session_cache_is_bounded():
+    auth.SessionCache.clear()
+    with mock.patch.object(auth.SessionCache, "SIZE", 2):
+        for key in (b"a", b"b", b"c"):
+            auth.SessionCache.set(key, "x@example.com", time.time() + 60)
+        assert auth.SessionCache.get(b"a") is None
+        assert auth.SessionCache.get(b"c") == "x@example.com"
+        assert auth.SessionCache.stats()["size"] == 2
@@ -0,0 +1,196 @@
+import asyncio
+import os
+import pytest
+import threading
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock, patch
+
+# Set TESTING before any lenny imports
+os.environ["TESTING"] = "true"
+
+from sqlalchemy import create_engine, event
+from lenny.core import database
+from lenny.core.db import engine, session
+from lenny.core.cache import (
+    Cache, CacheBackend, CacheEntry, RateLimit, ResponseCache,
+    PostgresCacheBackend, SQLiteFileCacheBackend, RedisCacheBackend,
+)
+
+
+@pytest.fixture
+def db_models():
+    return [CacheEntry, RateLimit]
+
+
+def test_is_throttled_allows_limit_attempts_per_window(db_tables):
+    results = [Cache.is_throttled("otp:send", "a@example.com", 3, 300) for _ in range(5)]
+    assert results == [False, False, False, True, True]
+    # Other keys have their own window
+    assert Cache.is_throttled("otp:send", "b@example.com", 3, 300) is False
+
+    row = session.get(RateLimit, ("otp:send", "a@example.com"))
+    # Throttled attempts aren't counted
+    assert row.hits == 4
+    assert session.query(RateLimit).count() == 2
+
+    row.expires_at = datetime.now(timezone.utc) - timedelta(seconds=1)
+    session.commit()
+    assert Cache.is_throttled("otp:send", "a@example.com", 3, 300) is False
+    session.expire_all()
+    assert session.get(RateLimit, ("otp:send", "a@example.com")).hits == 1
+
+
+def test_is_throttled_is_one_statement(db_tables):
+    executed = []
+    counter = lambda *args: executed.append(args[2])
+    event.listen(engine, "before_cursor_execute", counter)
+    try:
+        Cache.is_throttled("otp:verify", "a@example.com", 3, 300)
+        Cache.is_throttled("otp:verify", "a@example.com", 3, 300)
+    finally:
+        event.remove(engine, "before_cursor_execute", counter)
+    assert len(executed) == 2
+    assert all("ON CONFLICT" in sql for sql in executed)
+
+
+@pytest.fixture(params=["postgres", "sqlite", "redis"])
+def backend(request, tmp_path):
+    if request.param == "postgres":
+        request.getfixturevalue("db_tables")
+        yield PostgresCacheBackend()
+    elif request.param == "sqlite":
+        yield SQLiteFileCacheBackend(str(tmp_path / "cache.sqlite3"))
+    else:
+        fakeredis = pytest.importorskip("fakeredis")
+        yield RedisCacheBackend(client=fakeredis.FakeRedis())
+
+
+def test_backends_get_set_and_throttle(backend):
+    assert backend.get("ol:search", "k") is None
+    backend.set("ol:search", "k", '{"docs": []}', 60)
+    backend.set("ol:search", "k", '{"docs": [1]}', 60)
+    assert backend.get("ol:search", "k") == '{"docs": [1]}'
+    assert backend.get("ol:search", "other") is None
+
+    assert [backend.is_throttled("otp:send", "a@example.com", 2, 60) for _ in range(4)] == [False, False, True, True]
+    assert backend.is_throttled("otp:verify", "a@example.com", 2, 60) is False
+    # Nothing has expired yet
+    assert backend.purge() == 0
+
+
+def test_postgres_backend_stays_on_the_primary(db_tables):
+    # Like a hot standby, which can't read the UNLOGGED cache tables
+    replica = create_engine("sqlite://")
+    db_tables.remove()
+    try:
+        with patch("lenny.core.db.replica_engines", [replica]):
+            database.use_replicas()
+            backend = PostgresCacheBackend()
+            with engine.begin() as conn:
+                conn.execute(CacheEntry.__table__.insert().values(
+                    id=1, scope="ol:search", key="k", value="v",
+                    expires_at=datetime.now(timezone.utc) + timedelta(seconds=60)))
+            # A read before any write in this request
+            assert backend.get("ol:search", "k") == "v"
+            assert [backend.is_throttled("otp:send", "a@example.com", 1, 60) for _ in range(2)] == [False, True]
+            # The shared session does send these reads to the replica
+            assert db_tables.get_bind(clause=CacheEntry.__table__.select()) is replica
+    finally:
+        db_tables.remove()
+        database.use_replicas()
+        replica.dispose()
+
+
+def test_sqlite_file_backend_is_shared_and_windows_expire(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    worker1, worker2 = SQLiteFileCacheBackend(path), SQLiteFileCacheBackend(path)
+    with patch("lenny.core.cache.time.time", return_value=1000.0):
+        assert worker1.is_throttled("otp:send", "a@example.com", 1, 60) is False
+        assert worker2.is_throttled("otp:send", "a@example.com", 1, 60) is True
+        worker1.set("ol:search", "k", "v", 60)
+        assert worker2.get("ol:search", "k") == "v"
+    with patch("lenny.core.cache.time.time", return_value=1061.0):
+        assert worker2.get("ol:search", "k") is None
+        assert worker2.is_throttled("otp:send", "a@example.com", 1, 60) is False
+
+
+def test_partial_backend_fails_on_creation():
+    class GetOnly(CacheBackend):
+        def get(self, scope, key):
+            return None
+
+    with pytest.raises(TypeError):
+        GetOnly()
+
+
+def test_cache_uses_configured_backend(tmp_path):
+    with patch("lenny.core.cache.configs.CACHE_BACKEND", "sqlite"), \
+         patch("lenny.core.cache.configs.CACHE_URL", str(tmp_path / "cache.sqlite3")), \
+         patch.object(Cache, "_backend", None):
+        Cache.set("ol:search", "k", "v", 60)
+        assert isinstance(Cache.backend(), SQLiteFileCacheBackend)
+        assert Cache.get("ol:search", "k") == "v"
+
+    with patch("lenny.core.cache.configs.CACHE_BACKEND", "memcached"), \
+         patch.object(Cache, "_backend", None):
+        with pytest.raises(ValueError):
+            Cache.backend()
+
+
+@pytest.fixture
+def response_cache(tmp_path):
+    with patch.object(Cache, "_backend", SQLiteFileCacheBackend(str(tmp_path / "cache.sqlite3"))), \
+         patch.object(ResponseCache, "TTL", 300), \
+         patch.object(ResponseCache, "_version", (None, 0.0)):
+        yield ResponseCache
+
+
+def test_response_cache_round_trip_and_bump(response_cache):
+    key = response_cache.key("opds", {"offset": 0, "limit": 50}, True)
+    assert key == response_cache.key("opds", {"limit": 50, "offset": 0}, True)
+    assert key != response_cache.key("opds", {"offset": 0, "limit": 50}, False)
+    assert response_cache.get(key) is None
+    response_cache.set(key, '{"publications": []}')
+    assert response_cache.get(key) == '{"publications": []}'
+
+    response_cache.bump()
+    assert response_cache.key("opds", {"offset": 0, "limit": 50}, True) != key
+
+
+def test_response_cache_disabled(response_cache):
+    with patch.object(ResponseCache, "TTL", 0):
+        key = response_cache.key("opds", {}, True)
+        response_cache.set(key, "{}")
+        assert response_cache.get(key) is None
+    response_cache.set(None, "{}")
+    assert response_cache.get(None) is None
+
+
+def test_opds_cache_key_skips_patron_and_degraded_feeds(response_cache):
+    from lenny.routes.api import opds_cache_key
+    from lenny.core.openlibrary import OpenLibrary
+    assert asyncio.run(opds_cache_key("opds", {}, True)) is not None
+    assert asyncio.run(opds_cache_key("opds", {}, True, email="a@example.com")) is None
+    with patch.object(OpenLibrary, "BREAKER", MagicMock(is_open=True)):
+        assert asyncio.run(opds_cache_key("opds", {}, True)) is None
+
+
+def test_response_cache_async_io_runs_off_the_loop(response_cache):
+    threads = []
+
+    def on_thread(method):
+        def call(*args):
+            threads.append(threading.get_ident())
+            return method(*args)
+        return call
+
+    async def round_trip():
+        key = await response_cache.akey("opds", {}, True)
+        await response_cache.aset(key, "{}")
+        return threading.get_ident(), await response_cache.aget(key)
+
+    with patch.object(Cache, "get", side_effect=on_thread(Cache.get)), \
+         patch.object(Cache, "set", side_effect=on_thread(Cache.set)):
+        loop_thread, content = asyncio.run(round_trip())
+    assert content == "{}"
+    assert len(threads) == 3 and loop_thread not in threads
@@ -0,0 +1,59 @@
+import os
+import pytest
+from unittest.mock import patch
+
+# Set TESTING before any lenny imports
+os.environ["TESTING"] = "true"
+
+from lenny.core.db import session
+from lenny.core.models import Item, FormatEnum
+from lenny.core.catalog import CatalogIndex
+
+
+@pytest.fixture
+def catalog(db_tables):
+    state = {name: getattr(CatalogIndex, name) for name in
+             ("_snapshot", "_synced_until", "_checked_at", "_built_at", "_dirty")}
+    CatalogIndex._dirty = True
+    CatalogIndex._synced_until = None
+    yield db_tables
+    for name, value in state.items():
+        setattr(CatalogIndex, name, value)
+
+
+def add_item(olid):
+    session.add(Item(openlibrary_edition=olid, encrypted=False, formats=FormatEnum.EPUB))
+    session.commit()
+
+
+def test_index_is_sorted(catalog):
+    for olid in (30, 10, 20):
+        add_item(olid)
+
+    assert list(CatalogIndex.editions()) == [10, 20, 30]
+    assert CatalogIndex.contains(20) and not CatalogIndex.contains(15)
+    assert CatalogIndex.stats()["editions"] == 3
+
+
+def test_touch_refreshes_incrementally(catalog):
+    add_item(10)
+    assert list(CatalogIndex.editions()) == [10]
+    built_at = CatalogIndex._built_at
+
+    # Within the refresh interval nothing is re-read until touched
+    add_item(5)
+    assert list(CatalogIndex.editions()) == [10]
+
+    CatalogIndex.touch()
+    assert list(CatalogIndex.editions()) == [5, 10]
+    assert CatalogIndex._built_at == built_at
+
+
+def test_refresh_reads_columns_not_orm_objects(catalog):
+    add_item(10)
+    session.expunge_all()
+    with patch("lenny.core.catalog.Item.get_all") as mock_get_all:
+        CatalogIndex.refresh(force=True)
+    mock_get_all.assert_not_called()
+    assert len(session.identity_map) == 0
+    assert list(CatalogIndex.editions()) == [10]
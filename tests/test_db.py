@@ -0,0 +1,124 @@
+import os
+import pytest
+
+# Set TESTING before any lenny imports
+os.environ["TESTING"] = "true"
+
+from sqlalchemy import create_engine, exc, update
+from lenny.core import database as db
+from lenny.core.models import FormatEnum
+
+
+@pytest.fixture
+def pooled():
+    engine = create_engine(
+        "sqlite://", poolclass=db.InstrumentedQueuePool,
+        pool_size=2, max_overflow=1, pool_timeout=0.05,
+    )
+    yield engine
+    engine.dispose()
+
+
+def test_postgres_engine_options_configure_pool_and_timeout():
+    options = db.engine_options("postgresql+psycopg2://u:p@localhost/lenny")
+    assert options["poolclass"] is db.InstrumentedQueuePool
+    assert options["pool_size"] == db.DB_POOL_SIZE
+    assert options["pool_pre_ping"] is db.DB_POOL_PRE_PING
+    assert options["connect_args"] == {"options": f"-c statement_timeout={db.DB_STATEMENT_TIMEOUT}"}
+    assert "poolclass" not in db.engine_options("sqlite:///:memory:")
+
+
+def test_warmup_opens_up_to_pool_size(pooled):
+    assert db.warmup(5, bind=pooled) == 2
+    stats = db.pool_stats(pooled)
+    assert (stats["checked_in"], stats["checked_out"], stats["overflow"]) == (2, 0, 0)
+    assert db.warmup(bind=create_engine("sqlite://")) == 0
+
+
+def test_pool_stats_count_checkouts_overflow_and_timeouts(pooled):
+    held = [pooled.connect() for _ in range(3)]
+    stats = db.pool_stats(pooled)
+    assert (stats["checked_out"], stats["overflow"], stats["checkouts"]) == (3, 1, 3)
+
+    with pytest.raises(exc.TimeoutError):
+        pooled.connect()
+    stats = db.pool_stats(pooled)
+    assert stats["timeouts"] == 1
+    assert stats["wait_max_ms"] >= 50
+
+    for conn in held:
+        conn.close()
+    assert db.pool_stats(pooled)["checked_out"] == 0
+
+
+@pytest.fixture
+def replicated():
+    from lenny.core.models import Item, Loan
+
+    primary, replica = create_engine("sqlite://"), create_engine("sqlite://")
+    tables = [Item.__table__, Loan.__table__]
+    for engine, olid in ((primary, 1), (replica, 2)):
+        db.Base.metadata.create_all(engine, tables=tables)
+        with engine.begin() as conn:
+            conn.execute(Item.__table__.insert().values(openlibrary_edition=olid, encrypted=False, formats="EPUB"))
+    session = db.RoutingSession(bind=primary, replicas=[replica])
+    db.use_replicas()
+    yield session
+    session.close()
+    db.use_replicas()
+    primary.dispose()
+    replica.dispose()
+
+
+def editions(session):
+    from lenny.core.models import Item
+    return [olid for (olid,) in session.query(Item.openlibrary_edition).order_by(Item.id)]
+
+
+def test_routing_session_reads_from_replica_until_a_write(replicated):
+    from lenny.core.models import Item
+
+    assert editions(replicated) == [2]
+
+    replicated.add(Item(openlibrary_edition=3, encrypted=False, formats=FormatEnum.EPUB))
+    replicated.commit()
+    # Reads after the write see it on the primary
+    assert editions(replicated) == [1, 3]
+
+    db.use_replicas()
+    assert editions(replicated) == [2]
+
+
+def test_routing_session_sends_dml_to_primary(replicated):
+    from lenny.core.models import Item
+
+    replicated.execute(update(Item).values(active_loans=1))
+    replicated.commit()
+    assert replicated.query(Item.active_loans).scalar() == 1
+    db.use_replicas()
+    assert replicated.query(Item.active_loans).scalar() == 0
+
+
+def test_loan_checks_read_the_primary(replicated):
+    from unittest.mock import patch
+    from lenny.core.models import Item, Loan
+    from lenny.core.utils import hash_email
+
+    for engine, active_loans in ((replicated.bind, 1), (replicated.replicas[0], 0)):
+        with engine.begin() as conn:
+            conn.execute(update(Item).values(encrypted=True, active_loans=active_loans))
+    # The loan hasn't reached the replica yet
+    with replicated.bind.begin() as conn:
+        conn.execute(Loan.__table__.insert().values(id=1, item_id=1, patron_email_hash=hash_email("a@example.com")))
+
+    with patch("lenny.core.models.db", replicated):
+        item = replicated.get(Item, 1)
+        assert item.borrow("a@example.com").id == 1
+        db.use_replicas()
+        assert item.unborrow("a@example.com").returned_at is not None
+
+
+def test_routing_session_without_replicas_uses_primary():
+    session = db.RoutingSession(bind=db.engine, replicas=[])
+    assert session.get_bind() is db.engine
+    session.close()
@@ -0,0 +1,117 @@
+import importlib.util
+import os
+import pytest
+from unittest.mock import patch, MagicMock
+
+# Set TESTING before any lenny imports
+os.environ["TESTING"] = "true"
+
+from sqlalchemy import create_engine, event, text
+from lenny.core.db import Base, engine
+from lenny.core.models import Item, Loan, FormatEnum
+
+
+def upload(name="book.epub"):
+    return MagicMock(filename=name, content_type="application/epub+zip", size=4)
+
+
+def test_claim_inserts_once_per_edition(db_tables):
+    executed = []
+    counter = lambda *args: executed.append(args[2])
+    event.listen(engine, "before_cursor_execute", counter)
+    try:
+        item = Item.claim(42, False, FormatEnum.EPUB, copies=3)
+    finally:
+        event.remove(engine, "before_cursor_execute", counter)
+
+    assert len(executed) == 1 and "ON CONFLICT" in executed[0]
+    assert (item.openlibrary_edition, item.num_lendable_total, item.active_loans) == (42, 3, 0)
+    assert Item.claim(42, True, FormatEnum.PDF) is None
+    assert Item.exists(42).formats == FormatEnum.EPUB
+
+
+def test_add_rejects_existing_edition_before_uploading(db_tables):
+    from lenny.core.api import LennyAPI
+    from lenny.core.exceptions import ItemExistsError
+
+    Item.claim(42, False, FormatEnum.EPUB)
+    db_tables.commit()
+    with patch.object(LennyAPI, "is_allowed_uploader", return_value=True), \
+         patch.object(LennyAPI, "upload_files") as mock_upload:
+        with pytest.raises(ItemExistsError):
+            LennyAPI.add(42, [upload()], "127.0.0.1")
+    mock_upload.assert_not_called()
+
+
+def test_add_releases_claim_when_upload_fails(db_tables):
+    from lenny.core.api import LennyAPI
+    from lenny.core.exceptions import S3UploadError
+
+    with patch.object(LennyAPI, "is_allowed_uploader", return_value=True), \
+         patch.object(LennyAPI, "upload_files", side_effect=S3UploadError("down")):
+        with pytest.raises(S3UploadError):
+            LennyAPI.add(42, [upload()], "127.0.0.1")
+    assert Item.exists(42) is None
+
+    with patch.object(LennyAPI, "is_allowed_uploader", return_value=True), \
+         patch.object(LennyAPI, "upload_files"), \
+         patch.object(LennyAPI, "_schedule_metadata_refresh"):
+        item = LennyAPI.add(42, [upload(), upload("book.pdf")], "127.0.0.1")
+    assert item.formats == FormatEnum.EPUB_PDF
+
+
+def test_add_commits_claim_only_after_upload(db_tables):
+    from lenny.core.api import LennyAPI
+
+    calls = []
+    commit = db_tables.commit
+    with patch.object(LennyAPI, "is_allowed_uploader", return_value=True), \
+         patch.object(LennyAPI, "upload_files", side_effect=lambda *a, **k: calls.append("upload")), \
+         patch.object(LennyAPI, "_schedule_metadata_refresh"), \
+         patch("lenny.core.api.db.commit", side_effect=lambda: (calls.append("commit"), commit())):
+        LennyAPI.add(42, [upload()], "127.0.0.1")
+    assert calls == ["upload", "commit"]
+    db_tables.rollback()
+    assert Item.exists(42) is not None
+
+
+def test_add_reports_upload_error_when_release_fails(db_tables):
+    from lenny.core.api import LennyAPI
+    from lenny.core.exceptions import S3UploadError
+
+    with patch.object(LennyAPI, "is_allowed_uploader", return_value=True), \
+         patch.object(LennyAPI, "upload_files", side_effect=S3UploadError("down")), \
+         patch("lenny.core.api.db.rollback", side_effect=RuntimeError("connection lost")):
+        with pytest.raises(S3UploadError):
+            LennyAPI.add(42, [upload()], "127.0.0.1")
+
+
+def test_unique_edition_migration_merges_duplicates():
+    from alembic.migration import MigrationContext
+    from alembic.operations import Operations
+
+    path = os.path.join(os.path.dirname(__file__), "..", "alembic", "versions", "d82f6a1b3c94_unique_item_edition.py")
+    spec = importlib.util.spec_from_file_location("unique_item_edition", path)
+    migration = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(migration)
+    scratch = create_engine("sqlite://")
+    Base.metadata.create_all(scratch, tables=[Item.__table__, Loan.__table__])
+    with scratch.begin() as conn:
+        conn.execute(text("DROP INDEX idx_items_openlibrary_edition"))
+        conn.execute(text("CREATE INDEX idx_items_openlibrary_edition ON items (openlibrary_edition)"))
+        conn.execute(text(
+            "INSERT INTO items (id, openlibrary_edition, encrypted, formats, num_lendable_total, active_loans) "
+            "VALUES (1, 7, 1, 'EPUB', 1, 0), (2, 7, 1, 'EPUB', 1, 1), (3, 8, 0, 'EPUB', 1, 0)"
+        ))
+        conn.execute(text("INSERT INTO loans (item_id, patron_email_hash) VALUES (2, 'abc')"))
+
+        with Operations.context(MigrationContext.configure(conn)):
+            migration.upgrade()
+
+        assert conn.execute(text("SELECT id, active_loans FROM items ORDER BY id")).fetchall() == [(1, 1), (3, 0)]
+        assert conn.execute(text("SELECT item_id FROM loans")).scalar() == 1
+        with pytest.raises(Exception):
+            conn.execute(text(
+                "INSERT INTO items (openlibrary_edition, encrypted, formats) VALUES (7, 0, 'EPUB')"
+            ))
+    scratch.dispose()
@@ -0,0 +1,96 @@
+import os
+import pytest
+from unittest.mock import patch
+
+# Set TESTING before any lenny imports
+os.environ["TESTING"] = "true"
+
+from sqlalchemy import event
+from lenny.core.db import engine
+from lenny.core.models import Item, Loan, FormatEnum
+from lenny.core.exceptions import BookUnavailableError
+
+
+@pytest.fixture
+def statements():
+    executed = []
+    counter = lambda *args: executed.append(args[2])
+    event.listen(engine, "before_cursor_execute", counter)
+    yield executed
+    event.remove(engine, "before_cursor_execute", counter)
+
+
+def _lendable_item(db, olid, copies=1):
+    item = Item(openlibrary_edition=olid, encrypted=True, formats=FormatEnum.EPUB, num_lendable_total=copies)
+    db.add(item)
+    db.commit()
+    return item
+
+
+def test_borrow_claims_copies_atomically_and_return_releases_once(db_tables):
+    item = Item(openlibrary_edition=1, encrypted=True, formats=FormatEnum.EPUB, num_lendable_total=2)
+    db_tables.add(item)
+    db_tables.commit()
+
+    first = item.borrow("a@example.com")
+    assert item.borrow("a@example.com").id == first.id  # existing loan, no new copy
+    item.borrow("b@example.com")
+    assert item.active_loans == 2 and not item.is_borrowable
+    with pytest.raises(BookUnavailableError):
+        item.borrow("c@example.com")
+
+    first.finalize()
+    first.finalize()
+    db_tables.refresh(item)
+    assert item.active_loans == 1 and item.available_copies == 1
+    assert first.returned_at is not None
+
+
+def test_concurrent_borrows_by_one_patron_create_one_loan(db_tables):
+    item = _lendable_item(db_tables, 1, copies=2)
+    first = item.borrow("a@example.com")
+
+    # The second borrow raced past the existence check before the first committed
+    exists = Loan.exists
+    with patch.object(Loan, "exists", side_effect=[None, exists(item.id, "a@example.com")]):
+        second = item.borrow("a@example.com")
+
+    assert second.id == first.id
+    db_tables.refresh(item)
+    assert item.active_loans == 1
+    assert db_tables.query(Loan).filter(Loan.returned_at == None).count() == 1
+
+
+def test_loans_invalidate_cached_feeds_only_when_availability_changes(db_tables):
+    item = _lendable_item(db_tables, 1)
+    with patch("lenny.core.models.ResponseCache.bump") as bump:
+        loan = item.borrow("a@example.com")
+        item.borrow("a@example.com")  # existing loan
+        assert bump.call_count == 1
+        loan.finalize()
+        loan.finalize()  # already returned
+        assert bump.call_count == 2
+
+
+def test_get_active_loads_loans_with_items_in_one_query(db_tables, statements):
+    for olid in (1, 2, 3):
+        _lendable_item(db_tables, olid).borrow("a@example.com")
+    _lendable_item(db_tables, 4).borrow("b@example.com")
+    db_tables.expunge_all()
+    statements.clear()
+
+    loans = Loan.get_active("a@example.com")
+
+    assert sorted(loan.item.openlibrary_edition for loan in loans) == [1, 2, 3]
+    assert len(statements) == 1
+
+
+def test_count_active_counts_without_loading(db_tables, statements):
+    first = _lendable_item(db_tables, 1).borrow("a@example.com")
+    _lendable_item(db_tables, 2).borrow("a@example.com")
+    first.finalize()
+    statements.clear()
+
+    assert Loan.count_active("a@example.com") == 1
+    assert len(statements) == 1
+    assert Loan.count_active("nobody@example.com") == 0
@@ -0,0 +1,86 @@
+import os
+import time
+import pytest
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+# Set TESTING before any lenny imports
+os.environ["TESTING"] = "true"
+
+from lenny.core.db import session
+from lenny.core.cache import Cache, CacheEntry, RateLimit, SQLiteFileCacheBackend
+from lenny.core.maintenance import Maintenance
+
+
+@pytest.fixture
+def db_models():
+    return [CacheEntry, RateLimit]
+
+
+def add_entries(count, expires_in):
+    expires_at = datetime.now(timezone.utc) + timedelta(seconds=expires_in)
+    session.add_all(CacheEntry(scope="ol:search", key=f"k{i}", expires_at=expires_at) for i in range(count))
+    session.commit()
+
+
+def test_run_once_purges_expired_rows_in_batches(db_tables):
+    add_entries(7, -60)
+    add_entries(2, 60)
+    with patch.object(Maintenance, "BATCH_SIZE", 3), \
+         patch.object(Cache, "purge", wraps=Cache.purge) as mock_purge:
+        assert Maintenance.run_once() == 7
+
+    assert [c.args for c in mock_purge.call_args_list] == [(3,), (3,), (3,)]
+    assert session.query(CacheEntry).filter(CacheEntry.scope == "ol:search").count() == 2
+    stats = Maintenance.stats()
+    assert stats["last_deleted"] == 7 and stats["last_run_at"]
+
+
+def test_run_once_skips_when_another_worker_leads():
+    @contextmanager
+    def follower():
+        yield False
+
+    with patch.object(Maintenance, "leader", follower), \
+         patch.object(Cache, "purge") as mock_purge:
+        assert Maintenance.run_once() is None
+    mock_purge.assert_not_called()
+
+
+def test_workers_purge_once_per_interval(tmp_path):
+    # Two workers sharing one cache, waking out of phase within an interval
+    backend = SQLiteFileCacheBackend(str(tmp_path / "cache.sqlite3"))
+    with patch.object(Cache, "_backend", backend), \
+         patch.object(Maintenance, "INTERVAL", 300), \
+         patch.object(Cache, "purge", return_value=0) as mock_purge:
+        with patch("lenny.core.cache.time.time", return_value=1000.0):
+            assert Maintenance.run_once() == 0
+        with patch("lenny.core.cache.time.time", return_value=1150.0):
+            assert Maintenance.run_once() is None
+        assert mock_purge.call_count == 1
+
+        with patch("lenny.core.cache.time.time", return_value=1301.0):
+            assert Maintenance.run_once() == 0
+        assert mock_purge.call_count == 2
+
+
+def test_is_throttled_never_purges(db_tables):
+    with patch.object(Cache, "purge") as mock_purge:
+        for _ in range(200):
+            Cache.is_throttled("otp:send", "a@example.com", 5, 300)
+    mock_purge.assert_not_called()
+
+
+def test_scheduler_runs_in_the_background():
+    with patch.object(Maintenance, "INTERVAL", 0.01), \
+         patch.object(Maintenance, "run_once") as mock_run:
+        Maintenance.start()
+        try:
+            deadline = time.monotonic() + 2
+            while not mock_run.called and time.monotonic() < deadline:
+                time.sleep(0.01)
+        finally:
+            Maintenance.stop()
+    assert mock_run.called
+    assert Maintenance.stats()["running"] is False
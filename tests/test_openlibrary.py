@@ -0,0 +1,318 @@
+import asyncio
+import os
+import pytest
+import threading
+import time
+from unittest.mock import patch
+
+# Set TESTING before any lenny imports
+os.environ["TESTING"] = "true"
+
+from lenny.core.cache import Cache, CacheEntry, SQLiteFileCacheBackend
+from lenny.core.openlibrary import OpenLibrary
+
+DOCS = {"docs": [{"key": "/works/OL1W", "title": "A Book"}]}
+
+
+@pytest.fixture
+def db_models():
+    return [CacheEntry]
+
+
+@pytest.fixture(autouse=True)
+def cache_table(db_tables):
+    OpenLibrary.CACHE_STATS.clear()
+
+
+def test_cache_key_normalizes_query_and_fields():
+    a = OpenLibrary._cache_key("python   AND  django", ["title", "key"], 1, 100)
+    b = OpenLibrary._cache_key(" python AND django ", ["key", "title"], 1, 100)
+    assert a == b
+    assert a != OpenLibrary._cache_key("python AND django", None, 2, 100)
+    assert a != OpenLibrary._cache_key("python AND django", None, 1, 50)
+
+
+def test_search_json_miss_then_hit():
+    with patch.object(OpenLibrary, "_fetch_json", return_value=DOCS) as mock_fetch:
+        assert OpenLibrary.search_json("python") == DOCS
+        assert OpenLibrary.search_json("python") == DOCS
+
+    mock_fetch.assert_called_once()
+    assert OpenLibrary.stats()["misses"] == 1
+    assert OpenLibrary.stats()["hits"] == 1
+
+
+def test_search_json_does_not_cache_failures():
+    with patch.object(OpenLibrary, "_fetch_json", return_value={}) as mock_fetch:
+        assert OpenLibrary.search_json("python") == {}
+        assert OpenLibrary.search_json("python") == {}
+
+    assert mock_fetch.call_count == 2
+
+
+def test_search_json_serves_stale_and_revalidates():
+    with patch.object(OpenLibrary, "_fetch_json", return_value=DOCS):
+        OpenLibrary.search_json("python")
+
+    fresh = {"docs": [{"key": "/works/OL1W", "title": "A Newer Book"}]}
+    expired = OpenLibrary.CACHE_TTL + 1
+    with patch("lenny.core.openlibrary.time.time", return_value=time.time() + expired), \
+         patch("lenny.core.openlibrary.run_in_background", side_effect=lambda f: f()) as mock_bg, \
+         patch.object(OpenLibrary, "_fetch_json", return_value=fresh):
+        assert OpenLibrary.search_json("python") == DOCS
+
+    mock_bg.assert_called_once()
+    assert OpenLibrary.stats()["stale"] == 1
+    with patch.object(OpenLibrary, "_fetch_json") as mock_fetch:
+        assert OpenLibrary.search_json("python") == fresh
+    mock_fetch.assert_not_called()
+
+
+def test_search_json_bypasses_cache_when_disabled():
+    with patch.object(OpenLibrary, "CACHE_TTL", 0), \
+         patch.object(OpenLibrary, "_fetch_json", return_value=DOCS) as mock_fetch:
+        OpenLibrary.search_json("python")
+        OpenLibrary.search_json("python")
+
+    assert mock_fetch.call_count == 2
+
+
+def test_client_is_shared():
+    try:
+        assert OpenLibrary.client() is OpenLibrary.client()
+    finally:
+        asyncio.run(OpenLibrary.aclose())
+    assert OpenLibrary._client is None
+
+
+def test_async_client_is_shared_within_a_loop():
+    async def clients():
+        try:
+            return OpenLibrary.async_client(), OpenLibrary.async_client()
+        finally:
+            await OpenLibrary.aclose()
+
+    first, second = asyncio.run(clients())
+    assert first is second
+
+
+def test_asearch_pages_through_results():
+    pages = {
+        1: {"docs": [{"key": "/works/OL1W"}, {"key": "/works/OL2W"}]},
+        2: {"docs": [{"key": "/works/OL3W"}]},
+    }
+
+    async def fetch(query, fields, page, limit):
+        return pages[page]
+
+    async def collect():
+        return [r.key async for r in OpenLibrary.asearch("python", limit=2)]
+
+    with patch.object(OpenLibrary, "_afetch_json", side_effect=fetch) as mock_fetch:
+        keys = asyncio.run(collect())
+
+    assert keys == ["/works/OL1W", "/works/OL2W", "/works/OL3W"]
+    assert mock_fetch.call_count == 2
+
+
+def test_async_client_from_a_previous_loop_is_closed():
+    async def client():
+        return OpenLibrary.async_client()
+
+    first = asyncio.run(client())
+
+    async def replace():
+        second = OpenLibrary.async_client()
+        await asyncio.sleep(0)
+        await OpenLibrary.aclose()
+        return second
+
+    assert asyncio.run(replace()) is not first
+    assert first.is_closed
+
+
+def test_asearch_json_shares_sync_cache(tmp_path):
+    # A file-backed cache, since lookups run on a worker thread and the
+    # in-memory test database is per-thread
+    with patch.object(Cache, "_backend", SQLiteFileCacheBackend(str(tmp_path / "cache.sqlite3"))):
+        with patch.object(OpenLibrary, "_fetch_json", return_value=DOCS):
+            OpenLibrary.search_json("python")
+
+        loop_thread = threading.get_ident()
+        lookup = OpenLibrary._cache_lookup
+        threads = []
+        def tracked_lookup(*args):
+            threads.append(threading.get_ident())
+            return lookup(*args)
+
+        with patch.object(OpenLibrary, "_afetch_json") as mock_fetch, \
+             patch.object(OpenLibrary, "_cache_lookup", side_effect=tracked_lookup):
+            assert asyncio.run(OpenLibrary.asearch_json("python")) == DOCS
+        mock_fetch.assert_not_called()
+        assert threads and loop_thread not in threads
+
+
+def test_record_to_metadata():
+    from lenny.core.openlibrary import OpenLibraryRecord
+    record = OpenLibraryRecord({
+        "key": "/works/OL1W",
+        "title": "Work Title",
+        "author_name": ["Ada Lovelace", "Charles Babbage"],
+        "author_key": ["OL1A"],
+        "subject": ["Computing"],
+        "editions": {"docs": [{
+            "key": "/books/OL7M",
+            "title": "Edition Title",
+            "cover_i": 42,
+            "language": ["eng"],
+            "publish_date": ["1843"],
+        }]},
+    })
+
+    metadata = record.to_metadata()
+
+    assert metadata["title"] == "Edition Title"
+    assert metadata["edition_key"] == "/books/OL7M"
+    assert metadata["authors"] == [
+        {"name": "Ada Lovelace", "key": "OL1A"},
+        {"name": "Charles Babbage", "key": None},
+    ]
+    assert metadata["cover_i"] == 42
+    assert metadata["publish_date"] == "1843"
+    assert metadata["subject"] == ["Computing"]
+    assert metadata["isbn"] == []
+
+
+def test_record_without_editions_raises_attribute_error():
+    from lenny.core.openlibrary import OpenLibraryRecord
+    for data in ({"key": "/works/OL1W"}, {"key": "/works/OL1W", "editions": {"docs": []}}):
+        record = OpenLibraryRecord(data)
+        with pytest.raises(AttributeError):
+            record.olid
+        with pytest.raises(AttributeError):
+            record.edition
+
+
+def test_record_wraps_nested_values_lazily():
+    from lenny.core.openlibrary import OpenLibraryRecord, OpenLibraryID
+    record = OpenLibraryRecord({
+        "key": "/works/OL1W",
+        "editions": {"docs": [{"key": "/books/OL7M", "cover_i": 42}]},
+    })
+
+    # Nothing is converted until it is read
+    assert type(dict.__getitem__(record, "editions")) is dict
+
+    olid = record.olid
+    assert isinstance(olid, OpenLibraryID)
+    assert olid == "OL7M" and int(olid) == 7
+    assert record.olid is olid
+    assert record.edition is record.editions.docs[0]
+    assert isinstance(record.get("editions"), OpenLibraryRecord)
+    assert record.cover_url.endswith("/b/id/42-M.jpg")
+
+
+def test_record_resets_cached_edition_when_editions_change():
+    from lenny.core.openlibrary import OpenLibraryRecord
+    record = OpenLibraryRecord({"editions": {"docs": [{"key": "/books/OL7M"}]}})
+    assert int(record.olid) == 7
+
+    record.editions = {"docs": [{"key": "/books/OL8M"}]}
+    assert int(record.olid) == 8
+    assert int((record + {"lenny": None}).olid) == 8
+
+
+def test_field_profiles_select_requested_fields():
+    membership = OpenLibrary.fields_for("membership")
+    assert "editions.*" not in membership
+    assert "editions.key" in membership
+    assert OpenLibrary.fields_for() == sorted(OpenLibrary.DEFAULT_FIELDS)
+    assert "subject" in OpenLibrary.fields_for("card", ["subject"])
+
+    url = OpenLibrary._construct_search_url("python", membership)
+    assert "editions.%2A" not in url and "editions.key" in url
+
+
+def test_search_json_profiles_use_separate_cache_entries():
+    with patch.object(OpenLibrary, "_fetch_json", return_value=DOCS) as mock_fetch:
+        OpenLibrary.search_json("python", profile="membership")
+        OpenLibrary.search_json("python")
+        OpenLibrary.search_json("python", profile="full")
+
+    assert mock_fetch.call_count == 2
+    assert mock_fetch.call_args_list[0].args[1] == OpenLibrary.fields_for("membership")
+
+
+def test_fetch_json_coalesces_concurrent_identical_requests():
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    release = threading.Event()
+
+    def slow_get(url):
+        release.wait(5)
+        return DOCS
+
+    with patch.object(OpenLibrary, "_get_json", side_effect=slow_get) as mock_get, \
+         ThreadPoolExecutor(max_workers=5) as pool:
+        futures = [pool.submit(OpenLibrary._fetch_json, "python") for _ in range(5)]
+        while OpenLibrary.CACHE_STATS["coalesced"] < 4:
+            time.sleep(0.01)
+        release.set()
+        results = [f.result() for f in futures]
+
+    assert results == [DOCS] * 5
+    mock_get.assert_called_once()
+    assert OpenLibrary._inflight == {}
+
+
+def test_afetch_json_coalesces_concurrent_identical_requests():
+    async def slow_get(url):
+        await asyncio.sleep(0.01)
+        return DOCS
+
+    async def fetch_all():
+        return await asyncio.gather(*(OpenLibrary._afetch_json("python") for _ in range(5)))
+
+    with patch.object(OpenLibrary, "_aget_json", side_effect=slow_get) as mock_get:
+        assert asyncio.run(fetch_all()) == [DOCS] * 5
+        assert asyncio.run(OpenLibrary._afetch_json("python")) == DOCS
+
+    assert mock_get.call_count == 2
+    assert OpenLibrary.stats()["coalesced"] == 4
+    assert OpenLibrary._ainflight == {}
+
+
+def test_circuit_breaker_trips_fails_fast_and_half_opens():
+    from lenny.core.circuitbreaker import CircuitBreaker
+    from lenny.core.exceptions import CircuitOpenError
+
+    breaker = CircuitBreaker("test", failure_threshold=2, latency_budget=1.0, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_success(elapsed=5.0)  # over the latency budget
+    assert breaker.is_open
+
+    with pytest.raises(CircuitOpenError):
+        with breaker.track():
+            pass
+    assert breaker.stats()["rejected"] == 1
+
+    with patch("lenny.core.circuitbreaker.time.monotonic", return_value=time.monotonic() + 31):
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        assert breaker.allow()
+        assert not breaker.allow()  # one probe at a time
+        breaker.record_success(elapsed=0.1)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_get_json_fails_fast_while_breaker_open():
+    OpenLibrary.BREAKER.reset()
+    try:
+        for _ in range(OpenLibrary.BREAKER.failure_threshold):
+            OpenLibrary.BREAKER.record_failure()
+        with patch.object(OpenLibrary, "client") as mock_client:
+            assert OpenLibrary._get_json("https://openlibrary.org/search.json?q=x") == {}
+        mock_client.assert_not_called()
+        assert OpenLibrary.stats()["breaker"]["state"] == "open"
+    finally:
+        OpenLibrary.BREAKER.reset()
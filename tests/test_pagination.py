@@ -0,0 +1,75 @@
+import os
+import pytest
+from unittest.mock import patch, MagicMock
+
+# Set TESTING before any lenny imports
+os.environ["TESTING"] = "true"
+
+from lenny.core.db import session
+from lenny.core.models import Item, FormatEnum
+from lenny.core.exceptions import InvalidCursorError
+from lenny.core.utils import encode_cursor, decode_cursor
+
+
+@pytest.fixture
+def catalog(db_tables):
+    for olid in range(1, 8):
+        session.add(Item(openlibrary_edition=olid, encrypted=olid % 2 == 0, formats=FormatEnum.EPUB))
+    session.commit()
+    return session
+
+
+def editions(items):
+    return [i.openlibrary_edition for i in items]
+
+
+def test_cursor_round_trip_and_rejects_garbage():
+    assert decode_cursor(encode_cursor("after", 42)) == ("after", 42)
+    assert decode_cursor(encode_cursor("before", 7)) == ("before", 7)
+    for bad in ("not-a-cursor", encode_cursor("sideways", 1), "!!!"):
+        with pytest.raises(InvalidCursorError):
+            decode_cursor(bad)
+
+
+def test_item_get_page_is_keyset_ordered(catalog):
+    assert editions(Item.get_page(limit=3)) == [1, 2, 3]
+    assert editions(Item.get_page(after=3, limit=3)) == [4, 5, 6]
+    assert editions(Item.get_page(before=4, limit=2)) == [2, 3]
+    assert editions(Item.get_page(after=2, limit=2, encrypted=True)) == [4, 6]
+
+
+def test_get_items_page_walks_forward_and_back(catalog):
+    from lenny.core.api import LennyAPI
+
+    page1, cursors1 = LennyAPI.get_items_page(limit=3)
+    assert editions(page1) == [1, 2, 3]
+    assert cursors1["previous"] is None
+
+    page2, cursors2 = LennyAPI.get_items_page(cursor=cursors1["next"], limit=3)
+    page3, cursors3 = LennyAPI.get_items_page(cursor=cursors2["next"], limit=3)
+    assert editions(page2) == [4, 5, 6]
+    assert editions(page3) == [7]
+    assert cursors3["next"] is None
+
+    back, back_cursors = LennyAPI.get_items_page(cursor=cursors2["previous"], limit=3)
+    assert editions(back) == [1, 2, 3]
+    assert back_cursors["previous"] is None
+
+
+def test_opds_feed_rewrites_page_links_with_cursors():
+    from lenny.core.api import LennyAPI
+
+    item = MagicMock(openlibrary_edition=1, encrypted=False)
+    provider_catalog = {"links": [
+        {"rel": "self", "href": "/v1/api/opds"},
+        {"rel": "next", "href": "/v1/api/opds?offset=50&limit=50"},
+    ]}
+    with patch.object(LennyAPI, "get_items_page", return_value=([item], {"next": "abc", "previous": None})), \
+         patch("lenny.core.api.Item.borrowable_map", return_value={1: False}), \
+         patch("lenny.core.api.LennyDataProvider.search", return_value=MagicMock(records=[])), \
+         patch("lenny.core.api.LennyDataProvider.build_catalog", return_value=provider_catalog):
+        feed = LennyAPI.opds_feed(limit=50, local=False)
+
+    rels = {link["rel"]: link["href"] for link in feed["links"]}
+    assert set(rels) == {"self", "next"}
+    assert rels["next"].endswith("/v1/api/opds?cursor=abc&limit=50")
@@ -1,5 +1,7 @@
 import os
 import pytest
+from array import array
+from contextlib import contextmanager
 from unittest.mock import patch, MagicMock
 
 # Set TESTING before any lenny imports
@@ -17,6 +19,16 @@ def test_client():
 
 
 
+@contextmanager
+def indexed_editions(*editions):
+    """Serves the given edition ids from CatalogIndex without touching the DB."""
+    from lenny.core.catalog import CatalogIndex
+
+    with patch.object(CatalogIndex, "_snapshot", array("q", sorted(editions))), \
+         patch.object(CatalogIndex, "refresh") as mock_refresh:
+        yield mock_refresh
+
+
 # ---------------------------------------------------------------------------
 # Task 3 tests: _fetch_all_edition_ids
 # ---------------------------------------------------------------------------
@@ -76,7 +88,7 @@ def test_search_feed_no_items_returns_empty_catalog():
     """Verify empty DB returns empty catalog without querying OL."""
     from lenny.core.api import LennyAPI
 
-    with patch("lenny.core.api.Item.get_all", return_value={}) as mock_fetch, \
+    with indexed_editions() as mock_fetch, \
          patch("lenny.core.api.OpenLibrary.search") as mock_ol_search, \
          patch("lenny.core.api.LennyDataProvider.empty_catalog", return_value={"empty": True}) as mock_empty:
         result = LennyAPI.search_feed(query="python", auth_mode_direct=False)
@@ -104,7 +116,7 @@ def test_search_feed_builds_chunked_query():
     item2.encrypted = True
     item2.is_borrowable = False
 
-    all_items = {10: item1, 20: item2}
+    all_items = [item1, item2]
 
     # Create mock OL search results matching those items
     ol_record1 = MagicMock()
@@ -117,7 +129,8 @@ def test_search_feed_builds_chunked_query():
     mock_search_response = MagicMock()
     mock_search_response.records = [mock_lenny_record]
 
-    with patch("lenny.core.api.Item.get_all", return_value=all_items), \
+    with indexed_editions(10, 20), \
+         patch("lenny.core.api.Item.get_by_editions", return_value=all_items) as mock_get, \
          patch("lenny.core.api.OpenLibrary.search", return_value=[ol_record1, ol_record2]) as mock_ol_search, \
          patch("lenny.core.api.LennyDataProvider.search", return_value=mock_search_response), \
          patch("lenny.core.api.LennyDataProvider.build_catalog", return_value={"catalog": True}) as mock_build:
@@ -132,15 +145,293 @@ def test_search_feed_builds_chunked_query():
     assert "OL10M" in str(ol_query)
     assert "OL20M" in str(ol_query)
 
+    # Only the matched items are loaded from the DB
+    mock_get.assert_called_once_with([10, 20])
+
     # Verify build_catalog was called
     mock_build.assert_called_once()
     assert result == {"catalog": True}
 
 
+def test_search_feed_pages_through_open_library_results():
+    """offset skips earlier matches instead of repeating the first page."""
+    from lenny.core.api import LennyAPI
+
+    records = [MagicMock(olid=str(olid)) for olid in (10, 20, 30)]
+    items = {olid: MagicMock(openlibrary_edition=olid, encrypted=False) for olid in (10, 20, 30)}
+
+    with indexed_editions(10, 20, 30), \
+         patch("lenny.core.api.OpenLibrary.search", return_value=records), \
+         patch("lenny.core.api.Item.get_by_editions", side_effect=lambda olids: [items[o] for o in olids]) as mock_get, \
+         patch("lenny.core.api.Item.borrowable_map", return_value={}), \
+         patch("lenny.core.api.LennyDataProvider.search", return_value=MagicMock(records=[])), \
+         patch("lenny.core.api.LennyDataProvider.build_catalog", side_effect=lambda *a, **kw: {"links": []}):
+        first = LennyAPI.search_feed(query="python", limit=2, offset=0, auth_mode_direct=False)
+        assert mock_get.call_args.args[0] == [10, 20]
+        second = LennyAPI.search_feed(query="python", limit=2, offset=2, auth_mode_direct=False)
+        assert mock_get.call_args.args[0] == [30]
+
+    assert "query=python&offset=2&limit=2" in first["links"][0]["href"]
+    assert second["links"] == []
+
+
+def test_search_batches_keeps_batch_order_and_stops_early():
+    """Concurrent batches are consumed in order and stop once limit is reached."""
+    import time
+    from lenny.core.api import LennyAPI
+
+    def fake_search(query, limit, profile=None):
+        assert profile == "membership"
+        olid = int(query.split("OL")[1].split("M")[0])
+        # First batch is the slowest, so completion order differs from batch order
+        time.sleep(0.05 if olid == 1 else 0)
+        return [f"{olid}a", f"{olid}b"]
+
+    batches = [[i] for i in range(1, 6)]
+    with patch("lenny.core.api.OpenLibrary.search", side_effect=fake_search):
+        result = LennyAPI._search_batches("python", batches, limit=3)
+
+    assert result == ["1a", "1b", "2a"]
+
+
+def test_search_feed_is_degraded_when_a_batch_fails():
+    """A batch Open Library failed (or the breaker rejected) marks the feed
+    as degraded, so it isn't cached."""
+    from lenny.core.api import LennyAPI
+    from lenny.core.openlibrary import OpenLibrary
+
+    def flaky_search(query, limit, profile=None):
+        if "OL2M" in query:
+            OpenLibrary.BREAKER.record_failure()
+            return []
+        return ["1a"]
+
+    OpenLibrary.BREAKER.reset()
+    try:
+        with indexed_editions(1, 2), \
+             patch.object(LennyAPI, "SEARCH_BATCH_SIZE", 1), \
+             patch("lenny.core.api.OpenLibrary.search", side_effect=flaky_search), \
+             patch("lenny.core.api.Item.get_by_editions", return_value=[]), \
+             patch("lenny.core.api.LennyDataProvider.empty_catalog", return_value={"empty": True}):
+            LennyAPI.search_feed(query="python", limit=10, auth_mode_direct=False)
+            assert LennyAPI.feed_degraded()
+
+            OpenLibrary.BREAKER.reset()
+            with patch("lenny.core.api.OpenLibrary.search", return_value=["1a"]):
+                LennyAPI.search_feed(query="python", limit=10, auth_mode_direct=False)
+            assert not LennyAPI.feed_degraded()
+    finally:
+        OpenLibrary.BREAKER.reset()
+
+
+def _indexed_item(session, olid, metadata):
+    from lenny.core.models import Item, FormatEnum
+
+    item = Item(
+        openlibrary_edition=olid, encrypted=False, formats=FormatEnum.EPUB,
+        openlibrary_metadata=metadata,
+        search_text=Item.search_document(olid, metadata),
+    )
+    session.add(item)
+    session.commit()
+    return item
+
+
+def test_refresh_metadata_keeps_every_batch(db_tables):
+    """The Open Library cache rolls back the shared session on each
+    lookup, which must not discard earlier batches' metadata."""
+    import re
+    from lenny.core.api import LennyAPI
+    from lenny.core.models import Item
+    from lenny.core.openlibrary import OpenLibraryRecord
+
+    for olid in range(1, 7):
+        _indexed_item(db_tables, olid, None)
+
+    def search(query, fields=None, profile=None):
+        db_tables.rollback()
+        return [
+            OpenLibraryRecord({"title": f"Book {olid}", "editions": {"docs": [{"key": f"/books/OL{olid}M"}]}})
+            for olid in re.findall(r"OL(\d+)M", query)
+        ]
+
+    with patch.object(LennyAPI, "SEARCH_BATCH_SIZE", 2), \
+         patch("lenny.core.api.OpenLibrary.search", side_effect=search):
+        assert LennyAPI.refresh_metadata(list(range(1, 7))) == 6
+
+    db_tables.expire_all()
+    assert all(Item.exists(olid).openlibrary_metadata for olid in range(1, 7))
+
+
+def test_search_document_flattens_metadata():
+    from lenny.core.models import Item
+
+    doc = Item.search_document(7, {
+        "title": "Moby Dick",
+        "work_key": "/works/OL1W",
+        "authors": [{"name": "Herman Melville", "key": "OL1A"}],
+        "subject": ["Whales"],
+        "isbn": ["9780000000001"],
+    })
+    assert doc == "moby dick herman melville whales 9780000000001 ol7m ol1w"
+
+
+def test_item_search_matches_all_terms_and_paginates(db_tables):
+    """Local search backend: every term must match; offset/limit page results."""
+    from lenny.core.models import Item
+
+    _indexed_item(db_tables, 1, {"title": "Moby Dick", "authors": [{"name": "Herman Melville"}]})
+    _indexed_item(db_tables, 2, {"title": "Bartleby", "authors": [{"name": "Herman Melville"}]})
+    _indexed_item(db_tables, 3, {"title": "Emma", "authors": [{"name": "Jane Austen"}]})
+
+    assert [i.openlibrary_edition for i in Item.search("melville")] == [1, 2]
+    assert [i.openlibrary_edition for i in Item.search("Melville moby")] == [1]
+    assert [i.openlibrary_edition for i in Item.search("melville", offset=1, limit=1)] == [2]
+    assert Item.search("tolstoy") == []
+
+
+def test_borrowable_map_reads_loan_counters(db_tables):
+    """Availability for a page of items needs no queries against loans."""
+    from sqlalchemy import event
+    from lenny.core.db import engine
+    from lenny.core.models import Item, FormatEnum
+
+    items = []
+    for olid, encrypted in ((1, True), (2, True), (3, False)):
+        item = Item(openlibrary_edition=olid, encrypted=encrypted, formats=FormatEnum.EPUB)
+        db_tables.add(item)
+        items.append(item)
+    db_tables.commit()
+    items[0].borrow("patron@example.com")
+    [(item.id, item.active_loans) for item in items]  # load state before counting
+
+    statements = []
+    counter = lambda *args: statements.append(args[2])
+    event.listen(engine, "before_cursor_execute", counter)
+    try:
+        result = Item.borrowable_map(items)
+    finally:
+        event.remove(engine, "before_cursor_execute", counter)
+
+    assert result == {1: False, 2: True, 3: False}
+    assert statements == []
+
+
+def test_search_feed_local_backend_skips_openlibrary():
+    """With SEARCH_BACKEND=local, results come from Item.search and local metadata."""
+    from lenny.core.api import LennyAPI
+
+    item = MagicMock()
+    item.openlibrary_edition = 1
+    with patch.object(LennyAPI, "SEARCH_BACKEND", "local"), \
+         patch("lenny.core.api.Item.search", return_value=[item]) as mock_search, \
+         patch("lenny.core.api.Item.borrowable_map", return_value={1: True}), \
+         patch("lenny.core.api.OpenLibrary.search") as mock_ol_search, \
+         patch("lenny.core.api.LennyDataProvider.empty_catalog", return_value={"links": []}), \
+         patch.object(LennyAPI, "_local_publication", return_value={"pub": 1}):
+        result = LennyAPI.search_feed(query="melville", limit=1, auth_mode_direct=False)
+
+    mock_search.assert_called_once_with("melville", offset=0, limit=1)
+    mock_ol_search.assert_not_called()
+    assert result["publications"] == [{"pub": 1}]
+    assert not LennyAPI.feed_degraded()
+    assert "query=melville&offset=1&limit=1" in result["links"][0]["href"]
+
+
+def test_opds_feed_serves_local_metadata_while_breaker_open():
+    """With Open Library failing fast, the feed is built from local metadata."""
+    from lenny.core.api import LennyAPI
+    from lenny.core.openlibrary import OpenLibrary
+
+    described = MagicMock(openlibrary_edition=1, openlibrary_metadata={"title": "Emma"})
+    missing = MagicMock(openlibrary_edition=2, openlibrary_metadata=None)
+
+    OpenLibrary.BREAKER.reset()
+    for _ in range(OpenLibrary.BREAKER.failure_threshold):
+        OpenLibrary.BREAKER.record_failure()
+    try:
+        with patch.object(LennyAPI, "get_items_page", return_value=([described, missing], {"next": None, "previous": None})), \
+             patch("lenny.core.api.LennyDataProvider.search") as mock_provider, \
+             patch("lenny.core.api.LennyDataProvider.empty_catalog", return_value={"links": []}), \
+             patch.object(LennyAPI, "_local_publication", side_effect=lambda i, **kw: {"olid": i.openlibrary_edition}):
+            result = LennyAPI.opds_feed(limit=2, local=False)
+    finally:
+        OpenLibrary.BREAKER.reset()
+
+    mock_provider.assert_not_called()
+    assert result["publications"] == [{"olid": 1}]
+    assert LennyAPI.feed_degraded()
+
+
+def test_search_feed_falls_back_to_local_metadata_when_provider_is_rejected():
+    """The provider re-query goes through the breaker like opds_feed's."""
+    from lenny.core.api import LennyAPI
+    from lenny.core.exceptions import CircuitOpenError
+    from lenny.core.openlibrary import OpenLibrary
+
+    item = MagicMock(openlibrary_edition=10, encrypted=False, openlibrary_metadata={"title": "Emma"}, metadata_updated_at=None)
+    with indexed_editions(10), \
+         patch("lenny.core.api.OpenLibrary.search", return_value=[MagicMock(olid="10")]), \
+         patch("lenny.core.api.Item.get_by_editions", return_value=[item]), \
+         patch("lenny.core.api.Item.borrowable_map", return_value={10: True}), \
+         patch.object(OpenLibrary.BREAKER, "track", side_effect=CircuitOpenError("open")), \
+         patch("lenny.core.api.LennyDataProvider.search") as mock_provider, \
+         patch("lenny.core.api.LennyDataProvider.empty_catalog", return_value={"metadata": {}, "links": []}), \
+         patch.object(LennyAPI, "_schedule_metadata_refresh"), \
+         patch.object(LennyAPI, "_local_publication", side_effect=lambda i, **kw: {"olid": i.openlibrary_edition}):
+        result = LennyAPI.search_feed(query="emma", limit=10, auth_mode_direct=False)
+
+    mock_provider.assert_not_called()
+    assert result["publications"] == [{"olid": 10}]
+    assert result["metadata"]["title"] == "Search results for: emma"
+    assert LennyAPI.feed_degraded()
+
+
+def test_shelf_feed_failure_counts_toward_breaker_and_falls_back():
+    from lenny.core.api import LennyAPI
+    from lenny.core.exceptions import CircuitOpenError
+    from lenny.core.openlibrary import OpenLibrary
+
+    described = MagicMock(openlibrary_edition=1, openlibrary_metadata={"title": "Emma"})
+    missing = MagicMock(openlibrary_edition=2, openlibrary_metadata=None)
+    loans = [MagicMock(item=i, openlibrary_edition=i.openlibrary_edition) for i in (described, missing)]
+
+    OpenLibrary.BREAKER.reset()
+    try:
+        with patch.object(LennyAPI, "get_borrowed_items", return_value=loans), \
+             patch("lenny.core.api.LennyDataProvider.search", side_effect=TimeoutError("slow")), \
+             patch("lenny.core.api.LennyDataProvider.get_shelf_feed", side_effect=lambda pubs: pubs), \
+             patch.object(LennyAPI, "_local_publication", side_effect=lambda i, **kw: {"olid": i.openlibrary_edition}):
+            with pytest.raises(TimeoutError):
+                LennyAPI.get_shelf_feed("a@example.com", local=False)
+            assert OpenLibrary.BREAKER.stats()["failures"] == 1
+
+            # Tripped by other requests between the is_open check and the call
+            with patch.object(OpenLibrary.BREAKER, "track", side_effect=CircuitOpenError("open")):
+                assert LennyAPI.get_shelf_feed("a@example.com", local=False) == [{"olid": 1}]
+    finally:
+        OpenLibrary.BREAKER.reset()
+
+
 # ---------------------------------------------------------------------------
 # Task 5 tests: /opds/search endpoint
 # ---------------------------------------------------------------------------
 
+def test_items_endpoint_fetches_card_fields(test_client):
+    """/items lists feed cards, so it asks Open Library for the card profile."""
+    from unittest.mock import AsyncMock
+
+    with patch("lenny.routes.api.LennyAPI.aget_enriched_page", new_callable=AsyncMock,
+               return_value=({}, {"next": None, "previous": None})) as mock_page, \
+         patch("lenny.routes.api.LennyAPI.aget_enriched_items", new_callable=AsyncMock, return_value={}) as mock_items:
+        assert test_client.get("/v1/api/items?fields=subject").status_code == 200
+        assert test_client.get("/v1/api/items?offset=0").status_code == 200
+
+    assert mock_page.call_args.kwargs["profile"] == "card"
+    assert mock_page.call_args.kwargs["fields"] == ["subject"]
+    assert mock_items.call_args.kwargs["profile"] == "card"
+
+
 def test_opds_search_endpoint_returns_opds_json(test_client):
     """Mock LennyAPI.search_feed, verify 200 + correct content-type + correct body."""
     mock_feed = {"metadata": {"title": "Search results"}, "publications": []}
@@ -257,8 +548,9 @@ def test_search_flow_end_to_end(test_client):
     mock_search_response = MagicMock()
     mock_search_response.records = [mock_lenny_record]
 
-    with patch("lenny.core.api.Item.get_all",
-               return_value={999: mock_item}), \
+    with indexed_editions(999), \
+         patch("lenny.core.api.Item.get_by_editions",
+               return_value=[mock_item]), \
          patch("lenny.core.api.OpenLibrary.search",
                return_value=[ol_record]) as mock_ol_search, \
          patch("lenny.core.api.LennyDataProvider.search",